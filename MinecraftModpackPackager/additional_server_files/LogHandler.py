@@ -1,12 +1,12 @@
 
 import os
 import time
-import queue
 import threading
+import collections
 import json
 
 class log_handler(object):
-	def __init__(self, log_folder=os.path.join(os.path.dirname(os.path.realpath(__file__)),'launcher_logs'), log_max_length=8192, buffer_flush_size=8, number_maxdigits=8):
+	def __init__(self, log_folder=os.path.join(os.path.dirname(os.path.realpath(__file__)),'launcher_logs'), log_max_length=8192, buffer_flush_size=512, number_maxdigits=8, flush_interval=1, max_pending=65536):
 		self.log_time = time.time()
 		self.log_time_str = time.strftime('%Y_%m_%d__%H_%M_%S', time.gmtime(self.log_time))
 		self.log_dir = os.path.join(log_folder, self.log_time_str)
@@ -15,16 +15,30 @@ class log_handler(object):
 		self.log_max_length = log_max_length
 		self.buffer_flush_size = buffer_flush_size
 		self.number_maxdigits = number_maxdigits
+		self.flush_interval = flush_interval
+		self.max_pending = max_pending
+		# producers append (unixtime, string, is_err) entries without taking a lock, and only the writer takes them off
+		self.log_queue = collections.deque()
+		# held while entries are written, by the writer thread, flush and the readers
 		self.log_queue_lock = threading.RLock()
-		self.log_queue = queue.Queue()
+		# the current .jsonl segment stays open between batches
+		self.log_fp = None
+		self.encoder = json.JSONEncoder()
+		self.wakeup_event = threading.Event()
+		self.space_event = threading.Event()
 		self.stop_event = threading.Event()
 		os.makedirs(self.log_dir)
 		self.auto_flush_async()
 	
+	def segment_fname(self, log_id, extension):
+		return os.path.join(self.log_dir, '{}.{}'.format(str(log_id).zfill(self.number_maxdigits), extension))
+	
 	def auto_flush(self):
+		# write the queued entries once buffer_flush_size of them are waiting, or every flush_interval seconds
 		while not self.stop_event.is_set():
+			self.wakeup_event.wait(timeout=self.flush_interval)
+			self.wakeup_event.clear()
 			self.flush()
-			time.sleep(1)
 	
 	def auto_flush_async(self):
 		self.auto_flush_thr = threading.Thread(target=self.auto_flush, daemon=True)
@@ -32,14 +46,19 @@ class log_handler(object):
 	
 	def stop(self):
 		self.stop_event.set()
+		self.wakeup_event.set()
 		self.auto_flush_thr.join(timeout=120)
 		self.flush()
 		with self.log_queue_lock:
-			self.translate_log(self.log_id)
+			if not self.log_fp is None:
+				self.log_fp.close()
+				self.log_fp = None
+			if os.path.isfile(self.segment_fname(self.log_id, 'jsonl')):
+				self.translate_log(self.log_id)
 	
 	def translate_log(self, log_id):
-		with open(os.path.join(self.log_dir, '{}.jsonl'.format(str(log_id).zfill(self.number_maxdigits))), 'r') as l_fp:
-			with open(os.path.join(self.log_dir, '{}.json'.format(str(log_id).zfill(self.number_maxdigits))), 'wb') as j_fp:
+		with open(self.segment_fname(log_id, 'jsonl'), 'r') as l_fp:
+			with open(self.segment_fname(log_id, 'json'), 'wb') as j_fp:
 				j_fp.write(b'[\r\n')
 				is_first = True
 				for l in l_fp:
@@ -51,27 +70,40 @@ class log_handler(object):
 				j_fp.write(b'\r\n]\r\n')
 
 	def flush(self):
+		# write every queued entry, in batches that each fit in the current segment
 		with self.log_queue_lock:
-			while not self.log_queue.empty():
-				prev_id = self.log_id
-				with open(os.path.join(self.log_dir, '{}.jsonl'.format(str(self.log_id).zfill(self.number_maxdigits))), 'ab') as fp:
-					while not self.log_queue.empty():
-						log_dat = self.log_queue.get()
-						log_json = json.dumps(log_dat).replace('\r\n','').replace('\n','')
-						fp.write(log_json.encode('utf-8'))
-						fp.write(b'\r\n')
-						self.log_length = self.log_length + 1
-						if self.log_length >= self.log_max_length:
-							self.log_id = self.log_id + 1
-							self.log_length = 0
-							break
-				if prev_id != self.log_id:
-					self.translate_log(prev_id)
+			while len(self.log_queue) > 0:
+				batch = []
+				room = self.log_max_length - self.log_length
+				while len(batch) < room and len(self.log_queue) > 0:
+					batch.append(self.log_queue.popleft())
+				# let producers waiting for room in the queue carry on
+				self.space_event.set()
+				self.write_batch(batch)
+			if not self.log_fp is None:
+				self.log_fp.flush()
+	
+	def write_batch(self, batch):
+		# encode a batch of entries in one go and append it to the current segment, rolling over to a new segment once it is full
+		if self.log_fp is None:
+			self.log_fp = open(self.segment_fname(self.log_id, 'jsonl'), 'ab')
+		encode = self.encoder.encode
+		# json never leaves raw line breaks in its output, so every entry stays on one line
+		self.log_fp.write(''.join([encode(self.parse_str(string, is_err=is_err, unixtime=unixtime)) + '\r\n' for unixtime, string, is_err in batch]).encode('utf-8'))
+		self.log_length = self.log_length + len(batch)
+		if self.log_length >= self.log_max_length:
+			self.log_fp.close()
+			self.log_fp = None
+			prev_id = self.log_id
+			self.log_id = self.log_id + 1
+			self.log_length = 0
+			self.translate_log(prev_id)
 	
 	def load_lognum(self, num, rng=None):
-		jsonl_fname = os.path.join(self.log_dir, '{}.jsonl'.format(str(num).zfill(self.number_maxdigits)))
-		json_fname = os.path.join(self.log_dir, '{}.json'.format(str(num).zfill(self.number_maxdigits)))
-		if num >= self.log_id and not os.path.isfile(jsonl_fname):
+		jsonl_fname = self.segment_fname(num, 'jsonl')
+		json_fname = self.segment_fname(num, 'json')
+		if num >= self.log_id:
+			# the current segment may still have entries queued or buffered
 			self.flush()
 		if os.path.isfile(json_fname):
 			print(rng)
@@ -113,12 +145,26 @@ class log_handler(object):
 			return ret
 	
 	def add_str(self, string, is_err=False):
-		self.log_queue.put(self.parse_str(string, is_err=is_err))
-		if self.log_queue.qsize() >= self.buffer_flush_size:
+		# constant time and lock-free; the entry is parsed, encoded and written by the writer thread
+		if len(self.log_queue) >= self.max_pending:
+			self.wait_for_space()
+		self.log_queue.append((time.time(), string, is_err))
+		if len(self.log_queue)==self.buffer_flush_size:
+			self.wakeup_event.set()
+		if self.stop_event.is_set():
+			# there is no writer thread any more, so write it straight away
 			self.flush()
 	
-	def parse_str(self, string, is_err=False):
-		unixtime = time.time()
+	def wait_for_space(self):
+		# memory is bounded: wait for the writer to take entries off a full queue
+		while len(self.log_queue) >= self.max_pending and self.auto_flush_thr.is_alive():
+			self.space_event.clear()
+			self.wakeup_event.set()
+			self.space_event.wait(timeout=0.1)
+	
+	def parse_str(self, string, is_err=False, unixtime=None):
+		if unixtime is None:
+			unixtime = time.time()
 		parts = string.split(': ',1)
 		if len(parts)>=2:
 			head, body = parts
@@ -2,38 +2,394 @@
 
 #TODO: add graphical logger UI
 
+import io
 import os
 import sys
 import time
+import queue
+import struct
+import tempfile
+import selectors
+import collections
 import subprocess
 import threading
-import queue
 
 import settings
 import setup
 import LogHandler
 
-def fp_to_line_queue(fp, thread_name=None):
-	def fp_reader(fp, out_queue):
+# use selectors to wait on the server's pipes, the user's input and the wakeup pipe together
+# Windows can only select on sockets, so it falls back to reader threads feeding a single blocking queue
+USE_SELECTORS = os.name!='nt'
+READ_SIZE = 65536
+
+# what happens to server output once output_buffer_lines lines are waiting to be logged (see output_pipeline)
+OVERFLOW_POLICIES = ['spill', 'drop', 'coalesce']
+DEFAULT_OUTPUT_BUFFER_LINES = 4096
+DEFAULT_OUTPUT_OVERFLOW_POLICY = 'spill'
+# how often (in seconds) the state of the output pipeline is reported while the server writes output, or None to only report it when the server exits
+DEFAULT_OUTPUT_REPORT_INTERVAL = 300
+# spilled lines are stored as (source, length) headers followed by the line, and read back this many at a time
+SPILL_RECORD = struct.Struct('<BI')
+SPILL_READ_LINES = 256
+OUTPUT_SOURCES = ['out', 'err']
+
+class line_splitter(object):
+	def __init__(self):
+		self.partial = b''
+	
+	def feed(self, data):
+		# return the complete lines (with their line endings) in newly read data, keeping an incomplete last line for the next call
+		# empty data means the end of the stream, so the incomplete line (if any) is returned as-is
+		if data==b'':
+			rest = self.partial
+			self.partial = b''
+			return [rest] if rest!=b'' else []
+		lines = (self.partial + data).split(b'\n')
+		self.partial = lines.pop()
+		return [line + b'\n' for line in lines]
+
+def print_line(line):
+	# print a line in a single write, so it is not split by output the consumer thread is printing at the same time
+	sys.stdout.write(line + '\n')
+
+class output_pipeline(object):
+	# hands the server's output from the I/O loop to a consumer thread that prints and logs it
+	# put never waits for the consumer, so a slow logger can never stop the server's pipes from being drained
+	# once max_lines lines are waiting, further lines are:
+	#   spill: written to a temporary file, and read back in order once the consumer catches up (nothing is lost)
+	#   drop: dropped and counted
+	#   coalesce: appended to the last waiting line of the same stream (up to coalesce_max_bytes), so a burst is logged as fewer entries, and dropped beyond that
+	# while lines keep coming, the summary is passed to report every report_interval seconds, and straight away once lines start to overflow
+	def __init__(self, handle, max_lines=DEFAULT_OUTPUT_BUFFER_LINES, policy=DEFAULT_OUTPUT_OVERFLOW_POLICY, coalesce_max_bytes=65536, report=None, report_interval=DEFAULT_OUTPUT_REPORT_INTERVAL):
+		if not policy in OVERFLOW_POLICIES:
+			raise Exception('Unknown output overflow policy "{policy}"! Expected one of {policies}'.format(policy=policy, policies=', '.join(OVERFLOW_POLICIES)))
+		self.handle = handle
+		self.max_lines = max_lines
+		self.policy = policy
+		self.coalesce_max_bytes = coalesce_max_bytes
+		self.cond = threading.Condition()
+		self.buffer = collections.deque()
+		self.spill_fp = None
+		self.spill_read_pos = 0
+		self.spill_write_pos = 0
+		self.spill_pending = 0
+		self.closed = False
+		# counters reported by summary
+		self.lines = 0
+		self.max_depth = 0
+		self.spilled = 0
+		self.coalesced = 0
+		self.dropped = 0
+		self.report = report
+		if self.report is None:
+			self.report = print_line
+		self.report_interval = report_interval
+		# set once lines start to overflow, so the monitor reports it without waiting for the interval
+		self.overflow_event = threading.Event()
+		self.monitor_stop_event = threading.Event()
+		self.consumer_thr = threading.Thread(target=self.consume, daemon=True, name='output_pipeline')
+		self.consumer_thr.start()
+		self.monitor_thr = None
+		if not self.report_interval is None:
+			self.monitor_thr = threading.Thread(target=self.monitor, daemon=True, name='output_pipeline_monitor')
+			self.monitor_thr.start()
+	
+	def put(self, source, line):
+		# called by the I/O loop for every line of output
+		with self.cond:
+			self.lines = self.lines + 1
+			if self.spill_pending==0 and len(self.buffer) < self.max_lines:
+				self.buffer.append((source, line))
+				self.max_depth = max(self.max_depth, len(self.buffer))
+				self.cond.notify()
+			else:
+				if self.policy=='spill':
+					self.spill(source, line)
+				elif self.policy=='coalesce' and len(self.buffer) > 0 and self.buffer[-1][0]==source and len(self.buffer[-1][1]) + len(line) <= self.coalesce_max_bytes:
+					self.buffer[-1] = (source, self.buffer[-1][1] + line)
+					self.coalesced = self.coalesced + 1
+				else:
+					self.dropped = self.dropped + 1
+				if not self.overflow_event.is_set():
+					self.overflow_event.set()
+	
+	def spill(self, source, line):
+		# append a line to the spill file (called with the lock held)
+		if self.spill_fp is None:
+			self.spill_fp = tempfile.TemporaryFile()
+		self.spill_fp.seek(self.spill_write_pos)
+		self.spill_fp.write(SPILL_RECORD.pack(OUTPUT_SOURCES.index(source), len(line)))
+		self.spill_fp.write(line)
+		self.spill_write_pos = self.spill_fp.tell()
+		self.spill_pending = self.spill_pending + 1
+		self.spilled = self.spilled + 1
+		self.cond.notify()
+	
+	def unspill(self):
+		# read the oldest spilled lines back (called with the lock held)
+		self.spill_fp.seek(self.spill_read_pos)
+		batch = []
+		while len(batch) < SPILL_READ_LINES and self.spill_pending > 0:
+			source_index, size = SPILL_RECORD.unpack(self.spill_fp.read(SPILL_RECORD.size))
+			batch.append((OUTPUT_SOURCES[source_index], self.spill_fp.read(size)))
+			self.spill_pending = self.spill_pending - 1
+		self.spill_read_pos = self.spill_fp.tell()
+		if self.spill_pending==0:
+			# everything spilled has been read back, so the file can start over
+			self.spill_fp.seek(0)
+			self.spill_fp.truncate()
+			self.spill_read_pos = 0
+			self.spill_write_pos = 0
+		return batch
+	
+	def consume(self):
+		while True:
+			with self.cond:
+				while len(self.buffer)==0 and self.spill_pending==0 and not self.closed:
+					self.cond.wait()
+				if len(self.buffer) > 0:
+					# everything in the buffer came before anything in the spill file
+					batch = list(self.buffer)
+					self.buffer.clear()
+				elif self.spill_pending > 0:
+					batch = self.unspill()
+				else:
+					# closed, and everything has been handled
+					return
+			for source, line in batch:
+				self.handle(source, line)
+	
+	def monitor(self):
+		# report the summary while the server runs, at most once every report_interval seconds
+		reported_lines = 0
+		reported_overflow = (0, 0, 0)
+		while True:
+			# wait for lines to start overflowing, or for the next interval
+			self.overflow_event.wait(timeout=self.report_interval)
+			if self.monitor_stop_event.is_set():
+				return
+			with self.cond:
+				self.overflow_event.clear()
+				lines = self.lines
+				overflow = (self.spilled, self.coalesced, self.dropped)
+			if lines==reported_lines and overflow==reported_overflow:
+				# no output since the last report
+				continue
+			self.report(self.summary())
+			reported_lines = lines
+			reported_overflow = overflow
+			# a long burst is reported once per interval, not every time another line overflows
+			if self.monitor_stop_event.wait(timeout=self.report_interval):
+				return
+	
+	def depth(self):
+		# the number of lines waiting to be handled
+		with self.cond:
+			return len(self.buffer) + self.spill_pending
+	
+	def close(self):
+		# wait for every line to be handled
+		with self.cond:
+			self.closed = True
+			self.cond.notify()
+		self.consumer_thr.join()
+		if not self.monitor_thr is None:
+			self.monitor_stop_event.set()
+			self.overflow_event.set()
+			self.monitor_thr.join()
+		if not self.spill_fp is None:
+			self.spill_fp.close()
+			self.spill_fp = None
+	
+	def summary(self):
+		return 'Server output: {lines} lines, {depth} waiting to be logged (at most {max_depth} of {max_lines}), {spilled} spilled to disk, {coalesced} coalesced, {dropped} dropped'.format(
+			lines=self.lines, 
+			depth=self.depth(), 
+			max_depth=self.max_depth, 
+			max_lines=self.max_lines, 
+			spilled=self.spilled, 
+			coalesced=self.coalesced, 
+			dropped=self.dropped, 
+		)
+
+def fp_to_event_queue(fp, source, event_queue, thread_name=None):
+	def fp_reader(fp, source, event_queue):
 		for line in fp:
-			out_queue.put(line)
-	out_queue = queue.Queue(maxsize=256)
-	read_thread = threading.Thread(target=fp_reader, args=(fp, out_queue), daemon=True, name=thread_name)
+			event_queue.put((source, line))
+		# None marks the end of the stream
+		event_queue.put((source, None))
+	read_thread = threading.Thread(target=fp_reader, args=(fp, source, event_queue), daemon=True, name=thread_name)
 	read_thread.start()
-	return out_queue, read_thread
+	return read_thread
+
+def stdin_fd():
+	# the file descriptor of the user's input, or None if there is none
+	try:
+		return sys.stdin.fileno()
+	except (AttributeError, ValueError, io.UnsupportedOperation):
+		return None
+
+def is_selectable(fd):
+	# regular files and /dev/null are always ready to read, so selectors refuse them
+	try:
+		with selectors.DefaultSelector() as sel:
+			sel.register(fd, selectors.EVENT_READ)
+		return True
+	except (OSError, ValueError):
+		return False
 
 class server_starter(object):
 	def __init__(self, server_settings=settings.server_settings, run_dir=os.path.dirname(os.path.realpath(__file__)), log_handler=None):
 		self.server_settings = server_settings
 		self.run_dir = run_dir
-		self.in_queue = None
-		self.in_q_thr = None
 		self.stop_event = threading.Event()
 		self.running_server_event = threading.Event()
 		self.processing_input_event = threading.Event()
 		self.log_handler = log_handler
 		if self.log_handler is None:
 			self.log_handler = LogHandler.log_handler()
+		if USE_SELECTORS:
+			# input sent by other threads (e.g. stop) waits here, and a byte on the wakeup pipe tells the I/O loop about it
+			self.input_lock = threading.Lock()
+			self.pending_input = []
+			self.wakeup_r, self.wakeup_w = os.pipe()
+			os.set_blocking(self.wakeup_r, False)
+			os.set_blocking(self.wakeup_w, False)
+			self.stdin_fd = stdin_fd()
+			self.stdin_splitter = line_splitter()
+			if not self.stdin_fd is None and not is_selectable(self.stdin_fd):
+				# input that cannot be selected on is passed on by a reader thread instead
+				self.stdin_fd = None
+				threading.Thread(target=self.forward_input, args=(sys.stdin,), daemon=True).start()
+		else:
+			# every line of output and input arrives on this queue as a (source, line) tuple
+			self.event_queue = queue.Queue(maxsize=256)
+			self.in_q_thr = None
+	
+	def send_input(self, line):
+		# send a line of input (e.g. "stop\n") to the server process from any thread
+		if USE_SELECTORS:
+			with self.input_lock:
+				self.pending_input.append(line.encode('utf-8'))
+			try:
+				os.write(self.wakeup_w, b'\0')
+			except BlockingIOError:
+				# the pipe is full, so the I/O loop is already due to wake up
+				pass
+		else:
+			self.event_queue.put(('in', line.encode('utf-8')))
+	
+	def forward_input(self, fp):
+		for line in fp:
+			self.send_input(line)
+	
+	def take_pending_input(self):
+		# the lines sent with send_input since the last call
+		with self.input_lock:
+			lines = self.pending_input
+			self.pending_input = []
+		return lines
+	
+	def log_output(self, source, line):
+		# runs on the consumer thread of the output pipeline
+		if source=='out':
+			# log a stdout line
+			out = line.decode('utf-8', 'replace')
+			sys.stdout.write(out)
+			self.log_handler.add_str(out)
+		else:
+			# log a stderr line as an error
+			err = line.decode('utf-8', 'replace')
+			sys.stderr.write(err)
+			self.log_handler.add_str(err, is_err=True)
+	
+	def handle_line(self, proc, source, line):
+		if source in OUTPUT_SOURCES:
+			# hand output to the pipeline, so logging it never holds up reading the pipes
+			self.output.put(source, line)
+		else:
+			# send an input line to the server process
+			try:
+				proc.stdin.write(line)
+				proc.stdin.flush()
+			except (BrokenPipeError, OSError):
+				# the server is already exiting, so there is nobody to send it to
+				pass
+	
+	def discard_input(self):
+		# drop anything typed (or sent) while the server was not running
+		if USE_SELECTORS:
+			self.take_pending_input()
+			if not self.stdin_fd is None:
+				with selectors.DefaultSelector() as sel:
+					sel.register(self.stdin_fd, selectors.EVENT_READ)
+					while len(sel.select(timeout=0)) > 0:
+						if os.read(self.stdin_fd, READ_SIZE)==b'':
+							# the user's input is closed for good
+							self.stdin_fd = None
+							break
+			self.stdin_splitter = line_splitter()
+		else:
+			# output of the previous run has all been handled, so only input can be left on the queue
+			while not self.event_queue.empty():
+				try:
+					self.event_queue.get_nowait()
+				except queue.Empty:
+					pass
+	
+	def process_io_selectors(self, proc):
+		# block until the server writes output, the user types a line, or another thread sends input, and handle it straight away
+		splitters = {'out':line_splitter(), 'err':line_splitter(), 'in':self.stdin_splitter}
+		with selectors.DefaultSelector() as sel:
+			sel.register(proc.stdout.fileno(), selectors.EVENT_READ, 'out')
+			sel.register(proc.stderr.fileno(), selectors.EVENT_READ, 'err')
+			sel.register(self.wakeup_r, selectors.EVENT_READ, 'wakeup')
+			if not self.stdin_fd is None:
+				sel.register(self.stdin_fd, selectors.EVENT_READ, 'in')
+			# loop until both output streams are closed (the server exited)
+			open_outputs = 2
+			while open_outputs > 0:
+				for key, _ in sel.select():
+					source = key.data
+					if source=='wakeup':
+						# clear the wakeup pipe and send the input waiting for the server
+						try:
+							os.read(self.wakeup_r, READ_SIZE)
+						except BlockingIOError:
+							pass
+						for line in self.take_pending_input():
+							self.handle_line(proc, 'in', line)
+						continue
+					data = os.read(key.fd, READ_SIZE)
+					if data==b'':
+						# end of the stream
+						sel.unregister(key.fd)
+						if source=='in':
+							self.stdin_fd = None
+						else:
+							open_outputs = open_outputs - 1
+					for line in splitters[source].feed(data):
+						self.handle_line(proc, source, line)
+	
+	def process_io_threads(self, proc):
+		# reader threads put every line on the event queue, and this thread blocks on it until one arrives
+		fp_to_event_queue(proc.stdout, 'out', self.event_queue)
+		fp_to_event_queue(proc.stderr, 'err', self.event_queue)
+		# if input not being captured, start reading it (the reader keeps running across restarts)
+		if self.in_q_thr is None:
+			self.in_q_thr = fp_to_event_queue(sys.stdin, 'in_text', self.event_queue)
+		# loop until both output streams are closed (the server exited)
+		open_outputs = 2
+		while open_outputs > 0:
+			source, line = self.event_queue.get()
+			if line is None:
+				if source!='in_text':
+					open_outputs = open_outputs - 1
+			elif source=='in_text':
+				self.handle_line(proc, 'in', line.encode('utf-8'))
+			else:
+				self.handle_line(proc, source, line)
 	
 	def run_server(self):
 		# set state event to indicate server is running
@@ -46,52 +402,28 @@ class server_starter(object):
 			stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE, 
 			cwd=self.run_dir, 
 		)
-		# generate queues to handle the output and stderr of the program
-		out_queue, out_q_thr = fp_to_line_queue(proc.stdout)
-		err_queue, err_q_thr = fp_to_line_queue(proc.stderr)
-		# if input not being captured, generate queue to handle user input
-		if self.in_queue is None:
-			self.in_queue, self.in_q_thr = fp_to_line_queue(sys.stdin)
-		# clear the user input queue
-		while not self.in_queue.empty():
-			try:
-				self.in_queue.get_nowait()
-			except queue.Empty:
-				pass
-		# set state event to indicate input queue is being processed
+		# clear the user input
+		self.discard_input()
+		# set state event to indicate input is being processed
 		self.processing_input_event.set()
-		# loop until process exits and both output queues are complete
-		while proc.poll() is None or out_q_thr.is_alive() or err_q_thr.is_alive() or not out_queue.empty() or not err_queue.empty():
-			out_empty = False
-			err_empty = False
-			in_empty = False
-			try:
-				# get a stdout line and log it
-				out = out_queue.get_nowait().decode('utf-8')
-				sys.stdout.write(out)
-				self.log_handler.add_str(out)
-			except queue.Empty:
-				# if stdout queue is empty, mark that down
-				out_empty = True
-			try:
-				# get a stderr line and log it as an error
-				err = err_queue.get_nowait().decode('utf-8')
-				sys.stderr.write(err)
-				self.log_handler.add_str(err, is_err=True)
-			except queue.Empty:
-				# if stderr queue is empty, mark that down
-				err_empty = True
-			try:
-				# get a stdin line and send it to the server process
-				line = self.in_queue.get_nowait().encode('utf-8')
-				proc.stdin.write(line)
-				proc.stdin.flush()
-			except queue.Empty:
-				# if stdin queue is empty, mark that down
-				in_empty = True
-			# if all queues are empty, delay for a little bit to let the buffer fill back up
-			if out_empty and err_empty and in_empty:
-				time.sleep(0.005)
+		# start the pipeline that logs the output, with the backpressure policy from the settings
+		self.output = output_pipeline(
+			self.log_output, 
+			max_lines=getattr(self.server_settings, 'output_buffer_lines', DEFAULT_OUTPUT_BUFFER_LINES), 
+			policy=getattr(self.server_settings, 'output_overflow_policy', DEFAULT_OUTPUT_OVERFLOW_POLICY), 
+			report_interval=getattr(self.server_settings, 'output_report_interval', DEFAULT_OUTPUT_REPORT_INTERVAL), 
+		)
+		# handle output and input until the server exits
+		try:
+			if USE_SELECTORS:
+				self.process_io_selectors(proc)
+			else:
+				self.process_io_threads(proc)
+		finally:
+			# wait for the remaining output to be logged
+			self.output.close()
+		proc.wait()
+		print(self.output.summary())
 		# clear state events to indicate server is no longer running
 		self.processing_input_event.clear()
 		self.running_server_event.clear()
@@ -144,7 +476,7 @@ class server_starter(object):
 			# check that input is definitely still being processed before sending it
 			if self.processing_input_event.is_set():
 				#send stop command to the server
-				self.in_queue.put('stop\n')
+				self.send_input('stop\n')
 
 def main(log_handler=None):
 	server_starter(server_settings=settings.server_settings, log_handler=log_handler).run()
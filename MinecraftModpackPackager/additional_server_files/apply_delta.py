@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# applies a delta archive created by the packager (see MinecraftModpackPackager/delta_package.py) to this server
+# kept free of dependencies on the packager and on pip packages, so it can run on any server
+
+import os
+import sys
+import json
+import shutil
+import zipfile
+import hashlib
+import argparse
+
+DELTA_FORMAT = 1
+MANIFEST_NAME = 'delta_manifest.json'
+FILES_DIR = 'files'
+
+def hash_file(filename, chunk_size=1024*1024):
+	"""calculates the sha256 hash of a file, or returns None if it does not exist"""
+	if not os.path.isfile(filename):
+		return None
+	file_hash = hashlib.sha256()
+	with open(filename, 'rb') as fp:
+		for chunk in iter(lambda: fp.read(chunk_size), b''):
+			file_hash.update(chunk)
+	return file_hash.hexdigest()
+
+def read_manifest(delta_archive):
+	"""read the manifest of a delta archive"""
+	with zipfile.ZipFile(delta_archive, 'r') as zf:
+		manifest = json.loads(zf.read(MANIFEST_NAME).decode('utf-8'))
+	if manifest.get('format')!=DELTA_FORMAT:
+		raise Exception('Delta archive "{}" has unsupported format {}!'.format(delta_archive, manifest.get('format')))
+	return manifest
+
+def check_delta(manifest, target_dir):
+	"""
+	returns a list of the files in target_dir that were modified since the version the delta was created from
+	files that already hold the new contents are fine, so a partly applied delta can be applied again
+	"""
+	conflicts = []
+	for name, info in manifest['changed'].items():
+		if not hash_file(os.path.join(target_dir, *name.split('/'))) in [info['from_sha256'], info['sha256']]:
+			conflicts.append(name)
+	for name, info in manifest['removed'].items():
+		if not hash_file(os.path.join(target_dir, *name.split('/'))) in [info['sha256'], None]:
+			conflicts.append(name)
+	for name, info in manifest['added'].items():
+		if not hash_file(os.path.join(target_dir, *name.split('/'))) in [info['sha256'], None]:
+			conflicts.append(name)
+	return sorted(conflicts)
+
+def apply_delta(delta_archive, target_dir=os.path.dirname(os.path.realpath(__file__)), force=False):
+	"""
+	bring the server in target_dir up to the version a delta archive was created for
+	every file is checked before anything is modified, and new files are verified before they are moved into place
+	"""
+	manifest = read_manifest(delta_archive)
+	conflicts = check_delta(manifest, target_dir)
+	if len(conflicts) > 0:
+		if not force:
+			raise Exception('Cannot apply delta "{delta}": {count} files in "{target}" were modified since version {version} (e.g. "{example}")!'.format(delta=delta_archive, count=len(conflicts), target=target_dir, version=manifest['from_version'], example=conflicts[0]))
+		print('WARNING: Overwriting {} modified files!'.format(len(conflicts)))
+	staging_dir = os.path.join(target_dir, '.delta_staging')
+	if os.path.isdir(staging_dir):
+		shutil.rmtree(staging_dir)
+	updates = dict(manifest['added'])
+	updates.update(manifest['changed'])
+	with zipfile.ZipFile(delta_archive, 'r') as zf:
+		for name in sorted(updates):
+			staged = os.path.join(staging_dir, *name.split('/'))
+			if not os.path.isdir(os.path.dirname(staged)):
+				os.makedirs(os.path.dirname(staged))
+			with zf.open('{}/{}'.format(FILES_DIR, name)) as src_fp:
+				with open(staged, 'wb') as dest_fp:
+					shutil.copyfileobj(src_fp, dest_fp, 1024*1024)
+			if hash_file(staged)!=updates[name]['sha256']:
+				raise Exception('File "{}" in delta archive is corrupt!'.format(name))
+	for name in manifest['added_dirs']:
+		path = os.path.join(target_dir, *name.split('/'))
+		if not os.path.isdir(path):
+			os.makedirs(path)
+	for name in sorted(updates):
+		dest = os.path.join(target_dir, *name.split('/'))
+		if not os.path.isdir(os.path.dirname(dest)):
+			os.makedirs(os.path.dirname(dest))
+		os.replace(os.path.join(staging_dir, *name.split('/')), dest)
+	for name in manifest['removed']:
+		path = os.path.join(target_dir, *name.split('/'))
+		if os.path.isfile(path):
+			os.remove(path)
+	for name in manifest['removed_dirs']:
+		path = os.path.join(target_dir, *name.split('/'))
+		if os.path.isdir(path) and len(os.listdir(path))==0:
+			os.rmdir(path)
+	shutil.rmtree(staging_dir)
+	return manifest
+
+if __name__=="__main__":
+	parser = argparse.ArgumentParser(description='Update this server to a new modpack version with a delta archive.  Stop the server before applying it.')
+	parser.add_argument('delta_archive', help='Filename of the delta archive to apply.')
+	parser.add_argument('-d', '--target_dir', dest='target_dir', default=os.path.dirname(os.path.realpath(__file__)), help='Server directory to update.  Defaults to the directory this script is in.')
+	parser.add_argument('-f', '--force', dest='force', default=False, action='store_true', help='Apply the delta even if files in the server directory were modified since the previous version.')
+	args = parser.parse_args()
+	try:
+		manifest = apply_delta(args.delta_archive, target_dir=args.target_dir, force=args.force)
+	except Exception as e:
+		print('ERROR: {}'.format(e))
+		sys.exit(1)
+	print('Updated "{target}" from version {old} to version {new}.'.format(target=args.target_dir, old=manifest['from_version'], new=manifest['to_version']))
@@ -21,6 +21,13 @@ server_settings_dict = {
 	"javacmd":"java", 
 	"max_ram":"2048M",        # -Xmx
 	"java_parameters":["-XX:+UseParNewGC", "-XX:+CMSIncrementalPacing", "-XX:+CMSClassUnloadingEnabled", "-XX:ParallelGCThreads=5", "-XX:MinHeapFreeRatio=5", "-XX:MaxHeapFreeRatio=10"], 
+
+	###################################################
+	# Server output the logger cannot keep up with (e.g. during chunk generation or crash spam)
+
+	"output_buffer_lines":4096,        # lines waiting to be logged before the overflow policy applies
+	"output_overflow_policy":"spill",  # "spill" to a temporary file, "drop" the lines, or "coalesce" them into fewer log entries
+	"output_report_interval":300,      # seconds between reports of the lines waiting, spilled and dropped while the server runs (None to only report when it exits)
 }
 
 server_settings = SimpleNamespace(**server_settings_dict)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import traceback
+
+from MinecraftModpackPackager import package_modpack
+from MinecraftModpackPackager import task_graph
+from MinecraftModpackPackager import copy_backend
+from MinecraftModpackPackager import progress
+
+def load_jobs(batch_fname):
+	"""
+	load the list of jobs in a batch file
+	the file is either a JSON list, or a JSONL file with one job per line
+	every job is a dict in the format of the client info JSON file (see "client_loc_info.json")
+	"""
+	with open(batch_fname, 'r') as fp:
+		contents = fp.read()
+	if batch_fname.lower().endswith('.jsonl'):
+		return [json.loads(line) for line in contents.splitlines() if line.strip()!='']
+	jobs = json.loads(contents)
+	if not isinstance(jobs, list):
+		raise Exception('Batch file "{}" does not contain a list of jobs!'.format(batch_fname))
+	return jobs
+
+class batch_packager(object):
+	"""
+	packages several modpacks (or several versions of one) in a single process
+		the steps of every job are run on one shared task_graph, so workers threads are shared between all the jobs
+		jobs share the forge cache, the in-memory file hash memo, and the pooled downloader, so each forge version is only checked and hashed once
+		a job that fails does not stop the others; only its own remaining steps are skipped
+		jobs that would write to the same temporary directory or build cache run one after another
+		a summary of the result of every job is written to summary_fname
+	"""
+	def __init__(self, batch_fname, summary_fname=None, workers=4, packager_settings={}):
+		self.batch_fname = batch_fname
+		self.summary_fname = summary_fname
+		if self.summary_fname is None:
+			self.summary_fname = os.path.splitext(self.batch_fname)[0] + '_results.json'
+		self.workers = workers
+		self.packager_settings = packager_settings
+		self.jobs = load_jobs(self.batch_fname)
+		self.results = []
+
+	def create_packager(self, index, job):
+		"""create the packager for a job, with the settings of the job on top of the settings shared by every job"""
+		progress.message('Preparing batch job {index} of {count}...'.format(index=index+1, count=len(self.jobs)))
+		settings = dict(self.packager_settings)
+		if 'client_info_fname' in job:
+			settings['client_info_fname'] = job['client_info_fname']
+		settings['client_info'] = job
+		return package_modpack.modpack_packager(**settings)
+
+	def conflict_keys(self, packager):
+		"""the shared directories a job writes to, which no other job may use at the same time"""
+		keys = [('temp', packager.modpack_name, packager.modpack_version)]
+		if packager.use_build_cache:
+			keys.append(('build_cache', os.path.abspath(packager.build_cache_dir_native), packager.modpack_name))
+		return keys
+
+	def job_result(self, index, packager, graph=None, steps=[], error=None):
+		"""summarize the outcome of a job"""
+		result = {
+			'job':index,
+			'modpack_name':None,
+			'modpack_version':None,
+			'status':'done',
+			'error':None,
+			'failed_step':None,
+			'steps':{},
+			'packages':[],
+		}
+		if not packager is None:
+			result['modpack_name'] = packager.modpack_name
+			result['modpack_version'] = packager.modpack_version
+		if not error is None:
+			result['status'] = 'failed'
+			result['error'] = error
+			return result
+		prefix = '{}/'.format(index)
+		for name in steps:
+			step = graph.tasks[name]
+			status = graph.status(name)
+			result['steps'][name[len(prefix):]] = {
+				'status':status,
+				'duration':None if step.end_time is None else round(step.duration(), 3),
+			}
+			if status=='failed' and result['status']=='done':
+				result['status'] = 'failed'
+				result['failed_step'] = name[len(prefix):]
+				result['error'] = ''.join(traceback.format_exception_only(type(graph.errors[name]), graph.errors[name])).strip()
+		for fname in [packager.package_client_zip_path, packager.package_server_zip_path]:
+			if os.path.isfile(fname):
+				result['packages'].append(fname)
+		return result
+
+	def run(self):
+		"""run every job in the batch, then write the summary; returns whether every job succeeded"""
+		graph = task_graph.task_graph(workers=self.workers)
+		job_steps = {}
+		last_step_by_key = {}
+		errors = {}
+		for index, job in enumerate(self.jobs):
+			packager = None
+			try:
+				packager = self.create_packager(index, job)
+				packager.calculate_initial_paths()
+				packager.load_minecraftinstance()
+				packager.calculate_paths()
+			except Exception as e:
+				errors[index] = (packager, ''.join(traceback.format_exception_only(type(e), e)).strip())
+				progress.error('Batch job {index} failed: {error}'.format(index=index+1, error=errors[index][1]))
+				continue
+			keys = self.conflict_keys(packager)
+			after = [last_step_by_key[key] for key in keys if key in last_step_by_key]
+			steps = packager.add_tasks(graph, prefix='{}/'.format(index), after=after, prepared=True)
+			for key in keys:
+				last_step_by_key[key] = steps[-1]
+			job_steps[index] = (packager, steps)
+		start_time = time.time()
+		graph.run(keep_going=True)
+		self.results = []
+		for index in range(len(self.jobs)):
+			if index in errors:
+				packager, error = errors[index]
+				self.results.append(self.job_result(index, packager, error=error))
+			else:
+				packager, steps = job_steps[index]
+				result = self.job_result(index, packager, graph=graph, steps=steps)
+				if result['status']=='failed':
+					progress.error('Batch job {index} failed in step "{step}": {error}'.format(index=index+1, step=result['failed_step'], error=result['error']))
+				self.results.append(result)
+		summary = {
+			'batch_fname':os.path.abspath(self.batch_fname),
+			'duration':round(time.time() - start_time, 3),
+			'jobs':self.results,
+		}
+		with open(self.summary_fname, 'w') as fp:
+			json.dump(summary, fp, indent=2)
+		progress.message("Files copied by strategy: {}".format(copy_backend.default_backend.report()))
+		progress.message(graph.report())
+		failed = [result for result in self.results if result['status']!='done']
+		progress.message('Batch complete: {done} of {count} jobs succeeded.  Summary written to "{summary_fname}".'.format(done=len(self.results)-len(failed), count=len(self.results), summary_fname=self.summary_fname))
+		return len(failed)==0
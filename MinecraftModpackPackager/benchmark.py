@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+
+from MinecraftModpackPackager import file_ops
+from MinecraftModpackPackager import package_modpack
+from MinecraftModpackPackager import minecraft_instance
+from MinecraftModpackPackager import client_manifest
+
+MINECRAFT_VERSION = '1.12.2'
+FORGE_VERSION = '1.12.2-14.23.5.2847'
+LAUNCHWRAPPER_VERSION = '1.12'
+
+def synthetic_instance(addon_count, seed=0):
+	"""a minecraft_instance with addon_count made-up addons"""
+	rand = random.Random(seed)
+	addons = []
+	for index in range(addon_count):
+		extension = rand.choice(['.jar', '.jar', '.jar', '.zip'])
+		addons.append(minecraft_instance.addon(
+			rand.randint(10000, 999999),
+			rand.randint(1000000, 9999999),
+			'SyntheticMod{index}-1.12.2-{version}{extension}'.format(index=index, version=rand.randint(1, 99), extension=extension),
+			'SyntheticMod{index}{extension}'.format(index=index, extension=extension),
+		))
+	return minecraft_instance.minecraft_instance('Synthetic', 'benchmark', '1.12.2', 'forge-14.23.5.2847', 'forge-1.12.2-14.23.5.2847.jar', addons=addons)
+
+def synthetic_version_json(library_count, seed=0):
+	"""the "versionJson" of forge in minecraftinstance.json, with library_count made-up libraries besides forge and launchwrapper"""
+	rand = random.Random(seed)
+	libraries = [
+		{'name':'net.minecraftforge:forge:{}'.format(FORGE_VERSION), 'url':'https://files.minecraftforge.net/maven/'},
+		{'name':'net.minecraft:launchwrapper:{}'.format(LAUNCHWRAPPER_VERSION)},
+	]
+	for index in range(library_count):
+		name = 'org.synthetic.group{group}:library{index}:{major}.{minor}'.format(group=index % 7, index=index, major=rand.randint(1, 9), minor=rand.randint(0, 30))
+		libraries.append({
+			'name':name,
+			'downloads':{'artifact':{'path':name.replace(':', '/') + '.jar', 'sha1':'%040x' % rand.getrandbits(160), 'size':rand.randint(10000, 2000000)}},
+		})
+	return json.dumps({
+		'id':'{}-forge{}'.format(MINECRAFT_VERSION, FORGE_VERSION),
+		'inheritsFrom':MINECRAFT_VERSION,
+		'mainClass':'net.minecraft.launchwrapper.Launch',
+		'minecraftArguments':'--username ${auth_player_name} --version ${version_name} --tweakClass net.minecraftforge.fml.common.launcher.FMLTweaker',
+		'libraries':libraries,
+	})
+
+def write_dummy_jar(path, mod_id, rand, class_count=20, class_size=2000):
+	"""write a jar with an mcmod.info and class_count made-up (incompressible) classes"""
+	with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+		zf.writestr('mcmod.info', json.dumps([{'modid':mod_id, 'name':mod_id, 'version':'1.0', 'mcversion':MINECRAFT_VERSION}]))
+		zf.writestr('META-INF/MANIFEST.MF', 'Manifest-Version: 1.0\r\n')
+		for index in range(class_count):
+			zf.writestr('org/synthetic/{mod_id}/Class{index}.class'.format(mod_id=mod_id, index=index), bytes(rand.getrandbits(8) for _ in range(class_size)))
+
+def write_config_tree(config_dir, file_count, rand, files_per_dir=50):
+	"""write file_count small config files, spread over nested directories of files_per_dir files each"""
+	for index in range(file_count):
+		dir_path = os.path.join(config_dir, 'mod{}'.format(index // files_per_dir), 'sub{}'.format(index // files_per_dir % 3))
+		if not os.path.isdir(dir_path):
+			os.makedirs(dir_path)
+		with open(os.path.join(dir_path, 'setting{}.cfg'.format(index)), 'w') as fp:
+			for line in range(rand.randint(5, 40)):
+				fp.write('    I:option{line}={value}\n'.format(line=line, value=rand.randint(0, 100000)))
+
+def write_forge_install(forge_install_dir, library_count, rand, library_size=20000):
+	"""write a made-up forge install tree, as the forge installer leaves it"""
+	launchwrapper_dir = os.path.join(forge_install_dir, 'libraries', 'net', 'minecraft', 'launchwrapper', LAUNCHWRAPPER_VERSION)
+	os.makedirs(launchwrapper_dir)
+	with open(os.path.join(launchwrapper_dir, 'launchwrapper-{}.jar'.format(LAUNCHWRAPPER_VERSION)), 'wb') as fp:
+		fp.write(bytes(rand.getrandbits(8) for _ in range(library_size)))
+	for index in range(library_count):
+		library_dir = os.path.join(forge_install_dir, 'libraries', 'org', 'synthetic', 'group{}'.format(index % 7), 'library{}'.format(index), '1.0')
+		os.makedirs(library_dir)
+		with open(os.path.join(library_dir, 'library{}-1.0.jar'.format(index)), 'wb') as fp:
+			fp.write(bytes(rand.getrandbits(8) for _ in range(library_size)))
+	with open(os.path.join(forge_install_dir, 'forge-{}.jar'.format(FORGE_VERSION)), 'wb') as fp:
+		fp.write(bytes(rand.getrandbits(8) for _ in range(library_size * 10)))
+	with open(os.path.join(forge_install_dir, 'minecraft_server.{}.jar'.format(MINECRAFT_VERSION)), 'wb') as fp:
+		fp.write(bytes(rand.getrandbits(8) for _ in range(library_size * 10)))
+
+def generate_modpack(root, addon_count=200, config_files=2000, library_count=50, seed=0):
+	"""
+	write a synthetic CurseForge-style modpack instance and forge install tree into root
+	returns (modpack directory, forge install directory)
+	"""
+	rand = random.Random(seed)
+	modpack_dir = os.path.join(root, 'modpack')
+	forge_install_dir = os.path.join(root, 'forge_install')
+	os.makedirs(os.path.join(modpack_dir, 'mods'))
+	addons = []
+	for index in range(addon_count):
+		file_name = 'SyntheticMod{index}-{mcver}-1.0.{index}.jar'.format(index=index, mcver=MINECRAFT_VERSION)
+		write_dummy_jar(os.path.join(modpack_dir, 'mods', file_name), 'syntheticmod{}'.format(index), rand)
+		addons.append({
+			'addonID':100000 + index,
+			'gameID':432,
+			'installedFile':{'id':2000000 + index, 'fileName':file_name, 'FileNameOnDisk':file_name, 'fileDate':'2020-01-01T00:00:00Z', 'fileLength':os.path.getsize(os.path.join(modpack_dir, 'mods', file_name))},
+			'dateInstalled':'2020-01-01T00:00:00Z',
+		})
+	write_config_tree(os.path.join(modpack_dir, 'config'), config_files, rand)
+	os.makedirs(os.path.join(modpack_dir, 'saves', 'World'))
+	with open(os.path.join(modpack_dir, 'saves', 'World', 'level.dat'), 'wb') as fp:
+		fp.write(b'\0' * 1024)
+	with open(os.path.join(modpack_dir, 'minecraftinstance.json'), 'w') as fp:
+		json.dump({
+			'name':'SyntheticPack',
+			'customAuthor':'benchmark',
+			'gameVersion':MINECRAFT_VERSION,
+			'baseModLoader':{
+				'name':'forge-{}'.format(FORGE_VERSION.split('-', 1)[1]),
+				'filename':'forge-{}.jar'.format(FORGE_VERSION),
+				'minecraftVersion':MINECRAFT_VERSION,
+				'forgeVersion':FORGE_VERSION.split('-', 1)[1],
+				'versionJson':synthetic_version_json(library_count, seed=seed),
+			},
+			'installedAddons':addons,
+		}, fp)
+	write_forge_install(forge_install_dir, library_count, rand)
+	return (modpack_dir, forge_install_dir)
+
+class benchmark_packager(package_modpack.modpack_packager):
+	"""a modpack_packager that takes forge from a pre-made install tree instead of running the installer, and never builds docker images"""
+	def __init__(self, forge_install_dir, **kwargs):
+		self.benchmark_forge_install_dir = forge_install_dir
+		package_modpack.modpack_packager.__init__(self, **kwargs)
+
+	def install_forge(self):
+		"""use the pre-made forge install tree"""
+		self.forge_install_dir_path = self.benchmark_forge_install_dir
+		self.forge_universal_path = os.path.join(self.forge_install_dir_path, self.forge_universal_filename)
+
+	def package_docker_server(self):
+		"""skipped, so the benchmark does not depend on docker"""
+		pass
+
+def best_time(func, repeat=3, setup=None):
+	"""the fastest of repeat runs of func, in seconds (setup is called before each run, and not timed)"""
+	times = []
+	for _ in range(repeat):
+		if not setup is None:
+			setup()
+		start_time = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start_time)
+	return min(times)
+
+def directory_totals(directory):
+	"""the number of files in a directory and their total size in bytes"""
+	count = 0
+	size = 0
+	for _, entry in file_ops.walk_directory(directory):
+		if entry.is_file():
+			count += 1
+			size += entry.stat().st_size
+	return (count, size)
+
+def result(seconds, files=None, size=None, items=None):
+	"""a benchmark result, as stored in the JSON results file"""
+	bench_result = {'seconds':seconds}
+	if not items is None:
+		bench_result['items'] = items
+		bench_result['items_per_second'] = items / seconds if seconds > 0 else None
+	if not files is None:
+		bench_result['files'] = files
+		bench_result['files_per_second'] = files / seconds if seconds > 0 else None
+	if not size is None:
+		bench_result['bytes'] = size
+		bench_result['mb_per_second'] = size / 1024 / 1024 / seconds if seconds > 0 else None
+	return bench_result
+
+def remove_dir(path):
+	"""remove a directory if it exists"""
+	if os.path.isdir(path):
+		shutil.rmtree(path)
+
+def bench_client_files(addon_counts, repeat=3):
+	"""time writing manifest.json and modlist.html for instances of each size; returns a list of (addon count, seconds) tuples"""
+	results = []
+	for addon_count in addon_counts:
+		instance = synthetic_instance(addon_count)
+		results.append((addon_count, best_time(lambda: client_manifest.write_client_files(instance, 'Synthetic', '1.0.0', io.BytesIO(), io.BytesIO()), repeat=repeat)))
+	return results
+
+def bench_copy_directory(src, work_dir, repeat=3):
+	"""time file_ops.copy_directory of a directory into an empty directory"""
+	dest = os.path.join(work_dir, 'copy_directory')
+	(files, size) = directory_totals(src)
+	return result(best_time(lambda: file_ops.copy_directory(src, dest), repeat=repeat, setup=lambda: remove_dir(dest)), files=files, size=size)
+
+def bench_create_zip(src, work_dir, repeat=3):
+	"""time file_ops.create_zip of a directory"""
+	archive = os.path.join(work_dir, 'create_zip', 'archive.zip')
+	(files, size) = directory_totals(src)
+	return result(best_time(lambda: file_ops.create_zip(src, archive), repeat=repeat, setup=lambda: file_ops.unlink_if_exists(archive)), files=files, size=size)
+
+def bench_full_package(modpack_dir, forge_install_dir, work_dir, repeat=3, settings={}):
+	"""time a full run of the packager (client and server packages, with the forge install stubbed), from a clean packages directory each time"""
+	packages_dir = os.path.join(work_dir, 'packages')
+	def package():
+		packager = benchmark_packager(
+			forge_install_dir,
+			modpack_dir=modpack_dir,
+			packages_dir=packages_dir,
+			modpack_version='1.0.0',
+			client_info_fname=None,
+			remove_server_mods_fname=None,
+			forge_cache_dir=os.path.join(work_dir, 'forge_cache'),
+			**settings
+		)
+		packager.run()
+	def clean():
+		# a build cache is kept between runs, since skipping unchanged files is what it is for
+		if settings.get('use_build_cache'):
+			for name in os.listdir(packages_dir) if os.path.isdir(packages_dir) else []:
+				if name!='.build_cache':
+					remove_dir(os.path.join(packages_dir, name))
+		else:
+			remove_dir(packages_dir)
+	return result(best_time(package, repeat=repeat, setup=clean))
+
+def load_log_handler():
+	"""load additional_server_files/LogHandler.py, which is shipped with the server package instead of being part of the package"""
+	return file_ops.load_server_script('LogHandler')
+
+def bench_log_handler(work_dir, line_count=100000, repeat=3):
+	"""
+	time logging line_count lines of server output through LogHandler.log_handler; returns (enqueue, write) results in lines per second
+		enqueue is the time add_str takes the server output thread, write includes stop, so every line is on disk
+	"""
+	log_handler_module = load_log_handler()
+	log_folder = os.path.join(work_dir, 'log_handler')
+	lines = ['[12:34:56] [Server thread/INFO] [minecraft/DedicatedServer]: Synthetic server output line {}'.format(i) for i in range(line_count)]
+	enqueue_times = []
+	def log_lines():
+		handler = log_handler_module.log_handler(log_folder=log_folder)
+		start_time = time.perf_counter()
+		for line in lines:
+			handler.add_str(line)
+		enqueue_times.append(time.perf_counter() - start_time)
+		handler.stop()
+	write_seconds = best_time(log_lines, repeat=repeat, setup=lambda: remove_dir(log_folder))
+	return (result(min(enqueue_times), items=line_count), result(write_seconds, items=line_count))
+
+def run_suite(work_dir, mod_count=200, config_files=2000, library_count=50, addon_counts=[1000, 10000], log_lines=100000, repeat=3, full_settings={'default':{}}):
+	"""generate a synthetic modpack in work_dir and run every benchmark on it; returns the results, as stored in the JSON results file"""
+	print('Generating synthetic modpack ({mods} mods, {config_files} config files, {libraries} forge libraries)...'.format(mods=mod_count, config_files=config_files, libraries=library_count))
+	(modpack_dir, forge_install_dir) = generate_modpack(os.path.join(work_dir, 'source'), addon_count=mod_count, config_files=config_files, library_count=library_count)
+	results = {}
+	print('Timing file_ops.copy_directory...')
+	results['copy_directory config'] = bench_copy_directory(os.path.join(modpack_dir, 'config'), work_dir, repeat=repeat)
+	results['copy_directory mods'] = bench_copy_directory(os.path.join(modpack_dir, 'mods'), work_dir, repeat=repeat)
+	print('Timing file_ops.create_zip...')
+	results['create_zip config'] = bench_create_zip(os.path.join(modpack_dir, 'config'), work_dir, repeat=repeat)
+	results['create_zip mods'] = bench_create_zip(os.path.join(modpack_dir, 'mods'), work_dir, repeat=repeat)
+	print('Timing manifest.json + modlist.html generation...')
+	for addon_count, seconds in bench_client_files(addon_counts, repeat=repeat):
+		results['client files {}'.format(addon_count)] = result(seconds, items=addon_count)
+	print('Timing LogHandler ({} lines)...'.format(log_lines))
+	(results['log_handler enqueue'], results['log_handler write']) = bench_log_handler(work_dir, line_count=log_lines, repeat=repeat)
+	# the packager prints its progress, which would bury the benchmark output
+	for name, settings in full_settings.items():
+		print('Timing full packaging run ({})...'.format(name))
+		stdout = sys.stdout
+		sys.stdout = io.StringIO()
+		try:
+			results['full package {}'.format(name)] = bench_full_package(modpack_dir, forge_install_dir, work_dir, repeat=repeat, settings=settings)
+		finally:
+			sys.stdout = stdout
+	return {
+		'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+		'python':platform.python_version(),
+		'platform':platform.platform(),
+		'cpu_count':os.cpu_count(),
+		'parameters':{'mods':mod_count, 'config_files':config_files, 'libraries':library_count, 'addon_counts':addon_counts, 'log_lines':log_lines, 'repeat':repeat},
+		'results':results,
+	}
+
+def print_results(suite_results):
+	"""print the results of run_suite as a table"""
+	for name, bench_result in suite_results['results'].items():
+		line = '  {name:<32} {ms:10.2f} ms'.format(name=name, ms=bench_result['seconds']*1000)
+		if 'items_per_second' in bench_result and not bench_result['items_per_second'] is None:
+			line += '  {:10.0f} items/s'.format(bench_result['items_per_second'])
+		if 'files_per_second' in bench_result and not bench_result['files_per_second'] is None:
+			line += '  {:10.0f} files/s'.format(bench_result['files_per_second'])
+		if 'mb_per_second' in bench_result and not bench_result['mb_per_second'] is None:
+			line += '  {:8.1f} MiB/s'.format(bench_result['mb_per_second'])
+		print(line)
+
+def print_comparison(suite_results, baseline_results):
+	"""print how much slower (+) or faster (-) each benchmark is than in a previous results file"""
+	print('Compared to {}:'.format(baseline_results.get('timestamp', 'baseline')))
+	for name, bench_result in suite_results['results'].items():
+		if not name in baseline_results['results']:
+			continue
+		baseline_seconds = baseline_results['results'][name]['seconds']
+		print('  {name:<32} {change:+8.1f}%'.format(name=name, change=(bench_result['seconds'] - baseline_seconds) / baseline_seconds * 100 if baseline_seconds > 0 else 0))
+
+def print_scaling(title, results):
+	"""print timings along with the time per item, which stays flat when the work scales linearly"""
+	print(title)
+	for count, seconds in results:
+		print('  {count:>7} items: {ms:9.2f} ms  ({us:6.2f} us/item)'.format(count=count, ms=seconds*1000, us=seconds*1000000/max(count, 1)))
+
+if __name__=='__main__':
+	parser = argparse.ArgumentParser(description='Benchmark parts of the modpack packager on synthetic modpacks.')
+	parser.add_argument('--addons', dest='addon_counts', default=[1000, 2000, 5000, 10000], type=int, nargs='+', help='Addon counts of the synthetic instances manifest.json and modlist.html are generated for.  Defaults to 1000 2000 5000 10000.')
+	parser.add_argument('--repeat', dest='repeat', default=3, type=int, help='Number of times each benchmark is run (the fastest run is reported).  Defaults to 3.')
+	parser.add_argument('--client_files_only', dest='client_files_only', default=False, action='store_true', help='Only time manifest.json and modlist.html generation, without generating a synthetic modpack.')
+	parser.add_argument('--mods', dest='mod_count', default=200, type=int, help='Number of dummy mod jars in the synthetic modpack.  Defaults to 200.')
+	parser.add_argument('--config_files', dest='config_files', default=2000, type=int, help='Number of small files in the config directory of the synthetic modpack.  Defaults to 2000.')
+	parser.add_argument('--libraries', dest='library_count', default=50, type=int, help='Number of libraries in the fake forge install.  Defaults to 50.')
+	parser.add_argument('--log_lines', dest='log_lines', default=100000, type=int, help='Number of lines of server output logged through LogHandler.  Defaults to 100000.')
+	parser.add_argument('--log_handler_only', dest='log_handler_only', default=False, action='store_true', help='Only time logging server output through LogHandler, without generating a synthetic modpack.')
+	parser.add_argument('--work_dir', dest='work_dir', default=None, help='Directory the synthetic modpack and packages are written to.  Defaults to a temporary directory, which is deleted afterwards.')
+	parser.add_argument('-o', '--output', dest='output_fname', default=None, help='Filename of a JSON file to write the results to, to compare runs.')
+	parser.add_argument('--compare', dest='baseline_fname', default=None, help='Filename of a JSON results file of a previous run, to compare the results with.')
+	args = parser.parse_args()
+	if args.client_files_only:
+		print_scaling('manifest.json + modlist.html generation:', bench_client_files(args.addon_counts, repeat=args.repeat))
+		sys.exit(0)
+	work_dir = args.work_dir
+	if work_dir is None:
+		work_dir = tempfile.mkdtemp(prefix='mc_modpack_benchmark_')
+	if args.log_handler_only:
+		try:
+			(enqueue_result, write_result) = bench_log_handler(work_dir, line_count=args.log_lines, repeat=args.repeat)
+		finally:
+			if args.work_dir is None:
+				shutil.rmtree(work_dir)
+		print('LogHandler ({} lines):'.format(args.log_lines))
+		print('  enqueue {:10.0f} lines/s'.format(enqueue_result['items_per_second']))
+		print('  write   {:10.0f} lines/s'.format(write_result['items_per_second']))
+		sys.exit(0)
+	try:
+		suite_results = run_suite(
+			work_dir,
+			mod_count=args.mod_count,
+			config_files=args.config_files,
+			library_count=args.library_count,
+			addon_counts=args.addon_counts,
+			log_lines=args.log_lines,
+			repeat=args.repeat,
+			full_settings={'default':{}, 'stream_packages':{'stream_packages':True}, 'use_build_cache':{'use_build_cache':True}},
+		)
+	finally:
+		if args.work_dir is None:
+			shutil.rmtree(work_dir)
+	print_results(suite_results)
+	if not args.output_fname is None:
+		with open(args.output_fname, 'w') as fp:
+			json.dump(suite_results, fp, indent=2)
+		print('Results written to "{}".'.format(args.output_fname))
+	if not args.baseline_fname is None:
+		with open(args.baseline_fname, 'r') as fp:
+			print_comparison(suite_results, json.load(fp))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import os
+import json
+import threading
+
+from MinecraftModpackPackager import file_ops
+from MinecraftModpackPackager import progress
+
+class build_cache(object):
+	"""
+	persistent record of every file copied into the staging directories of a build
+		stores the size, mtime, and hash of each source file along with the size and mtime of the copy made from it
+		lets a rebuild skip copying any file whose content has not changed since the previous build
+		staging directories are kept inside cache_dir, so they survive between builds
+	"""
+	index_version = 1
+
+	def __init__(self, cache_dir):
+		self.cache_dir = cache_dir
+		self.index_fname = os.path.join(self.cache_dir, 'index.json')
+		self.lock = threading.RLock()
+		self.files = {}
+		self.touched = set()
+		self.load()
+
+	def load(self):
+		"""load the cache index from disk, starting with an empty index if it is missing or unreadable"""
+		self.files = {}
+		if os.path.isfile(self.index_fname):
+			try:
+				with open(self.index_fname, 'r') as fp:
+					index = json.load(fp)
+			except ValueError:
+				progress.warning('Build cache index "{}" is corrupt! Rebuilding cache from scratch...'.format(self.index_fname))
+				return
+			if index.get('version')==self.index_version:
+				self.files = index['files']
+
+	def save(self):
+		"""write the cache index to disk, replacing the previous index atomically"""
+		if not os.path.isdir(self.cache_dir):
+			os.makedirs(self.cache_dir)
+		tmp_fname = self.index_fname + '.tmp'
+		# the staging steps save from parallel threads, so the temporary file is only written and renamed by one of them at a time
+		with self.lock:
+			with open(tmp_fname, 'w') as fp:
+				json.dump({'version':self.index_version, 'files':self.files}, fp)
+			os.replace(tmp_fname, self.index_fname)
+
+	def staging_dir(self, name):
+		"""path of a persistent staging directory kept inside the cache"""
+		return os.path.join(self.cache_dir, name)
+
+	def is_current(self, src, dest):
+		"""checks whether dest still holds an unmodified copy of the current contents of src"""
+		dest = os.path.abspath(dest)
+		with self.lock:
+			entry = self.files.get(dest)
+		if entry is None:
+			return False
+		try:
+			dest_stat = os.stat(dest)
+			src_stat = os.stat(src)
+		except OSError:
+			return False
+		if dest_stat.st_size!=entry['dest_size'] or dest_stat.st_mtime_ns!=entry['dest_mtime']:
+			# the copy was modified after it was made (e.g. by a template substitution)
+			return False
+		if src_stat.st_size!=entry['size']:
+			return False
+		if src_stat.st_mtime_ns==entry['mtime'] and os.path.abspath(src)==entry['src']:
+			return True
+		# same size but touched or moved - only the content decides
+		if file_ops.hash_file_cached(src)!=entry['hash']:
+			return False
+		with self.lock:
+			entry['src'] = os.path.abspath(src)
+			entry['mtime'] = src_stat.st_mtime_ns
+		return True
+
+	def record(self, src, dest):
+		"""record that dest was just copied from src"""
+		src_stat = os.stat(src)
+		dest_stat = os.stat(dest)
+		entry = {
+			'src':os.path.abspath(src),
+			'size':src_stat.st_size,
+			'mtime':src_stat.st_mtime_ns,
+			# dest was just copied from src, so src is hashed instead (it is shared between builds, so its hash is usually already known)
+			'hash':file_ops.hash_file_cached(src),
+			'dest_size':dest_stat.st_size,
+			'dest_mtime':dest_stat.st_mtime_ns,
+		}
+		with self.lock:
+			self.files[os.path.abspath(dest)] = entry
+		self.touch(dest)
+
+	def touch(self, path):
+		"""mark a file or directory as part of the current build, so remove_untouched keeps it"""
+		with self.lock:
+			self.touched.add(os.path.abspath(path))
+
+	def remove_untouched(self, directory):
+		"""delete every file and empty directory in directory that was not copied or generated during the current build"""
+		directory = os.path.abspath(directory)
+		with self.lock:
+			for dirpath, dirnames, filenames in os.walk(directory, topdown=False):
+				for fname in filenames:
+					path = os.path.join(dirpath, fname)
+					if not path in self.touched:
+						os.remove(path)
+				if dirpath!=directory and not dirpath in self.touched and len(os.listdir(dirpath))==0:
+					os.rmdir(dirpath)
+			prefix = os.path.join(directory, '')
+			for dest in list(self.files):
+				if dest.startswith(prefix) and not dest in self.touched:
+					del self.files[dest]
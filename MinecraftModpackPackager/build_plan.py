@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import os
+import json
+
+from MinecraftModpackPackager import file_ops
+from MinecraftModpackPackager import server_mod_filter
+
+class source_scan(object):
+	"""
+	the metadata of a source directory (e.g. the modpack instance), read in a single walk (see file_ops.walk_directory)
+	the entries of every package taken from the directory, and the index of its mods directory, come from the scan instead of walking the directory again
+	"""
+	def __init__(self, root, exclude=[]):
+		self.root = root
+		self.items = list(file_ops.walk_directory(root, exclude=exclude))
+
+	def subtree(self, rel_dir):
+		"""the items inside a subdirectory of the scan, with paths relative to the subdirectory"""
+		prefix = rel_dir + os.sep
+		return [(rel[len(prefix):], entry) for rel, entry in self.items if rel.startswith(prefix)]
+
+	def mods_index(self, mods_rel_dir='mods'):
+		"""the files directly inside the mods directory, sorted by name (like server_mod_filter.index_mods_dir)"""
+		index = [server_mod_filter.mod_file(entry.name, entry.path, entry.stat()) for rel, entry in self.subtree(mods_rel_dir) if not os.sep in rel and entry.is_file()]
+		return sorted(index, key=lambda cur_file: cur_file.name)
+
+class planned_package(object):
+	"""a package in a build plan: its entries (see package_stream.package_entries), and the directory and archive they are written to"""
+	def __init__(self, name, entries, package_dir, archive):
+		self.name = name
+		self.entries = entries
+		self.package_dir = package_dir
+		self.archive = archive
+
+	def files(self):
+		"""the file entries of the package, in the order they are written"""
+		return [entry for entry in self.entries.sorted_entries() if not entry.is_dir]
+
+	def totals(self):
+		"""the number of files and bytes in the package, in total and by transform, as {transform:{'files':..., 'bytes':...}} (the total is under None)"""
+		totals = {None:{'files':0, 'bytes':0}}
+		for entry in self.files():
+			for key in [None, entry.transform()]:
+				if not key in totals:
+					totals[key] = {'files':0, 'bytes':0}
+				totals[key]['files'] += 1
+				totals[key]['bytes'] += entry.size
+		return totals
+
+	def as_dict(self):
+		"""the package as stored in the JSON export of the plan"""
+		totals = self.totals()
+		return {
+			'name':self.name,
+			'package_dir':self.package_dir,
+			'archive':self.archive,
+			'files':totals[None]['files'],
+			'bytes':totals[None]['bytes'],
+			'transforms':dict([(key, value) for key, value in totals.items() if not key is None]),
+			'entries':[{
+				'arcname':entry.arcname,
+				'src':entry.src,
+				'size':entry.size,
+				'transform':entry.transform(),
+				'renamed_from':entry.renamed_from,
+			} for entry in self.files()],
+		}
+
+class build_plan(object):
+	"""
+	everything a packager run will write: every entry of each package, where it comes from, its size, how it is produced, and the archive it goes into
+		the executors of the packager write the packages from the plan, so the plan is exactly what gets built
+		sizes are those of the source files, so templated files may end up slightly larger or smaller
+		notes record anything the plan could not include (e.g. the files of a forge version that is not installed yet)
+	"""
+	def __init__(self):
+		self.packages = []
+		self.notes = []
+
+	def add_package(self, name, entries, package_dir, archive):
+		"""add a package to the plan"""
+		self.packages.append(planned_package(name, entries, package_dir, archive))
+
+	def package(self, name):
+		"""the entries of the package called name"""
+		for package in self.packages:
+			if package.name==name:
+				return package.entries
+		raise Exception('Build plan has no package "{}"!'.format(name))
+
+	def total_bytes(self):
+		"""the number of bytes in every package of the plan"""
+		return sum([package.totals()[None]['bytes'] for package in self.packages])
+
+	def as_dict(self):
+		"""the plan as stored in the JSON export"""
+		return {
+			'packages':[package.as_dict() for package in self.packages],
+			'notes':self.notes,
+		}
+
+	def write_json(self, fname):
+		"""export the plan to a JSON file"""
+		with open(fname, 'w') as fp:
+			json.dump(self.as_dict(), fp, indent=1)
+
+	def summary(self):
+		"""the totals of each package as a table of lines"""
+		lines = []
+		for package in self.packages:
+			totals = package.totals()
+			lines.append('  {name:<8} {files:>7} files {mb:9.1f} MiB  -> "{archive}"'.format(name=package.name, files=totals[None]['files'], mb=totals[None]['bytes'] / 1024 / 1024, archive=package.archive))
+			for transform in sorted([key for key in totals if not key is None]):
+				lines.append('    {transform:<12} {files:>7} files {mb:9.1f} MiB'.format(transform=transform, files=totals[transform]['files'], mb=totals[transform]['bytes'] / 1024 / 1024))
+		for note in self.notes:
+			lines.append('  NOTE: {}'.format(note))
+		return '\n'.join(lines)
+
+def estimate_seconds(plan, report):
+	"""
+	a rough estimate of how long building a plan takes, from the instrumentation report of a previous run (see instrumentation)
+	scales how long that run took by the bytes in the plan over the bytes in the plan of that run; None if the report has nothing to go by
+	"""
+	totals = report.get('totals', {})
+	if not 'elapsed_seconds' in totals or not totals.get('plan_bytes'):
+		return None
+	return totals['elapsed_seconds'] * plan.total_bytes() / totals['plan_bytes']
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import os
+import json
+
+# placeholder the skeleton of manifest.json is split at, to stream the list of files into it
+FILES_PLACEHOLDER = '"files": []'
+# how many addons are rendered before the text is written out
+WRITE_BATCH_SIZE = 256
+
+def manifest_skeleton(instance, modpack_name, modpack_version):
+	"""the parts of manifest.json before and after the list of files, exactly as json.dump(..., indent=2) lays them out"""
+	skeleton = json.dumps({
+		"minecraft": {
+			"version": instance.minecraft_version,
+			"modLoaders": [
+				{
+					"id": instance.mod_loader_name,
+					"primary": True
+				}
+			]
+		},
+		"manifestType": "minecraftModpack",
+		"manifestVersion": 1,
+		"name": modpack_name,
+		"version": modpack_version,
+		"author": instance.custom_author,
+		"files": [],
+		"overrides": "overrides"
+	}, indent=2)
+	# quotes inside strings are escaped by json, so the placeholder can only match the key itself
+	head, tail = skeleton.split(FILES_PLACEHOLDER, 1)
+	return (head + '"files": [', ']' + tail)
+
+def manifest_file_entry(addon):
+	"""the entry for an addon in the list of files in manifest.json, indented as json.dump(..., indent=2) would"""
+	return '\n    {{\n      "projectID": {project_id},\n      "fileID": {file_id},\n      "required": {required}\n    }}'.format(
+		project_id=json.dumps(addon.addon_id),
+		file_id=json.dumps(addon.file_id),
+		required=json.dumps(addon.file_name_on_disk[-4:]=='.jar'),
+	)
+
+def modlist_entry(addon):
+	"""the line for an addon in modlist.html"""
+	return '<li><a href="https://minecraft.curseforge.com/mc-mods/{id}">{name}</a></li>\r\n'.format(
+		id=addon.addon_id,
+		name=addon.file_name, #TODO: find better way of representing this information
+	)
+
+def write_client_files(instance, modpack_name, modpack_version, manifest_fp, modlist_fp):
+	"""
+	write manifest.json and modlist.html for the client package into two binary file objects, in a single pass over the addons
+	the output is byte-for-byte what json.dump(..., indent=2) to a text file and the old string concatenation produced
+	"""
+	manifest_head, manifest_tail = manifest_skeleton(instance, modpack_name, modpack_version)
+	manifest_fp.write(manifest_head.replace('\n', os.linesep).encode('utf-8'))
+	modlist_fp.write(b'<ul>\r\n')
+	manifest_parts = []
+	modlist_parts = []
+	for index, addon in enumerate(instance.addons):
+		if index > 0:
+			manifest_parts.append(',')
+		manifest_parts.append(manifest_file_entry(addon))
+		modlist_parts.append(modlist_entry(addon))
+		if len(modlist_parts) >= WRITE_BATCH_SIZE:
+			manifest_fp.write(''.join(manifest_parts).replace('\n', os.linesep).encode('utf-8'))
+			modlist_fp.write(''.join(modlist_parts).encode('utf-8'))
+			manifest_parts = []
+			modlist_parts = []
+	manifest_fp.write(''.join(manifest_parts).replace('\n', os.linesep).encode('utf-8'))
+	modlist_fp.write(''.join(modlist_parts).encode('utf-8'))
+	if len(instance.addons) > 0:
+		manifest_tail = '\n  ' + manifest_tail
+	manifest_fp.write(manifest_tail.replace('\n', os.linesep).encode('utf-8'))
+	modlist_fp.write(b'</ul>\r\n')
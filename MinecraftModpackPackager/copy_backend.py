@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+import os
+import errno
+import shutil
+import threading
+
+from MinecraftModpackPackager import instrumentation
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+# ioctl request number for cloning a file on copy-on-write filesystems (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# errors meaning a strategy is not available between two filesystems, rather than a real failure
+UNSUPPORTED_ERRNOS = set([getattr(errno, name) for name in [
+	'EXDEV',
+	'EOPNOTSUPP',
+	'ENOTSUP',
+	'ENOSYS',
+	'EINVAL',
+	'ENOTTY',
+	'ENOTSOCK',
+	'EPERM',
+	'EBADF',
+] if hasattr(errno, name)])
+
+class unsupported_strategy(Exception):
+	"""raised when a copy strategy cannot be used for a specific file"""
+	pass
+
+def clone_file(src, dest):
+	"""clone src into dest with the FICLONE ioctl, sharing the data blocks between both files"""
+	if fcntl is None:
+		raise unsupported_strategy('reflink not available on this platform')
+	with open(src, 'rb') as src_fp:
+		with open(dest, 'wb') as dest_fp:
+			fcntl.ioctl(dest_fp.fileno(), FICLONE, src_fp.fileno())
+	shutil.copystat(src, dest)
+
+def link_file(src, dest):
+	"""hardlink src to dest, so both names share the same file"""
+	os.link(src, dest)
+
+def copy_file_range(src, dest):
+	"""copy src into dest inside the kernel with copy_file_range"""
+	if not hasattr(os, 'copy_file_range'):
+		raise unsupported_strategy('copy_file_range not available on this platform')
+	with open(src, 'rb') as src_fp:
+		with open(dest, 'wb') as dest_fp:
+			while os.copy_file_range(src_fp.fileno(), dest_fp.fileno(), 1024*1024*1024)>0:
+				pass
+	shutil.copystat(src, dest)
+
+def sendfile(src, dest):
+	"""copy src into dest inside the kernel with sendfile"""
+	if not hasattr(os, 'sendfile'):
+		raise unsupported_strategy('sendfile not available on this platform')
+	with open(src, 'rb') as src_fp:
+		with open(dest, 'wb') as dest_fp:
+			offset = 0
+			while True:
+				sent = os.sendfile(dest_fp.fileno(), src_fp.fileno(), offset, 1024*1024*1024)
+				if sent==0:
+					break
+				offset = offset + sent
+	shutil.copystat(src, dest)
+
+def plain_copy(src, dest):
+	"""copy src into dest by reading and writing every byte"""
+	shutil.copy2(src, dest)
+
+class copy_backend(object):
+	"""
+	copies files with the cheapest strategy the filesystems involved support
+		tries reflink, then hardlink (only for read-only inputs), then copy_file_range and sendfile, and finally a plain copy
+		remembers for every pair of filesystems which strategies are unsupported, so they are only tried once
+		counts the files and bytes copied by each strategy
+	"""
+	strategies = [
+		('reflink', clone_file),
+		('hardlink', link_file),
+		('copy_file_range', copy_file_range),
+		('sendfile', sendfile),
+		('copy', plain_copy),
+	]
+
+	def __init__(self, disabled_strategies=[]):
+		self.disabled_strategies = disabled_strategies
+		self.lock = threading.Lock()
+		self.unsupported = {}
+		self.stats = {}
+
+	def filesystem_key(self, src_stat, dest):
+		"""identify the pair of filesystems a copy goes between"""
+		return (src_stat.st_dev, os.stat(os.path.dirname(os.path.abspath(dest))).st_dev)
+
+	def copy(self, src, dest, read_only=False):
+		"""
+		copy src to dest, returning the name of the strategy used
+			read_only marks src as an input that is never modified in place, so it may be hardlinked
+			an existing dest is removed first, so a copy never writes through a hardlink made by a previous build
+		"""
+		if os.path.lexists(dest):
+			os.remove(dest)
+		src_stat = os.stat(src)
+		fs_key = self.filesystem_key(src_stat, dest)
+		for name, strategy in self.strategies:
+			if name in self.disabled_strategies:
+				continue
+			if name=='hardlink' and not read_only:
+				continue
+			with self.lock:
+				if name in self.unsupported.get(fs_key, ()):
+					continue
+			try:
+				strategy(src, dest)
+			except unsupported_strategy:
+				self.mark_unsupported(fs_key, name)
+			except OSError as e:
+				if name=='hardlink' and e.errno==errno.EMLINK:
+					# too many links to this one file, not a limitation of the filesystem
+					pass
+				elif name=='copy' or not e.errno in UNSUPPORTED_ERRNOS:
+					raise
+				else:
+					self.mark_unsupported(fs_key, name)
+			else:
+				self.count(name, src_stat.st_size)
+				if name in ['reflink', 'hardlink']:
+					# no data is read or written for these
+					instrumentation.default_recorder.count_written(1, 0)
+				else:
+					instrumentation.default_recorder.count_read(1, src_stat.st_size)
+					instrumentation.default_recorder.count_written(1, src_stat.st_size)
+				return name
+			if os.path.lexists(dest):
+				os.remove(dest)
+
+	def mark_unsupported(self, fs_key, name):
+		"""remember that a strategy does not work between a pair of filesystems"""
+		with self.lock:
+			if not fs_key in self.unsupported:
+				self.unsupported[fs_key] = set()
+			self.unsupported[fs_key].add(name)
+
+	def count(self, name, size):
+		"""add a copied file to the statistics of a strategy"""
+		with self.lock:
+			files, total = self.stats.get(name, (0, 0))
+			self.stats[name] = (files + 1, total + size)
+
+	def report(self):
+		"""describe how many files and bytes each strategy copied"""
+		with self.lock:
+			if len(self.stats)==0:
+				return 'no files copied'
+			return ', '.join(['{name}: {files} files ({size:.1f} MiB)'.format(name=name, files=files, size=total/(1024*1024)) for name, (files, total) in sorted(self.stats.items())])
+
+default_backend = copy_backend()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import zipfile
+import hashlib
+import argparse
+
+from MinecraftModpackPackager import file_ops
+from MinecraftModpackPackager import zip_writer
+from MinecraftModpackPackager import package_stream
+
+# deltas are applied by apply_delta.py, which is shipped with the server package so servers can apply them without the packager
+# it is only loaded once a delta is created or applied (see load_apply_delta)
+apply_delta_script = None
+
+def load_apply_delta():
+	"""the apply_delta.py script shipped with the server package, which holds the delta format, manifest name, and files folder as well"""
+	global apply_delta_script
+	if apply_delta_script is None:
+		apply_delta_script = file_ops.load_server_script('apply_delta')
+	return apply_delta_script
+
+def apply_delta(delta_archive, target_dir, force=False):
+	"""apply a delta archive to an unpacked package (see apply_delta.py)"""
+	return load_apply_delta().apply_delta(delta_archive, target_dir, force=force)
+
+def hash_fp(fp, chunk_size=1024*1024):
+	"""calculates the sha256 hash of everything left in an open binary file object, returned as a hex string"""
+	file_hash = hashlib.sha256()
+	for chunk in iter(lambda: fp.read(chunk_size), b''):
+		file_hash.update(chunk)
+	return file_hash.hexdigest()
+
+def zip_manifest(archive):
+	"""
+	list the contents of a zip archive
+	returns a dict of the files (path inside the archive to sha256 hash and size) and a list of the directories
+	"""
+	files = {}
+	dirs = []
+	with zipfile.ZipFile(archive, 'r') as zf:
+		for info in zf.infolist():
+			if info.is_dir():
+				dirs.append(info.filename.rstrip('/'))
+			else:
+				with zf.open(info) as fp:
+					files[info.filename] = {'sha256':hash_fp(fp), 'size':info.file_size}
+	return (files, dirs)
+
+class zip_member_entry(object):
+	"""a file inside an existing zip archive that should be written into a new zip archive (see zip_writer)"""
+	def __init__(self, zf, info, arcname):
+		self.zf = zf
+		self.info = info
+		self.arcname = arcname
+		self.is_dir = False
+		self.mtime = time.mktime(info.date_time + (0, 0, -1))
+		self.mode = (info.external_attr >> 16) or 0o100664
+
+	def open(self):
+		"""open a binary file object for reading the contents of this entry"""
+		return self.zf.open(self.info)
+
+def create_delta(old_archive, new_archive, delta_archive, from_version=None, to_version=None, compresslevel=6, workers=None):
+	"""
+	create a delta archive holding everything needed to turn the contents of old_archive into the contents of new_archive
+		the manifest lists the added, changed, and removed files along with their hashes, and the added and removed directories
+		only the added and changed files are included, under the folder "files"
+	returns the manifest
+	"""
+	script = load_apply_delta()
+	old_files, old_dirs = zip_manifest(old_archive)
+	new_files, new_dirs = zip_manifest(new_archive)
+	manifest = {
+		'format':script.DELTA_FORMAT,
+		'from_version':from_version,
+		'to_version':to_version,
+		'from_package':os.path.basename(old_archive),
+		'to_package':os.path.basename(new_archive),
+		'added':{},
+		'changed':{},
+		'removed':{},
+		'added_dirs':sorted(set(new_dirs) - set(old_dirs)),
+		'removed_dirs':sorted(set(old_dirs) - set(new_dirs), reverse=True),
+	}
+	for name in sorted(new_files):
+		if not name in old_files:
+			manifest['added'][name] = new_files[name]
+		elif old_files[name]['sha256']!=new_files[name]['sha256']:
+			manifest['changed'][name] = {
+				'from_sha256':old_files[name]['sha256'],
+				'sha256':new_files[name]['sha256'],
+				'size':new_files[name]['size'],
+			}
+	for name in sorted(old_files):
+		if not name in new_files:
+			manifest['removed'][name] = {'sha256':old_files[name]['sha256']}
+	if not os.path.isdir(os.path.dirname(delta_archive)):
+		os.makedirs(os.path.dirname(delta_archive))
+	with zipfile.ZipFile(new_archive, 'r') as zf:
+		entries = [package_stream.package_entry(script.MANIFEST_NAME, data=json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))]
+		for name in sorted(list(manifest['added']) + list(manifest['changed'])):
+			entries.append(zip_member_entry(zf, zf.getinfo(name), '{}/{}'.format(script.FILES_DIR, name)))
+		zip_writer.write_zip(delta_archive, entries, compresslevel=compresslevel, workers=workers)
+	return manifest
+
+if __name__=='__main__':
+	parser = argparse.ArgumentParser(description='Create or apply delta archives between two versions of a modpack package.')
+	subparsers = parser.add_subparsers(dest='command')
+	create_parser = subparsers.add_parser('create', help='Create a delta archive from two package zip archives.')
+	create_parser.add_argument('old_archive', help='Zip archive of the previous version of the package.')
+	create_parser.add_argument('new_archive', help='Zip archive of the new version of the package.')
+	create_parser.add_argument('delta_archive', help='Filename of the delta archive to create.')
+	apply_parser = subparsers.add_parser('apply', help='Apply a delta archive to an unpacked package.')
+	apply_parser.add_argument('delta_archive', help='Filename of the delta archive to apply.')
+	apply_parser.add_argument('target_dir', help='Directory holding the unpacked previous version of the package.')
+	apply_parser.add_argument('-f', '--force', dest='force', default=False, action='store_true', help='Apply the delta even if files in the target directory were modified since the previous version.')
+	args = parser.parse_args()
+	if args.command=='create':
+		manifest = create_delta(args.old_archive, args.new_archive, args.delta_archive)
+		print('Delta created: {added} added, {changed} changed, {removed} removed files.'.format(added=len(manifest['added']), changed=len(manifest['changed']), removed=len(manifest['removed'])))
+	elif args.command=='apply':
+		manifest = apply_delta(args.delta_archive, args.target_dir, force=args.force)
+		print('Updated "{target}" to version {version}.'.format(target=args.target_dir, version=manifest['to_version']))
+	else:
+		parser.print_help()
+		sys.exit(1)
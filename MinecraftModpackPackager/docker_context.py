@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import os
+import json
+import stat
+import hashlib
+import tarfile
+import subprocess
+
+from MinecraftModpackPackager import file_ops
+
+# label holding the digest of the build context an image was built from
+CONTEXT_DIGEST_LABEL = 'minecraft-modpack-packager.context-digest'
+
+class context_member(object):
+	"""a file or directory of a build context, with the metadata normalized as it goes into the tar"""
+	__slots__ = ['arcname', 'path', 'is_dir', 'mode', 'size']
+
+	def __init__(self, arcname, path, is_dir, mode, size=0):
+		self.arcname = arcname
+		self.path = path
+		self.is_dir = is_dir
+		self.mode = mode
+		self.size = size
+
+def list_context(context_dir):
+	"""the members of a build context in the order they go into the tar; only the executable bit of the file modes is kept"""
+	members = []
+	for rel, entry in file_ops.walk_directory(context_dir):
+		arcname = rel.replace(os.sep, '/')
+		if entry.is_dir():
+			members.append(context_member(arcname, entry.path, True, 0o755))
+		else:
+			entry_stat = entry.stat()
+			members.append(context_member(arcname, entry.path, False, 0o755 if entry_stat.st_mode & stat.S_IXUSR else 0o644, entry_stat.st_size))
+	return members
+
+def context_digest(members):
+	"""
+	a digest of everything in the tar of a build context, without writing the tar
+	it covers the path, type, mode and contents hash of each member, so it changes exactly when the tar does
+	"""
+	digest = hashlib.sha256()
+	for member in members:
+		if member.is_dir:
+			record = [member.arcname, 'dir', member.mode]
+		else:
+			record = [member.arcname, 'file', member.mode, file_ops.hash_file_cached(member.path)]
+		digest.update(json.dumps(record).encode('utf-8'))
+		digest.update(b'\n')
+	return 'sha256:' + digest.hexdigest()
+
+def tar_info(member):
+	"""the tar header of a member, with the owner and timestamps cleared so the same context always gives the same tar"""
+	info = tarfile.TarInfo(member.arcname)
+	info.mode = member.mode
+	info.uid = 0
+	info.gid = 0
+	info.uname = ''
+	info.gname = ''
+	info.mtime = 0
+	if member.is_dir:
+		info.type = tarfile.DIRTYPE
+	else:
+		info.type = tarfile.REGTYPE
+		info.size = member.size
+	return info
+
+def write_context_tar(members, fp):
+	"""stream a deterministic tar of the build context into a binary file object (e.g. the stdin of "docker build -")"""
+	with tarfile.open(fileobj=fp, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+		for member in members:
+			if member.is_dir:
+				tar.addfile(tar_info(member))
+			else:
+				with open(member.path, 'rb') as member_fp:
+					tar.addfile(tar_info(member), member_fp)
+
+def find_image(digest):
+	"""the ID of a local image built from a context with the given digest, or None if there is none"""
+	output = subprocess.check_output(['docker', 'images', '--quiet', '--no-trunc', '--filter', 'label={label}={digest}'.format(label=CONTEXT_DIGEST_LABEL, digest=digest)])
+	image_ids = output.decode('utf-8', 'replace').split()
+	if len(image_ids)==0:
+		return None
+	return image_ids[0]
+
+def build_image(members, digest, tag, dockerfile='Dockerfile'):
+	"""build an image from the tar of a build context streamed to "docker build -", labelled with the digest of the context"""
+	proc = subprocess.Popen(['docker', 'build', '--rm', '-f', dockerfile, '--label', '{label}={digest}'.format(label=CONTEXT_DIGEST_LABEL, digest=digest), '-t', tag, '-'], stdin=subprocess.PIPE)
+	try:
+		write_context_tar(members, proc.stdin)
+	except BrokenPipeError:
+		# docker exited early, its return code says why
+		pass
+	finally:
+		try:
+			proc.stdin.close()
+		except BrokenPipeError:
+			pass
+	if proc.wait()!=0:
+		raise subprocess.CalledProcessError(proc.returncode, proc.args)
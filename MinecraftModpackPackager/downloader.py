@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+import os
+import re
+import hashlib
+import concurrent.futures
+
+import requests
+
+from MinecraftModpackPackager import progress
+
+CONTENT_RANGE_PATTERN = re.compile(r'^bytes\s+(\d+)-(\d+)/(\d+|\*)$')
+
+def parse_expected_hash(expected_hash):
+	"""split an expected hash of the form "<algorithm>:<hex digest>" (or just a sha256 hex digest) into its parts"""
+	if ':' in expected_hash:
+		algorithm, digest = expected_hash.split(':', 1)
+	else:
+		algorithm, digest = ('sha256', expected_hash)
+	return (algorithm.lower(), digest.lower())
+
+def response_validator(r):
+	"""the strong ETag of a response, or else its Last-Modified date, for resuming the download with If-Range; None if it has neither"""
+	etag = r.headers.get('ETag')
+	if not etag is None and not etag.startswith('W/'):
+		return etag
+	return r.headers.get('Last-Modified')
+
+def content_range_start(r):
+	"""the offset a partial (206) response starts at, from its Content-Range header, or None if the header is missing or invalid"""
+	match = CONTENT_RANGE_PATTERN.match(r.headers.get('Content-Range', ''))
+	if match is None:
+		return None
+	return int(match.group(1))
+
+def remove_file(filename):
+	"""delete a file if it exists"""
+	if os.path.isfile(filename):
+		os.remove(filename)
+
+def remove_part(part_filename, validator_filename):
+	"""delete a partial download along with its validator"""
+	remove_file(part_filename)
+	remove_file(validator_filename)
+
+class downloader(object):
+	"""
+	downloads files over a pooled HTTP session
+		data is written in large chunks to "<filename>.part", which is only renamed into place once the download is complete and verified
+		a leftover ".part" file from an interrupted download is resumed with an HTTP Range request, if the file on the server did not change since
+		downloads can optionally be verified against an expected hash ("sha1:<hex>", "sha256:<hex>", ...)
+	"""
+	def __init__(self, chunk_size=1024*1024, pool_size=8, timeout=60):
+		self.chunk_size = chunk_size
+		self.timeout = timeout
+		self.session = requests.Session()
+		adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+
+	def get(self, url, headers={}):
+		"""start a streaming GET request, falling back to not verifying certificates if the SSL handshake fails"""
+		try:
+			return self.session.get(url, stream=True, headers=headers, timeout=self.timeout)
+		except requests.exceptions.SSLError:
+			progress.warning("Downloading the file {} resulted in a SSL error! Falling back to not verifying certificates!".format(url))
+			return self.session.get(url, stream=True, headers=headers, timeout=self.timeout, verify=False)
+
+	def download(self, url, filename, expected_hash=None, tracker=None):
+		"""
+		downloads the file at the specified url and saves it to the specified filename, resuming a previous partial download if there is one
+			the ETag or Last-Modified of the file is kept in "<filename>.part.validator", and sent as If-Range when resuming
+			so a partial file is only appended to if the file on the server is still the same, and starts at the end of the partial file
+			otherwise (or if no validator was kept) the download starts over
+		if a progress tracker is given, the bytes downloaded are reported to it as they arrive (see progress)
+		"""
+		par_dir = os.path.dirname(filename)
+		if par_dir!='' and not os.path.isdir(par_dir):
+			os.makedirs(par_dir, exist_ok=True)
+		part_filename = filename + '.part'
+		validator_filename = part_filename + '.validator'
+		while True:
+			file_hash = None
+			if not expected_hash is None:
+				algorithm, digest = parse_expected_hash(expected_hash)
+				file_hash = hashlib.new(algorithm)
+			offset = 0
+			if os.path.isfile(part_filename) and os.path.isfile(validator_filename):
+				offset = os.path.getsize(part_filename)
+			headers = {}
+			if offset > 0:
+				with open(validator_filename, 'r') as fp:
+					headers['If-Range'] = fp.read()
+				headers['Range'] = 'bytes={}-'.format(offset)
+			with self.get(url, headers=headers) as r:
+				if offset > 0 and (r.status_code==416 or (r.status_code==206 and content_range_start(r)!=offset)):
+					# the partial file does not match the file on the server (e.g. the file changed) - start over
+					remove_part(part_filename, validator_filename)
+					continue
+				r.raise_for_status()
+				if r.status_code!=206:
+					offset = 0
+					validator = response_validator(r)
+					remove_file(validator_filename)
+					if not validator is None:
+						with open(validator_filename, 'w') as fp:
+							fp.write(validator)
+				total_size = None
+				if 'Content-Length' in r.headers and not 'Content-Encoding' in r.headers:
+					total_size = offset + int(r.headers['Content-Length'])
+				if not tracker is None:
+					tracker.add_total(1, total_size)
+					tracker.advance(0, offset)
+				if offset > 0 and not file_hash is None:
+					with open(part_filename, 'rb') as fp:
+						for chunk in iter(lambda: fp.read(self.chunk_size), b''):
+							file_hash.update(chunk)
+				with open(part_filename, 'ab' if offset > 0 else 'wb') as fd:
+					for chunk in r.iter_content(chunk_size=self.chunk_size):
+						fd.write(chunk)
+						if not file_hash is None:
+							file_hash.update(chunk)
+						if not tracker is None:
+							tracker.advance(0, len(chunk))
+			break
+		size = os.path.getsize(part_filename)
+		if not total_size is None and size!=total_size:
+			raise Exception('Download of "{url}" stopped after {size} of {total_size} bytes! Run again to resume it.'.format(url=url, size=size, total_size=total_size))
+		if not file_hash is None and file_hash.hexdigest()!=digest:
+			remove_part(part_filename, validator_filename)
+			raise Exception('Downloaded file "{url}" has {algorithm} hash {actual}, expected {expected}!'.format(url=url, algorithm=algorithm, actual=file_hash.hexdigest(), expected=digest))
+		os.replace(part_filename, filename)
+		remove_file(validator_filename)
+		if not tracker is None:
+			tracker.advance(1, 0)
+		return filename
+
+	def download_many(self, jobs, workers=4):
+		"""
+		download several files at the same time
+		jobs is a list of (url, filename) or (url, filename, expected_hash) tuples
+		every download is attempted, and the first error (if any) is raised once they have all finished
+		"""
+		with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+			futures = [executor.submit(self.download, *job) for job in jobs]
+			concurrent.futures.wait(futures)
+		return [future.result() for future in futures]
+
+default_downloader = downloader()
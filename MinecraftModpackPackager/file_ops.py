@@ -1,97 +1,286 @@
 #!/usr/bin/env python
 
 import os
-import shutil
+import fnmatch
+import hashlib
+import threading
+import types
+import concurrent.futures
 
-import requests
+from MinecraftModpackPackager import zip_writer
+from MinecraftModpackPackager import copy_backend
+from MinecraftModpackPackager import downloader
+from MinecraftModpackPackager import instrumentation
+from MinecraftModpackPackager import progress
 
-def copy_file(src, dest):
-	"""copies the contents of a file into another file"""
+# default number of threads copy_directory copies files with
+COPY_WORKERS = 8
+
+def hash_file(filename, chunk_size=1024*1024):
+	"""calculates the sha256 hash of the contents of a file, returned as a hex string"""
+	file_hash = hashlib.sha256()
+	size = 0
+	with open(filename, 'rb') as fp:
+		for chunk in iter(lambda: fp.read(chunk_size), b''):
+			file_hash.update(chunk)
+			size += len(chunk)
+	instrumentation.default_recorder.count_read(1, size)
+	return file_hash.hexdigest()
+
+class hash_memo(object):
+	"""
+	in-memory record of file hashes, keyed by path, size, and mtime
+	shared by every build in the process (see batch_package), so files used by several builds are only hashed once
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.hashes = {}
+
+	def hash_file(self, filename):
+		"""the sha256 hash of a file, calculated only if the file changed since it was last hashed"""
+		file_stat = os.stat(filename)
+		key = (os.path.abspath(filename), file_stat.st_size, file_stat.st_mtime_ns)
+		with self.lock:
+			file_hash = self.hashes.get(key)
+		if file_hash is None:
+			file_hash = hash_file(filename)
+			with self.lock:
+				self.hashes[key] = file_hash
+		return file_hash
+
+default_hash_memo = hash_memo()
+
+def hash_file_cached(filename):
+	"""calculates the sha256 hash of a file like hash_file, reusing the result of an earlier call if the file has not changed since"""
+	return default_hash_memo.hash_file(filename)
+
+def unlink_if_exists(filename):
+	"""
+	removes filename if it exists
+	used before rewriting a file, so the new contents go into a new file instead of one that may be hardlinked into another package
+	"""
+	if os.path.lexists(filename):
+		os.remove(filename)
+
+def is_read_only(path, read_only):
+	"""
+	check whether a file should be treated as a read-only input that may be hardlinked
+	read_only is either a bool applying to every file, or a list of file extensions (e.g. ['.jar'])
+	"""
+	if read_only in [True, False]:
+		return read_only
+	return os.path.splitext(path)[1].lower() in read_only
+
+def copy_file(src, dest, cache=None, read_only=False):
+	"""
+	copies the contents of a file into another file, returning the name of the copy strategy used (see copy_backend)
+	if a build cache is given, the copy is skipped when dest already holds the current contents of src
+	if read_only is set, src is never modified in place, so it may be hardlinked instead of copied
+	"""
+	if not cache is None and cache.is_current(src, dest):
+		cache.touch(dest)
+		return 'cached'
 	if not os.path.isdir(os.path.dirname(dest)):
-		os.makedirs(os.path.dirname(dest))
-	shutil.copy2(src, dest)
+		os.makedirs(os.path.dirname(dest), exist_ok=True)
+	strategy = copy_backend.default_backend.copy(src, dest, read_only=read_only)
+	if not cache is None:
+		cache.record(src, dest)
+	return strategy
 
-def copy_directory(src, dest, exclude=[]):
+def render_file(template, src, dest, relpath, cache=None):
+	"""
+	write a copy of src to dest with its template placeholders filled in (see template_engine), returning 'template'
+	files that turn out not to be text are copied as-is
+	"""
+	if not os.path.isdir(os.path.dirname(dest)):
+		os.makedirs(os.path.dirname(dest), exist_ok=True)
+	try:
+		template.render_file(src, dest, relpath=relpath)
+	except UnicodeDecodeError:
+		progress.warning('"{}" is not a text file! Copying it without filling in placeholders...'.format(src))
+		return copy_file(src, dest, cache=cache)
+	instrumentation.default_recorder.count_read(1, os.path.getsize(src))
+	instrumentation.default_recorder.count_written(1, os.path.getsize(dest))
+	if not cache is None:
+		# rendered on every build, since the template values may change while src does not
+		cache.touch(dest)
+	return 'template'
+
+class exclude_trie(object):
+	"""
+	exclude list compiled into a tree of path components, so it is only parsed once per copy
+		each component may be a glob pattern (e.g. "*.log" or "crash-reports")
+		a node is excluded when a complete exclude path ends at it
+	"""
+	def __init__(self, exclude=[]):
+		self.excluded = False
+		self.children = {}
+		self.patterns = []
+		for path in exclude:
+			self.add(path)
+
+	@staticmethod
+	def split_path(path):
+		"""split a path into its components, accepting both os.sep and '/' as separators"""
+		return [part for part in path.replace(os.sep, '/').split('/') if part!='']
+
+	def add(self, path):
+		"""add an exclude path to the tree"""
+		node = self
+		for part in self.split_path(path):
+			if any([c in part for c in '*?[']):
+				for pattern, child in node.patterns:
+					if pattern==part:
+						break
+				else:
+					child = exclude_trie()
+					node.patterns.append((part, child))
+			else:
+				if not part in node.children:
+					node.children[part] = exclude_trie()
+				child = node.children[part]
+			node = child
+		node.excluded = True
+
+	def match(self, name):
+		"""all child nodes a directory entry called name matches"""
+		matches = []
+		if name in self.children:
+			matches.append(self.children[name])
+		for pattern, child in self.patterns:
+			if fnmatch.fnmatch(name, pattern):
+				matches.append(child)
+		return matches
+
+def walk_directory(src, exclude=[]):
+	"""
+	iterate over the contents of a directory (src), skipping anything specified in exclude
+	yields (relative path, os.DirEntry) tuples, with each directory yielded before its contents
+	uses os.scandir, so file types (and on Windows the whole stat result) come from the directory listing without extra stat calls
+	"""
+	stack = [(src, '', [exclude_trie(exclude)])]
+	while len(stack) > 0:
+		dir_path, dir_rel, nodes = stack.pop()
+		with os.scandir(dir_path) as it:
+			dir_entries = sorted(it, key=lambda e: e.name)
+		sub_dirs = []
+		for entry in dir_entries:
+			matches = []
+			for node in nodes:
+				matches.extend(node.match(entry.name))
+			if any([node.excluded for node in matches]):
+				continue
+			rel = os.path.join(dir_rel, entry.name)
+			yield (rel, entry)
+			if entry.is_dir():
+				sub_dirs.append((entry.path, rel, matches))
+		stack.extend(reversed(sub_dirs))
+
+def copy_directory(src, dest, exclude=[], cache=None, read_only=False, workers=None, template=None):
 	"""
 	copy directory and its contents from one place (src) to another (dest)
 	if dest does not exist, create the folder
-	do not copy any files or directories specified in exclude
-	"""
-	def path_first_split(path):
-		head, tail = os.path.split(path)
-		if head=='':
-			return (tail, '')
-		else:
-			first, rest = path_first_split(head)
-			if tail=='':
-				return (first, rest)
-			else:
-				return (first, os.path.join(rest, tail))
+	do not copy any files or directories specified in exclude (path components may be glob patterns)
+	if a build cache is given, only files whose contents changed since the last copy are copied
+	read_only (a bool, or a list of file extensions) marks files that may be hardlinked instead of copied
+	files are copied on a pool of workers threads, since per-file latency dominates on network and WSL mounts
+	the files and bytes copied are reported as progress events (see progress)
+	if a template_engine is given, files matching its rules (by their path relative to dest) are rendered instead of copied
+	"""
+	with instrumentation.default_recorder.operation('file_ops.copy_directory'):
+		copy_entries(list(walk_directory(src, exclude=exclude)), dest, cache=cache, read_only=read_only, workers=workers, template=template)
+
+def copy_entries(entries, dest, cache=None, read_only=False, workers=None, template=None):
+	"""
+	copy the (relative path, os.DirEntry) tuples of a directory listing (see walk_directory) into dest, like copy_directory
+	lets a directory that was already scanned (see build_plan) be copied without walking it again
+	"""
+	if workers is None:
+		workers = COPY_WORKERS
 	if not os.path.isdir(dest):
 		os.makedirs(dest)
-	if False and len(exclude)==0: # temporarily disabled this case - just use my own implementation for this TODO: find more efficient implementation
-		shutil.copytree(src, dest)
-	else:
-		exclude_split = [path_first_split(ex) for ex in exclude]
-		exclude_dict = {}
-		for first, rest in exclude_split:
-			if not first in exclude_dict:
-				exclude_dict[first] = []
-			exclude_dict[first].append(rest)
-		for first in exclude_dict:
-			if '' in exclude_dict[first]:
-				#don't copy this file/folder
-				pass
-			else:
-				first_path = os.path.join(src, first)
-				first_dest_path = os.path.join(dest, first)
-				if os.path.isdir(first_path):
-					#copy this with modified exclude list
-					copy_directory(first_path, first_dest_path, exclude=exclude_dict[first])
-		dont_recurse_norm = [ex[0] for ex in exclude_split]
-		contents = os.listdir(src)
-		for cont in contents:
-			if not cont in dont_recurse_norm:
-				cont_path = os.path.join(src, cont)
-				cont_dest_path = os.path.join(dest, cont)
-				if os.path.isdir(cont_path):
-					copy_directory(cont_path, cont_dest_path)
+	if not cache is None:
+		cache.touch(dest)
+	# the copies on the pool count towards the phase the copy was started in (see instrumentation)
+	bound_copy_file = instrumentation.default_recorder.bind(copy_file)
+	bound_render_file = instrumentation.default_recorder.bind(render_file)
+	with progress.default_reporter.tracker('copy_directory') as tracker:
+		sizes = {}
+		if tracker.enabled:
+			# the sizes only cost a stat per file (none on Windows), so they are only read when progress is reported
+			sizes = dict([(rel, entry.stat().st_size) for rel, entry in entries if not entry.is_dir()])
+			tracker.add_total(len(sizes), sum(sizes.values()))
+		def copy_and_advance(func, rel, *args, **kwargs):
+			strategy = func(*args, **kwargs)
+			tracker.advance(1, sizes.get(rel, 0))
+			return strategy
+		with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+			pending = []
+			for rel, entry in entries:
+				dest_path = os.path.join(dest, rel)
+				if entry.is_dir():
+					if not os.path.isdir(dest_path):
+						os.makedirs(dest_path)
+					if not cache is None:
+						cache.touch(dest_path)
+				elif not template is None and template.matches(rel):
+					pending.append(executor.submit(copy_and_advance, bound_render_file, rel, template, entry.path, dest_path, rel, cache=cache))
 				else:
-					copy_file(cont_path, cont_dest_path)
+					pending.append(executor.submit(copy_and_advance, bound_copy_file, rel, entry.path, dest_path, cache=cache, read_only=is_read_only(rel, read_only)))
+				# keep a bounded number of copies and renders queued, and fail early if one of them failed
+				while len(pending) > workers*4:
+					pending.pop(0).result()
+			for future in pending:
+				future.result()
 
-def create_zip(directory, archive):
-	"""create a zip archive containing the contents of a directory, with the filename specified in archive"""
+def create_zip(directory, archive, compresslevel=6, workers=None):
+	"""
+	create a zip archive containing the contents of a directory, with the filename specified in archive
+	entries are compressed in parallel on workers threads (defaults to one per CPU), and already-compressed file types are stored as-is
+	the files and bytes written into the archive are reported as progress events (see progress)
+	"""
 	if not os.path.isdir(os.path.dirname(archive)):
 		os.makedirs(os.path.dirname(archive))
-	basename, ext = os.path.splitext(archive)
-	shutil.make_archive(basename, 'zip', directory)
-	if ext!='.zip':
-		archive_name = basename+'.zip'
-		os.rename(archive_name, archive)
+	with instrumentation.default_recorder.operation('file_ops.create_zip'):
+		with progress.default_reporter.tracker('create_zip') as tracker:
+			zip_writer.write_zip(archive, zip_writer.directory_entries(directory), compresslevel=compresslevel, workers=workers, tracker=tracker)
+
+def replace_in_string(contents, rep):
+	"""replaces parts of contents matching keys in the given dict with the contents of the paired value in the dict"""
+	for find in rep:
+		contents = contents.replace(find, rep[find])
+	return contents
 
 def replace_in_file(filename, rep):
 	"""replaces contents of filename matching keys in the given dict with the contents of the paired value in the dict"""
 	with open(filename, 'r') as fp:
 		file_contents = fp.read()
-	for find in rep:
-		file_contents = file_contents.replace(find, rep[find])
+	unlink_if_exists(filename)
 	with open(filename, 'w') as fp:
-		fp.write(file_contents)
-
-def download_file(url, filename):
-	"""downloads the file at the specified url and saves it to the specified filename"""
-	par_dir = os.path.dirname(filename)
-	if not os.path.isdir(par_dir):
-		if par_dir!='':
-			os.makedirs(par_dir)
-	try:
-		r = requests.get(url, stream=True)
-	except requests.exceptions.SSLError:
-		warn_msg = "WARNING! Downloading the file {} resulted in a SSL error! Falling back to not verifying certificates!".format(url)
-		print(warn_msg)
-		print(warn_msg)
-		print(warn_msg+" [message repeated for visibility]")
-		r = requests.get(url, stream=True, verify=False)
-	with open(filename, 'wb') as fd:
-		for chunk in r.iter_content(chunk_size=128):
-			fd.write(chunk)
+		fp.write(replace_in_string(file_contents, rep))
+
+def download_file(url, filename, expected_hash=None):
+	"""
+	downloads the file at the specified url and saves it to the specified filename
+	uses the shared downloader, so connections are pooled, interrupted downloads resume, and the file only appears once it is complete
+	if expected_hash is given (e.g. "sha1:<hex>"), the download is verified against it
+	the bytes downloaded are reported as progress events (see progress)
+	"""
+	with instrumentation.default_recorder.operation('file_ops.download_file'):
+		with progress.default_reporter.tracker('download_file') as tracker:
+			result = downloader.default_downloader.download(url, filename, expected_hash=expected_hash, tracker=tracker)
+	instrumentation.default_recorder.count_written(1, os.path.getsize(filename))
+	return result
+
+def load_server_script(name):
+	"""
+	load a script shipped in additional_server_files (e.g. "apply_delta"), which is not a package, as a module
+	the source is compiled directly instead of imported, so no __pycache__ is written into additional_server_files (it would end up in every server package)
+	"""
+	filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'additional_server_files', '{}.py'.format(name))
+	with open(filename, 'r') as fp:
+		code = compile(fp.read(), filename, 'exec')
+	module = types.ModuleType(name)
+	module.__file__ = filename
+	exec(code, module.__dict__)
+	return module
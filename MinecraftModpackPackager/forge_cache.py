@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import shutil
+import threading
+import subprocess
+import collections
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+	import msvcrt
+
+from MinecraftModpackPackager import file_ops
+from MinecraftModpackPackager import progress
+
+class file_lock(object):
+	"""
+	lock held on a lock file, so several packager processes can coordinate
+		uses fcntl.flock on posix systems, where shared locks allow several readers at once
+		uses msvcrt.locking on Windows, where every lock is exclusive
+	"""
+	def __init__(self, path, shared=False):
+		self.path = path
+		self.shared = shared
+		self.fp = None
+
+	def acquire(self, blocking=True):
+		"""take the lock, waiting for other holders unless blocking is False; returns whether the lock was taken"""
+		if not os.path.isdir(os.path.dirname(self.path)):
+			os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		self.fp = open(self.path, 'a+')
+		try:
+			if not fcntl is None:
+				flags = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+				if not blocking:
+					flags = flags | fcntl.LOCK_NB
+				fcntl.flock(self.fp.fileno(), flags)
+			else:
+				self.fp.seek(0)
+				while True:
+					try:
+						msvcrt.locking(self.fp.fileno(), msvcrt.LK_NBLCK, 1)
+						break
+					except OSError:
+						if not blocking:
+							raise
+						time.sleep(0.1)
+		except OSError:
+			self.fp.close()
+			self.fp = None
+			return False
+		return True
+
+	def downgrade(self):
+		"""turn a held exclusive lock into a shared one (a no-op on Windows, where it stays exclusive)"""
+		if not fcntl is None:
+			fcntl.flock(self.fp.fileno(), fcntl.LOCK_SH)
+		self.shared = True
+
+	def release(self):
+		"""give up the lock"""
+		if self.fp is None:
+			return
+		if not fcntl is None:
+			fcntl.flock(self.fp.fileno(), fcntl.LOCK_UN)
+		else:
+			self.fp.seek(0)
+			msvcrt.locking(self.fp.fileno(), msvcrt.LK_UNLCK, 1)
+		self.fp.close()
+		self.fp = None
+
+	def __enter__(self):
+		self.acquire()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.release()
+
+class counted_lock(object):
+	"""
+	a lock on a cache entry shared by every build in this process that uses the entry, given up when the last of them releases it
+	flock locks taken on separate files conflict even within a process, so each build of a batch taking its own lock would leave them waiting on each other
+	"""
+	def __init__(self, path, entry_lock):
+		self.path = path
+		self.entry_lock = entry_lock
+		self.users = 1
+
+	def release(self):
+		"""give up the lock of one user, releasing the file lock once no build in the process uses the entry"""
+		with held_locks_lock:
+			self.users = self.users - 1
+			if self.users > 0:
+				return
+			del held_locks[self.path]
+			self.entry_lock.release()
+
+# the counted_locks held by this process, by lock file
+held_locks = {}
+held_locks_lock = threading.Lock()
+# serializes the threads of this process looking up or installing the same entry, by lock file
+entry_mutexes = collections.defaultdict(threading.Lock)
+
+def directory_size(path):
+	"""total size of all files in a directory"""
+	return sum([entry.stat().st_size for _, entry in file_ops.walk_directory(path) if entry.is_file()])
+
+class forge_cache(object):
+	"""
+	shared cache of forge installers and server installs, used by every packager run on the machine
+		installers are kept in "installers", and installs in "installs/forge-<version>-<installer hash>"
+		every entry is protected by a file lock, so parallel builds wait for each other instead of installing into the same folder
+		builds hold a shared lock on the install they use, so it is never evicted while files are hardlinked or copied out of it
+		installs are evicted least-recently-used first once they take up more than max_size bytes
+	"""
+	def __init__(self, cache_dir=os.path.join(os.path.expanduser('~'), '.mc_forge_installs'), max_size=None):
+		self.cache_dir = cache_dir
+		self.max_size = max_size
+		self.installers_dir = os.path.join(self.cache_dir, 'installers')
+		self.installs_dir = os.path.join(self.cache_dir, 'installs')
+		self.locks_dir = os.path.join(self.cache_dir, 'locks')
+		self.index_fname = os.path.join(self.cache_dir, 'index.json')
+
+	def lock(self, name, shared=False):
+		"""a lock on a single cache entry (or on the index)"""
+		return file_lock(os.path.join(self.locks_dir, '{}.lock'.format(name)), shared=shared)
+
+	def installer_path(self, version):
+		"""where the installer for a forge version is kept"""
+		return os.path.join(self.installers_dir, 'forge-{}-installer.jar'.format(version))
+
+	def ensure_installer(self, version, url):
+		"""download the installer for a forge version, unless it is already in the cache"""
+		installer_path = self.installer_path(version)
+		with self.lock('installer-{}'.format(version)):
+			if not os.path.isfile(installer_path):
+				progress.message("Downloading installer for forge {ver} (URL: {url})...".format(ver=version,url=url))
+				file_ops.download_file(url, installer_path)
+		return installer_path
+
+	def install_name(self, version, installer_path):
+		"""the name of the install of a forge version made with a given installer"""
+		return 'forge-{version}-{hash}'.format(version=version, hash=file_ops.hash_file_cached(installer_path)[:16])
+
+	def find_install(self, version, universal_filename):
+		"""the install directory of a forge version if it is already in the cache, or None; nothing is downloaded, installed or locked"""
+		installer_path = self.installer_path(version)
+		if not os.path.isfile(installer_path):
+			return None
+		install_dir = os.path.join(self.installs_dir, self.install_name(version, installer_path))
+		if not os.path.isfile(os.path.join(install_dir, universal_filename)):
+			return None
+		return install_dir
+
+	def ensure_install(self, version, url, universal_filename):
+		"""
+		install the server for a forge version into the cache, unless it is already there
+		returns the install directory and a shared lock on it (a counted_lock), which the caller releases once it is done with the install
+		"""
+		installer_path = self.ensure_installer(version, url)
+		install_name = self.install_name(version, installer_path)
+		install_dir = os.path.join(self.installs_dir, install_name)
+		install_lock = self.lock(install_name)
+		with held_locks_lock:
+			entry_mutex = entry_mutexes[install_lock.path]
+		with entry_mutex:
+			with held_locks_lock:
+				held = held_locks.get(install_lock.path)
+				if not held is None:
+					held.users = held.users + 1
+			if held is None:
+				held = self.lock_install(install_lock, install_dir, install_name, version, universal_filename)
+				with held_locks_lock:
+					held_locks[install_lock.path] = held
+			else:
+				# another build in this process already holds the install, so it is there and cannot be evicted
+				try:
+					self.update_index(install_name, version)
+				except:
+					held.release()
+					raise
+		return (install_dir, held)
+
+	def lock_install(self, install_lock, install_dir, install_name, version, universal_filename):
+		"""
+		take the file lock on an install, installing it first if it is not there yet; returns it as a counted_lock
+			a shared lock is taken first, so builds using an install that is already there do not wait for each other
+			only if the install is missing is the lock taken exclusively to install it, then turned back into a shared one
+		"""
+		installer_path = self.installer_path(version)
+		install_lock.shared = True
+		install_lock.acquire()
+		try:
+			if os.path.isfile(os.path.join(install_dir, universal_filename)):
+				self.update_index(install_name, version)
+				return counted_lock(install_lock.path, install_lock)
+		except:
+			install_lock.release()
+			raise
+		install_lock.release()
+		install_lock.shared = False
+		install_lock.acquire()
+		try:
+			# another process may have installed it while no lock was held
+			if not os.path.isfile(os.path.join(install_dir, universal_filename)):
+				temp_install_dir = install_dir + '.tmp'
+				if os.path.isdir(temp_install_dir):
+					progress.message('Removing incomplete forge installation "{}" (Possibly from previous failed build?)...'.format(temp_install_dir))
+					shutil.rmtree(temp_install_dir)
+				os.makedirs(temp_install_dir)
+				progress.message('Installing forge {forge_version} into "{forge_install_dir_path}"...'.format(forge_version=version,forge_install_dir_path=install_dir))
+				subprocess.check_call(['java', '-jar', os.path.abspath(installer_path), '--installServer'], cwd=temp_install_dir)
+				if not os.path.isfile(os.path.join(temp_install_dir, universal_filename)):
+					raise Exception('Forge installer did not create "{}"!'.format(universal_filename))
+				if os.path.isdir(install_dir):
+					shutil.rmtree(install_dir)
+				os.replace(temp_install_dir, install_dir)
+				progress.message("Forge installation complete!")
+			self.update_index(install_name, version)
+		except:
+			install_lock.release()
+			raise
+		# keep holding the lock (shared from now on), so the install cannot be evicted while it is in use
+		install_lock.downgrade()
+		return counted_lock(install_lock.path, install_lock)
+
+	def evict_if_needed(self):
+		"""evict old installs if the cache takes up more than max_size bytes"""
+		if not self.max_size is None:
+			self.evict(self.max_size)
+
+	def load_index(self):
+		"""read the index of installs (their size and when they were last used)"""
+		if not os.path.isfile(self.index_fname):
+			return {}
+		with open(self.index_fname, 'r') as fp:
+			return json.load(fp)
+
+	def save_index(self, index):
+		"""write the index of installs, replacing the previous one atomically"""
+		tmp_fname = self.index_fname + '.tmp'
+		with open(tmp_fname, 'w') as fp:
+			json.dump(index, fp, indent=1)
+		os.replace(tmp_fname, self.index_fname)
+
+	def update_index(self, install_name, version):
+		"""record that an install was just used"""
+		with self.lock('index'):
+			index = self.load_index()
+			if not install_name in index:
+				index[install_name] = {
+					'version':version,
+					'size':directory_size(os.path.join(self.installs_dir, install_name)),
+				}
+			index[install_name]['last_used'] = time.time()
+			self.save_index(index)
+
+	def evict(self, max_size):
+		"""delete the least recently used installs until the cache takes up at most max_size bytes, skipping installs that are in use"""
+		with self.lock('index'):
+			index = self.load_index()
+			total_size = sum([entry['size'] for entry in index.values()])
+			for install_name in sorted(index, key=lambda name: index[name]['last_used']):
+				if total_size <= max_size:
+					break
+				entry_lock = self.lock(install_name)
+				if not entry_lock.acquire(blocking=False):
+					continue
+				try:
+					progress.message('Evicting forge installation "{}" from the cache...'.format(install_name))
+					install_dir = os.path.join(self.installs_dir, install_name)
+					if os.path.isdir(install_dir):
+						shutil.rmtree(install_dir)
+					total_size = total_size - index.pop(install_name)['size']
+				finally:
+					entry_lock.release()
+			self.save_index(index)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+import io
+import json
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+
+from MinecraftModpackPackager import progress
+
+class phase_stats(object):
+	"""what was measured for a single phase of the packager"""
+	def __init__(self, name):
+		self.name = name
+		self.runs = 0
+		self.wall = 0.0
+		self.cpu = 0.0
+		self.files_read = 0
+		self.bytes_read = 0
+		self.files_written = 0
+		self.bytes_written = 0
+		self.operations = {}
+
+	def as_dict(self):
+		"""the stats as stored in the JSON report, with throughput calculated from the wall time"""
+		return {
+			'runs':self.runs,
+			'wall_seconds':self.wall,
+			'cpu_seconds':self.cpu,
+			'files_read':self.files_read,
+			'bytes_read':self.bytes_read,
+			'files_written':self.files_written,
+			'bytes_written':self.bytes_written,
+			'read_mb_per_second':self.bytes_read / 1024 / 1024 / self.wall if self.wall > 0 else None,
+			'write_mb_per_second':self.bytes_written / 1024 / 1024 / self.wall if self.wall > 0 else None,
+			'operations':dict([(name, {'calls':calls, 'wall_seconds':wall}) for name, (calls, wall) in sorted(self.operations.items())]),
+		}
+
+class recorder(object):
+	"""
+	records the wall time, CPU time, and files and bytes read and written by each phase of the packager (see phase)
+		the phase running on a thread is kept in a thread-local, and handed to worker threads by bind, so work done on thread pools counts towards the phase that started it
+		CPU time is counted per thread, so phases running at the same time on other threads are not counted twice
+		I/O done outside of any phase is not recorded
+		with profile set, every phase (and the work bound to it) also runs under cProfile, and the results are merged for dump_profile
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.local = threading.local()
+		self.phases = {}
+		self.totals = {}
+		self.profile = False
+		self.profile_stats = None
+		self.profile_warned = False
+
+	def reset(self):
+		"""forget everything recorded so far"""
+		with self.lock:
+			self.phases = {}
+			self.totals = {}
+			self.profile_stats = None
+
+	def current(self):
+		"""the stats of the phase running on this thread, or None"""
+		return getattr(self.local, 'phase', None)
+
+	def start_profile(self):
+		"""start profiling this thread, returning the profiler (or None if profiling is off or another profiler is already active)"""
+		if not self.profile:
+			return None
+		profiler = cProfile.Profile()
+		try:
+			profiler.enable()
+		except ValueError:
+			# only one profiler can be active at a time on some Python versions
+			with self.lock:
+				if not self.profile_warned:
+					progress.warning('Another profiler is already active! Work running at the same time on other threads is left out of the profile...')
+					self.profile_warned = True
+			return None
+		return profiler
+
+	def stop_profile(self, profiler):
+		"""stop a profiler started by start_profile, and merge its results"""
+		if profiler is None:
+			return
+		profiler.disable()
+		with self.lock:
+			if self.profile_stats is None:
+				self.profile_stats = pstats.Stats(profiler, stream=io.StringIO())
+			else:
+				self.profile_stats.add(profiler)
+
+	@contextlib.contextmanager
+	def run_as(self, stats):
+		"""count everything done on this thread inside the with block towards stats, including the CPU time of the thread"""
+		previous = self.current()
+		self.local.phase = stats
+		profiler = self.start_profile()
+		start_cpu = time.thread_time()
+		try:
+			yield stats
+		finally:
+			cpu = time.thread_time() - start_cpu
+			self.stop_profile(profiler)
+			self.local.phase = previous
+			with self.lock:
+				stats.cpu += cpu
+
+	@contextlib.contextmanager
+	def phase(self, name):
+		"""measure a phase of the packager, which is everything done inside the with block (phases with the same name are added up)"""
+		with self.lock:
+			if not name in self.phases:
+				self.phases[name] = phase_stats(name)
+			stats = self.phases[name]
+		start_wall = time.perf_counter()
+		try:
+			with self.run_as(stats):
+				yield stats
+		finally:
+			wall = time.perf_counter() - start_wall
+			with self.lock:
+				stats.runs += 1
+				stats.wall += wall
+
+	def bind(self, func):
+		"""wrap func so it counts towards the phase running on this thread, wherever it is called (e.g. when submitted to a thread pool)"""
+		stats = self.current()
+		if stats is None:
+			return func
+		def bound(*args, **kwargs):
+			with self.run_as(stats):
+				return func(*args, **kwargs)
+		return bound
+
+	@contextlib.contextmanager
+	def operation(self, name):
+		"""measure a call of a primitive operation (e.g. "file_ops.copy_directory") within the current phase"""
+		stats = self.current()
+		start_wall = time.perf_counter()
+		try:
+			yield
+		finally:
+			if not stats is None:
+				wall = time.perf_counter() - start_wall
+				with self.lock:
+					calls, total = stats.operations.get(name, (0, 0.0))
+					stats.operations[name] = (calls + 1, total + wall)
+
+	def count_read(self, files, size):
+		"""record files read (size in bytes) by the current phase"""
+		stats = self.current()
+		if not stats is None:
+			with self.lock:
+				stats.files_read += files
+				stats.bytes_read += size
+
+	def count_written(self, files, size):
+		"""record files written (size in bytes) by the current phase"""
+		stats = self.current()
+		if not stats is None:
+			with self.lock:
+				stats.files_written += files
+				stats.bytes_written += size
+
+	def set_total(self, name, value):
+		"""record a value describing the whole run (e.g. "elapsed_seconds"), stored under "totals" in the report"""
+		with self.lock:
+			self.totals[name] = value
+
+	def report(self):
+		"""everything recorded, as stored in the JSON report"""
+		with self.lock:
+			return {'phases':dict([(name, stats.as_dict()) for name, stats in self.phases.items()]), 'totals':dict(self.totals)}
+
+	def write_report(self, fname):
+		"""write the report to a JSON file"""
+		with open(fname, 'w') as fp:
+			json.dump(self.report(), fp, indent=2)
+
+	def summary(self):
+		"""the report as a table of lines, one per phase"""
+		lines = []
+		for name, stats in self.report()['phases'].items():
+			lines.append('  {name:<28} wall {wall:8.2f}s  cpu {cpu:8.2f}s  read {files_read:>6} files {mb_read:9.1f} MiB  wrote {files_written:>6} files {mb_written:9.1f} MiB'.format(
+				name=name,
+				wall=stats['wall_seconds'],
+				cpu=stats['cpu_seconds'],
+				files_read=stats['files_read'],
+				mb_read=stats['bytes_read'] / 1024 / 1024,
+				files_written=stats['files_written'],
+				mb_written=stats['bytes_written'] / 1024 / 1024,
+			))
+		return '\n'.join(lines)
+
+	def dump_profile(self, fname):
+		"""write the merged cProfile results to a file pstats can read (e.g. "python -m pstats <fname>"); returns whether there were any"""
+		with self.lock:
+			if self.profile_stats is None:
+				return False
+			self.profile_stats.dump_stats(fname)
+			return True
+
+default_recorder = recorder()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+import os
+import re
+import mmap
+import json
+import zlib
+import struct
+import hashlib
+import zipfile
+
+from MinecraftModpackPackager import file_ops
+from MinecraftModpackPackager import progress
+
+MCMOD_INFO_NAME = 'mcmod.info'
+MODS_TOML_NAME = 'META-INF/mods.toml'
+FABRIC_MOD_JSON_NAME = 'fabric.mod.json'
+
+# zip structures, see the .ZIP file format specification (APPNOTE.TXT)
+END_OF_CENTRAL_DIRECTORY = struct.Struct('<4s4H2LH')
+END_OF_CENTRAL_DIRECTORY_SIGNATURE = b'PK\x05\x06'
+CENTRAL_DIRECTORY_ENTRY = struct.Struct('<4s6H3L5H2L')
+CENTRAL_DIRECTORY_ENTRY_SIGNATURE = b'PK\x01\x02'
+LOCAL_FILE_HEADER = struct.Struct('<4s5H3L2H')
+LOCAL_FILE_HEADER_SIGNATURE = b'PK\x03\x04'
+# the end of central directory record is followed by a comment of at most 65535 bytes
+MAX_END_OF_CENTRAL_DIRECTORY_SIZE = END_OF_CENTRAL_DIRECTORY.size + 0xFFFF
+
+TOML_TABLE_PATTERN = re.compile(r'^\[\[?\s*([^\]]+?)\s*\]\]?\s*(#.*)?$')
+TOML_STRING_PATTERN = re.compile(r'''^([A-Za-z0-9_.-]+)\s*=\s*(?:"((?:[^"\\]|\\.)*)"|'([^']*)')\s*(#.*)?$''')
+
+class jar_reader(object):
+	"""
+	reads the central directory of a jar (or any zip) through mmap, and single members without touching the rest of the jar
+	zip64 and encrypted jars raise zipfile.BadZipFile, so the caller can fall back to zipfile
+	"""
+	def __init__(self, jar_path):
+		self.jar_path = jar_path
+		with open(jar_path, 'rb') as fp:
+			if os.fstat(fp.fileno()).st_size==0:
+				raise zipfile.BadZipFile('File is empty')
+			self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			self.members = self.read_central_directory()
+		except (struct.error, IndexError) as e:
+			self.close()
+			raise zipfile.BadZipFile('Truncated zip structure: {}'.format(e))
+		except zipfile.BadZipFile:
+			self.close()
+			raise
+
+	def read_central_directory(self):
+		"""the members of the jar, as a dict of name: (compression method, flags, compressed size, local header offset), in order"""
+		search_start = max(0, len(self.mm) - MAX_END_OF_CENTRAL_DIRECTORY_SIZE)
+		end_offset = self.mm.rfind(END_OF_CENTRAL_DIRECTORY_SIGNATURE, search_start)
+		if end_offset < 0:
+			raise zipfile.BadZipFile('File is not a zip file')
+		(_, _, _, _, entry_count, directory_size, directory_offset, _) = END_OF_CENTRAL_DIRECTORY.unpack_from(self.mm, end_offset)
+		if entry_count==0xFFFF or directory_offset==0xFFFFFFFF:
+			raise zipfile.BadZipFile('Zip64 archives are not supported by jar_reader')
+		members = {}
+		offset = directory_offset
+		for _ in range(entry_count):
+			entry = CENTRAL_DIRECTORY_ENTRY.unpack_from(self.mm, offset)
+			if entry[0]!=CENTRAL_DIRECTORY_ENTRY_SIGNATURE:
+				raise zipfile.BadZipFile('Bad central directory entry at offset {}'.format(offset))
+			(flags, method, compressed_size, name_length, extra_length, comment_length, local_offset) = (entry[3], entry[4], entry[8], entry[10], entry[11], entry[12], entry[16])
+			name_start = offset + CENTRAL_DIRECTORY_ENTRY.size
+			name_bytes = self.mm[name_start:name_start + name_length]
+			# bit 11 marks utf-8 names, others are cp437 as in zipfile
+			name = name_bytes.decode('utf-8' if flags & 0x800 else 'cp437')
+			members[name] = (method, flags, compressed_size, local_offset)
+			offset = name_start + name_length + extra_length + comment_length
+		return members
+
+	def names(self):
+		"""the names of all the members of the jar"""
+		return list(self.members)
+
+	def read(self, name):
+		"""the decompressed contents of a single member"""
+		(method, flags, compressed_size, local_offset) = self.members[name]
+		if flags & 0x1:
+			raise zipfile.BadZipFile('Encrypted member "{}" is not supported by jar_reader'.format(name))
+		header = LOCAL_FILE_HEADER.unpack_from(self.mm, local_offset)
+		if header[0]!=LOCAL_FILE_HEADER_SIGNATURE:
+			raise zipfile.BadZipFile('Bad local file header for member "{}"'.format(name))
+		data_start = local_offset + LOCAL_FILE_HEADER.size + header[9] + header[10]
+		data = self.mm[data_start:data_start + compressed_size]
+		if method==zipfile.ZIP_STORED:
+			return data
+		if method==zipfile.ZIP_DEFLATED:
+			return zlib.decompress(data, -15)
+		raise zipfile.BadZipFile('Compression method {} of member "{}" is not supported by jar_reader'.format(method, name))
+
+	def sha256(self):
+		"""the sha256 hash of the whole jar, as a hex string (in the same format as file_ops.hash_file)"""
+		return hashlib.sha256(self.mm).hexdigest()
+
+	def close(self):
+		"""unmap the jar"""
+		self.mm.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+class zipfile_reader(object):
+	"""the same interface as jar_reader, through zipfile, for the jars jar_reader does not support"""
+	def __init__(self, jar_path):
+		self.jar_path = jar_path
+		self.zf = zipfile.ZipFile(jar_path, 'r')
+
+	def names(self):
+		"""the names of all the members of the jar"""
+		return self.zf.namelist()
+
+	def read(self, name):
+		"""the decompressed contents of a single member"""
+		return self.zf.read(name)
+
+	def sha256(self):
+		"""the sha256 hash of the whole jar, as a hex string"""
+		return file_ops.hash_file(self.jar_path)
+
+	def close(self):
+		"""close the jar"""
+		self.zf.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+def open_jar(jar_path):
+	"""open a jar with jar_reader, falling back to zipfile for zip features jar_reader does not handle"""
+	try:
+		return jar_reader(jar_path)
+	except zipfile.BadZipFile:
+		return zipfile_reader(jar_path)
+
+def empty_metadata():
+	"""metadata of a jar without any mod descriptor"""
+	return {
+		'loader':None,
+		'mod_ids':[],
+		'names':[],
+		'versions':[],
+		'client_only':None,
+	}
+
+def parse_mcmod_info(contents, metadata):
+	"""read the mods described by an mcmod.info file (forge up to 1.12) into metadata; it has no way to mark a mod client-only"""
+	info = json.loads(contents)
+	if isinstance(info, dict):
+		info = info.get('modList', info.get('modlist', []))
+	metadata['loader'] = 'forge'
+	for mod in info:
+		if 'modid' in mod:
+			metadata['mod_ids'].append(mod['modid'])
+			metadata['names'].append(mod.get('name', mod['modid']))
+			metadata['versions'].append(mod.get('version', ''))
+
+def parse_toml_strings(contents):
+	"""
+	read the string values out of a TOML file, as a list of (table name, {key: value}) tuples, one per table
+	only handles the subset of TOML used by mods.toml; multi-line strings and non-string values are skipped
+	"""
+	tables = [('', {})]
+	in_multiline = None
+	for line in contents.splitlines():
+		line = line.strip()
+		if not in_multiline is None:
+			if in_multiline in line:
+				in_multiline = None
+			continue
+		for quote in ['"""', "'''"]:
+			if quote in line and line.count(quote)==1:
+				in_multiline = quote
+		if not in_multiline is None or line=='' or line.startswith('#'):
+			continue
+		table_match = TOML_TABLE_PATTERN.match(line)
+		if not table_match is None:
+			tables.append((table_match.group(1), {}))
+			continue
+		string_match = TOML_STRING_PATTERN.match(line)
+		if not string_match is None:
+			value = string_match.group(2) if not string_match.group(2) is None else string_match.group(3)
+			tables[-1][1][string_match.group(1)] = value
+	return tables
+
+def parse_mods_toml(contents, metadata):
+	"""
+	read the mods described by a mods.toml file (forge 1.13 and later) into metadata
+	a mod is client-only if every dependency it declares on minecraft or forge is limited to the client side
+	"""
+	metadata['loader'] = 'forge'
+	sides = []
+	for table, values in parse_toml_strings(contents):
+		if table=='mods' and 'modId' in values:
+			metadata['mod_ids'].append(values['modId'])
+			metadata['names'].append(values.get('displayName', values['modId']))
+			metadata['versions'].append(values.get('version', ''))
+		elif table.startswith('dependencies.') and values.get('modId') in ['minecraft', 'forge', 'neoforge']:
+			sides.append(values.get('side', 'BOTH').upper())
+	if len(sides) > 0:
+		metadata['client_only'] = all([side=='CLIENT' for side in sides])
+
+def parse_fabric_mod_json(contents, metadata):
+	"""read the mod described by a fabric.mod.json file into metadata, which marks client-only mods with "environment" """
+	info = json.loads(contents)
+	metadata['loader'] = 'fabric'
+	if 'id' in info:
+		metadata['mod_ids'].append(info['id'])
+		metadata['names'].append(info.get('name', info['id']))
+		metadata['versions'].append(info.get('version', ''))
+	metadata['client_only'] = info.get('environment', '*')=='client'
+
+def parse_jar_metadata(jar, names=None):
+	"""read the metadata from the descriptor files of an open jar (see open_jar), given the names of its members if already known"""
+	metadata = empty_metadata()
+	if names is None:
+		names = jar.names()
+	names = set(names)
+	for descriptor, parse in [(MODS_TOML_NAME, parse_mods_toml), (MCMOD_INFO_NAME, parse_mcmod_info), (FABRIC_MOD_JSON_NAME, parse_fabric_mod_json)]:
+		if descriptor in names:
+			parse(jar.read(descriptor).decode('utf-8', 'replace'), metadata)
+			break
+	return metadata
+
+def read_jar_metadata(jar_path):
+	"""
+	read the mod ids, names, versions, and (if the descriptor says) whether the mod is client-only from a jar
+	only the central directory and the descriptor files are read, nothing is extracted
+	"""
+	try:
+		with open_jar(jar_path) as jar:
+			return parse_jar_metadata(jar)
+	except (zipfile.BadZipFile, zlib.error, ValueError, KeyError, AttributeError, TypeError) as e:
+		progress.warning('Could not read mod metadata from "{jar_path}": {error}'.format(jar_path=jar_path, error=e))
+	return empty_metadata()
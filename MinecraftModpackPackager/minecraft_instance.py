@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+import os
+import json
+import pickle
+import hashlib
+import threading
+
+from MinecraftModpackPackager import file_ops
+from MinecraftModpackPackager import progress
+
+# bump whenever the model changes, so cache files written by older versions are rebuilt
+CACHE_VERSION = 1
+
+class addon(object):
+	"""a single addon (mod, resource pack, ...) installed in the instance"""
+	__slots__ = ['addon_id', 'file_id', 'file_name', 'file_name_on_disk']
+
+	def __init__(self, addon_id, file_id, file_name, file_name_on_disk):
+		self.addon_id = addon_id
+		self.file_id = file_id
+		self.file_name = file_name
+		self.file_name_on_disk = file_name_on_disk
+
+	@classmethod
+	def from_dict(cls, addon_dict):
+		"""create an addon from its entry in "installedAddons" """
+		installed_file = addon_dict["installedFile"]
+		return cls(addon_dict["addonID"], installed_file["id"], installed_file["fileName"], installed_file["FileNameOnDisk"])
+
+class library(object):
+	"""a library the mod loader depends on, identified by its maven coordinate ("group:artifact:version")"""
+	__slots__ = ['group', 'artifact', 'version', 'name']
+
+	def __init__(self, name):
+		self.name = name
+		parts = name.split(':')
+		self.group = parts[0]
+		self.artifact = parts[1] if len(parts) > 1 else ''
+		self.version = parts[-1]
+
+	def coordinate(self):
+		"""the coordinate of the library without its version ("group:artifact"), which the libraries are indexed by"""
+		return '{}:{}'.format(self.group, self.artifact)
+
+class minecraft_instance(object):
+	"""
+	the parts of a modpack's minecraftinstance.json used by the packager, with the addons and libraries indexed for lookups
+	the embedded "versionJson" of the mod loader is only decoded once, while the instance is built
+	"""
+	def __init__(self, name, custom_author, minecraft_version, mod_loader_name, mod_loader_filename, addons=[], libraries=[]):
+		self.name = name
+		self.custom_author = custom_author
+		self.minecraft_version = minecraft_version
+		self.mod_loader_name = mod_loader_name
+		self.mod_loader_filename = mod_loader_filename
+		self.addons = list(addons)
+		self.libraries = list(libraries)
+		self.build_indexes()
+
+	def build_indexes(self):
+		"""index the addons by addonID and file name, and the libraries by coordinate (later entries win, as the last match did before)"""
+		self.addons_by_id = {}
+		self.addons_by_file_name = {}
+		for cur_addon in self.addons:
+			self.addons_by_id[cur_addon.addon_id] = cur_addon
+			self.addons_by_file_name[cur_addon.file_name_on_disk] = cur_addon
+		self.libraries_by_coordinate = {}
+		for lib in self.libraries:
+			self.libraries_by_coordinate[lib.coordinate()] = lib
+
+	@classmethod
+	def from_dict(cls, instance_dict):
+		"""build the model from the decoded contents of minecraftinstance.json"""
+		base_mod_loader = instance_dict["baseModLoader"]
+		version_dict = json.loads(base_mod_loader["versionJson"])
+		return cls(
+			instance_dict["name"],
+			instance_dict["customAuthor"],
+			base_mod_loader["minecraftVersion"],
+			base_mod_loader["name"],
+			base_mod_loader["filename"],
+			addons=[addon.from_dict(addon_dict) for addon_dict in instance_dict["installedAddons"]],
+			libraries=[library(lib['name']) for lib in version_dict["libraries"] if 'name' in lib],
+		)
+
+	def library_version(self, group, artifact):
+		"""the version of a library of the mod loader, or None if it is not used"""
+		lib = self.libraries_by_coordinate.get('{}:{}'.format(group, artifact))
+		if lib is None:
+			return None
+		return lib.version
+
+def cache_fname(cache_dir, json_path):
+	"""the cache file for an instance file, named after the hash of its path"""
+	return os.path.join(cache_dir, '{}.pickle'.format(hashlib.sha1(os.path.abspath(json_path).encode('utf-8')).hexdigest()))
+
+def load_cached(json_path, cache_path):
+	"""
+	read the model from the cache, if the cache was written for the current contents of the instance file
+	the mtime and size are checked first; if only the mtime changed, the hash of the file decides
+	"""
+	if not os.path.isfile(cache_path):
+		return None
+	try:
+		with open(cache_path, 'rb') as fp:
+			cached = pickle.load(fp)
+	except Exception:
+		progress.warning('Instance cache "{}" is corrupt! Rebuilding it...'.format(cache_path))
+		return None
+	if not isinstance(cached, dict) or cached.get('version')!=CACHE_VERSION:
+		return None
+	json_stat = os.stat(json_path)
+	if json_stat.st_size!=cached['size']:
+		return None
+	if json_stat.st_mtime_ns!=cached['mtime']:
+		if file_ops.hash_file_cached(json_path)!=cached['hash']:
+			return None
+		save_cache(json_path, cache_path, cached['instance'], json_stat)
+	return cached['instance']
+
+def save_cache(json_path, cache_path, instance, json_stat):
+	"""write the model to the cache, replacing the previous cache file atomically (json_stat is the stat result of the file the model was read from)"""
+	cached = {
+		'version':CACHE_VERSION,
+		'size':json_stat.st_size,
+		'mtime':json_stat.st_mtime_ns,
+		'hash':file_ops.hash_file_cached(json_path),
+		'instance':instance,
+	}
+	if not os.path.isdir(os.path.dirname(cache_path)):
+		os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+	tmp_path = '{}.{}.{}.tmp'.format(cache_path, os.getpid(), threading.get_ident())
+	with open(tmp_path, 'wb') as fp:
+		pickle.dump(cached, fp, protocol=pickle.HIGHEST_PROTOCOL)
+	os.replace(tmp_path, cache_path)
+
+def load_instance(json_path, cache_dir=None):
+	"""
+	load the model of a minecraftinstance.json file
+	if cache_dir is given, the model is kept there between runs, and only rebuilt when the file changes
+	"""
+	cache_path = None
+	if not cache_dir is None:
+		cache_path = cache_fname(cache_dir, json_path)
+		instance = load_cached(json_path, cache_path)
+		if not instance is None:
+			return instance
+	# taken before reading, so a change made while the file is read leads to a rebuild next time
+	json_stat = os.stat(json_path)
+	with open(json_path, 'r') as fp:
+		instance = minecraft_instance.from_dict(json.load(fp))
+	if not cache_path is None:
+		save_cache(json_path, cache_path, instance, json_stat)
+	return instance
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import zlib
+import sqlite3
+import zipfile
+import argparse
+import concurrent.futures
+
+from MinecraftModpackPackager import file_ops
+from MinecraftModpackPackager import jar_metadata
+from MinecraftModpackPackager import progress
+
+# bump whenever the schema or what is read from jars changes, so databases written by older versions are rebuilt
+SCHEMA_VERSION = 1
+
+DEFAULT_DB_FNAME = os.path.join(os.path.expanduser('~'), '.mc_mod_index.sqlite')
+
+SCHEMA = [
+	'CREATE TABLE jars (path TEXT PRIMARY KEY, dir TEXT NOT NULL, size INTEGER NOT NULL, mtime INTEGER NOT NULL, hash TEXT NOT NULL, loader TEXT, client_only INTEGER, error TEXT)',
+	'CREATE INDEX jars_dir ON jars (dir)',
+	'CREATE INDEX jars_hash ON jars (hash)',
+	'CREATE TABLE mods (path TEXT NOT NULL REFERENCES jars (path) ON DELETE CASCADE, mod_id TEXT NOT NULL, name TEXT, version TEXT)',
+	'CREATE INDEX mods_path ON mods (path)',
+	'CREATE INDEX mods_mod_id ON mods (mod_id)',
+	'CREATE TABLE classes (path TEXT NOT NULL REFERENCES jars (path) ON DELETE CASCADE, name TEXT NOT NULL)',
+	'CREATE INDEX classes_path ON classes (path)',
+	'CREATE INDEX classes_name ON classes (name)',
+]
+
+def is_indexed_class(name):
+	"""check whether a member of a jar is a class that can clash with a class in another jar (not module-info or under META-INF)"""
+	return name.endswith('.class') and not name.startswith('META-INF/') and os.path.basename(name)!='module-info.class'
+
+class jar_record(object):
+	"""everything the index stores about a single jar"""
+	__slots__ = ['path', 'mods_dir', 'size', 'mtime', 'hash', 'metadata', 'classes', 'error']
+
+	def __init__(self, path, mods_dir, size, mtime, jar_hash, metadata=None, classes=[], error=None):
+		self.path = path
+		self.mods_dir = mods_dir
+		self.size = size
+		self.mtime = mtime
+		self.hash = jar_hash
+		self.metadata = metadata
+		self.classes = classes
+		self.error = error
+
+def read_jar_record(path, mods_dir, jar_stat, known_hashes=set()):
+	"""
+	hash a jar and read its mod metadata and class names, from a single mmap of the jar
+	if the hash is in known_hashes, only the hash is calculated, and the metadata of the record is left as None
+	a jar that cannot be read (including one that cannot be opened at all) gets a record with the error instead
+	"""
+	try:
+		with jar_metadata.open_jar(path) as jar:
+			jar_hash = jar.sha256()
+			if jar_hash in known_hashes:
+				return jar_record(path, mods_dir, jar_stat.st_size, jar_stat.st_mtime_ns, jar_hash)
+			names = jar.names()
+			return jar_record(path, mods_dir, jar_stat.st_size, jar_stat.st_mtime_ns, jar_hash, jar_metadata.parse_jar_metadata(jar, names=names), [name for name in names if is_indexed_class(name)])
+	except (zipfile.BadZipFile, zlib.error, ValueError, KeyError, AttributeError, TypeError) as e:
+		error = str(e)
+	except OSError as e:
+		# e.g. the jar was removed since the scan; the empty hash never matches that of another jar
+		return jar_record(path, mods_dir, jar_stat.st_size, jar_stat.st_mtime_ns, '', jar_metadata.empty_metadata(), [], error=str(e))
+	try:
+		jar_hash = file_ops.hash_file(path)
+	except OSError as e:
+		jar_hash = ''
+		error = str(e)
+	return jar_record(path, mods_dir, jar_stat.st_size, jar_stat.st_mtime_ns, jar_hash, jar_metadata.empty_metadata(), [], error=error)
+
+class mod_index(object):
+	"""
+	persistent SQLite index of the jars in mods directories: the mods each jar declares, and the classes it contains
+		jars are keyed by path, and only read again when their size or mtime changes (and their hash then differs)
+		a jar with the same hash as one already indexed (e.g. a renamed or copied jar) is not read again either
+		the packager updates the index of the modpack's mods directory on every run, and reads the metadata of the jars from it (see server_mod_filter)
+		the connection to the database can only be used on the thread that opened it
+	"""
+	def __init__(self, db_fname=DEFAULT_DB_FNAME):
+		self.db_fname = db_fname
+		if not os.path.isdir(os.path.dirname(os.path.abspath(self.db_fname))):
+			os.makedirs(os.path.dirname(os.path.abspath(self.db_fname)), exist_ok=True)
+		self.db = sqlite3.connect(self.db_fname, timeout=60)
+		self.db.execute('PRAGMA foreign_keys = ON')
+		self.db.execute('PRAGMA journal_mode = WAL')
+		self.create_schema()
+
+	def create_schema(self):
+		"""create the tables, dropping those of a database written by another version"""
+		(version,) = self.db.execute('PRAGMA user_version').fetchone()
+		if version==SCHEMA_VERSION:
+			return
+		with self.db:
+			# several packagers may open a new database at once, so the version is checked again under the write lock
+			self.db.execute('BEGIN IMMEDIATE')
+			(version,) = self.db.execute('PRAGMA user_version').fetchone()
+			if version==SCHEMA_VERSION:
+				return
+			for table in ['classes', 'mods', 'jars']:
+				self.db.execute('DROP TABLE IF EXISTS {}'.format(table))
+			for statement in SCHEMA:
+				self.db.execute(statement)
+			self.db.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+
+	def close(self):
+		"""close the database"""
+		self.db.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def metadata(self, path):
+		"""the metadata of an indexed jar (in the format of jar_metadata.empty_metadata), or None if the jar is not indexed"""
+		row = self.db.execute('SELECT loader, client_only FROM jars WHERE path=?', (os.path.abspath(path),)).fetchone()
+		if row is None:
+			return None
+		metadata = jar_metadata.empty_metadata()
+		metadata['loader'] = row[0]
+		metadata['client_only'] = None if row[1] is None else bool(row[1])
+		for mod_id, name, version in self.db.execute('SELECT mod_id, name, version FROM mods WHERE path=? ORDER BY rowid', (os.path.abspath(path),)):
+			metadata['mod_ids'].append(mod_id)
+			metadata['names'].append(name)
+			metadata['versions'].append(version)
+		return metadata
+
+	def copy_record(self, record):
+		"""
+		fill in the metadata and classes of a record from the stored record of an indexed jar with the same hash
+		returns False if no indexed jar has the hash any more (e.g. the only one was changed earlier in the same update)
+		"""
+		row = self.db.execute('SELECT path, error FROM jars WHERE hash=? LIMIT 1', (record.hash,)).fetchone()
+		if row is None:
+			return False
+		record.metadata = self.metadata(row[0])
+		record.classes = [name for (name,) in self.db.execute('SELECT name FROM classes WHERE path=?', (row[0],))]
+		record.error = row[1]
+		return True
+
+	def store_record(self, record):
+		"""replace the stored record of a jar (must be called in a transaction)"""
+		self.db.execute('DELETE FROM jars WHERE path=?', (record.path,))
+		self.db.execute('INSERT INTO jars (path, dir, size, mtime, hash, loader, client_only, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+			record.path, record.mods_dir, record.size, record.mtime, record.hash, record.metadata['loader'],
+			None if record.metadata['client_only'] is None else int(record.metadata['client_only']), record.error,
+		))
+		self.db.executemany('INSERT INTO mods (path, mod_id, name, version) VALUES (?, ?, ?, ?)', [
+			(record.path, mod_id, name, version) for mod_id, name, version in zip(record.metadata['mod_ids'], record.metadata['names'], record.metadata['versions'])
+		])
+		self.db.executemany('INSERT INTO classes (path, name) VALUES (?, ?)', [(record.path, name) for name in record.classes])
+
+	def update(self, mods_dir, workers=4):
+		"""
+		bring the index of the jars in a mods directory up to date, in a single scan of the directory
+		returns a dict of the number of jars added, updated, removed, and unchanged
+		"""
+		jar_files = []
+		if os.path.isdir(mods_dir):
+			with os.scandir(mods_dir) as scan:
+				for dir_entry in scan:
+					if dir_entry.is_file() and dir_entry.name.endswith('.jar'):
+						jar_files.append((dir_entry.path, dir_entry.stat()))
+		return self.update_files(mods_dir, jar_files, workers=workers)
+
+	def update_files(self, mods_dir, jar_files, workers=4):
+		"""
+		bring the index of the jars in a mods directory up to date, from a list of the (path, stat) of every jar in it (e.g. from a scan of the modpack)
+		jars that could not be read are reported when they are first indexed
+		returns a dict of the number of jars added, updated, removed, and unchanged
+		"""
+		mods_dir = os.path.abspath(mods_dir)
+		stored = dict([(row[0], row[1:]) for row in self.db.execute('SELECT path, size, mtime, hash FROM jars WHERE dir=?', (mods_dir,))])
+		counts = {'added':0, 'updated':0, 'removed':0, 'unchanged':0}
+		changed = []
+		seen = set()
+		for path, jar_stat in jar_files:
+			path = os.path.abspath(path)
+			seen.add(path)
+			row = stored.get(path)
+			if not row is None and row[0]==jar_stat.st_size and row[1]==jar_stat.st_mtime_ns:
+				counts['unchanged'] += 1
+			else:
+				changed.append((path, jar_stat, row))
+		removed = [path for path in stored if not path in seen]
+		if len(changed)==0 and len(removed)==0:
+			return counts
+		# sqlite connections stay on this thread, so the workers are given the hashes already indexed up front
+		known_hashes = set([jar_hash for (jar_hash,) in self.db.execute('SELECT DISTINCT hash FROM jars')])
+		with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+			records = list(executor.map(lambda change: read_jar_record(change[0], mods_dir, change[1], known_hashes=known_hashes), changed))
+		with self.db:
+			for (path, jar_stat, row), record in zip(changed, records):
+				if not row is None and row[2]==record.hash:
+					# only touched, the contents are the same
+					self.db.execute('UPDATE jars SET size=?, mtime=? WHERE path=?', (record.size, record.mtime, path))
+					counts['unchanged'] += 1
+					continue
+				read = not record.metadata is None
+				if not read and not self.copy_record(record):
+					# the only jar with the same contents was changed earlier in this update, so this one is read after all
+					record = read_jar_record(path, mods_dir, jar_stat)
+					read = True
+				if read and not record.error is None:
+					progress.warning('Could not read mod metadata from "{jar_path}": {error}'.format(jar_path=path, error=record.error))
+				self.store_record(record)
+				counts['added' if row is None else 'updated'] += 1
+			for path in removed:
+				self.db.execute('DELETE FROM jars WHERE path=?', (path,))
+				counts['removed'] += 1
+		return counts
+
+	def dir_filter(self, mods_dir, column='jars.dir'):
+		"""a SQL condition and its parameters limiting a query to the jars of a mods directory (or all jars if mods_dir is None)"""
+		if mods_dir is None:
+			return ('1', ())
+		return ('{}=?'.format(column), (os.path.abspath(mods_dir),))
+
+	def jars(self, mods_dir=None):
+		"""every indexed jar, as a list of dicts"""
+		(condition, params) = self.dir_filter(mods_dir)
+		jars = []
+		for path, size, jar_hash, loader, client_only, error in self.db.execute('SELECT path, size, hash, loader, client_only, error FROM jars WHERE {} ORDER BY path'.format(condition), params):
+			jars.append({
+				'path':path,
+				'size':size,
+				'hash':jar_hash,
+				'loader':loader,
+				'client_only':None if client_only is None else bool(client_only),
+				'mod_ids':[mod_id for (mod_id,) in self.db.execute('SELECT mod_id FROM mods WHERE path=? ORDER BY rowid', (path,))],
+				'error':error,
+			})
+		return jars
+
+	def duplicates(self, mods_dir=None):
+		"""mod IDs declared by more than one jar, as a dict of mod ID: sorted list of jar paths"""
+		(condition, params) = self.dir_filter(mods_dir)
+		duplicates = {}
+		for mod_id, path in self.db.execute('''
+			SELECT mods.mod_id, mods.path FROM mods JOIN jars ON jars.path=mods.path
+			WHERE {condition} AND mods.mod_id IN (
+				SELECT mods.mod_id FROM mods JOIN jars ON jars.path=mods.path WHERE {condition} GROUP BY mods.mod_id HAVING COUNT(DISTINCT mods.path) > 1
+			)
+			ORDER BY mods.mod_id, mods.path
+		'''.format(condition=condition), params + params):
+			duplicates.setdefault(mod_id, []).append(path)
+		return duplicates
+
+	def identical(self, mods_dir=None):
+		"""jars with exactly the same contents under different names, as a dict of hash: sorted list of jar paths"""
+		(condition, params) = self.dir_filter(mods_dir)
+		identical = {}
+		for jar_hash, path in self.db.execute('''
+			SELECT hash, path FROM jars
+			WHERE {condition} AND hash IN (SELECT hash FROM jars WHERE {condition} AND hash!='' GROUP BY hash HAVING COUNT(*) > 1)
+			ORDER BY hash, path
+		'''.format(condition=condition), params + params):
+			identical.setdefault(jar_hash, []).append(path)
+		return identical
+
+	def conflicts(self, mods_dir=None):
+		"""pairs of jars containing some of the same classes, as a list of (path, other path, number of shared classes, an example class) tuples"""
+		(condition_a, params_a) = self.dir_filter(mods_dir, column='jars_a.dir')
+		(condition_b, params_b) = self.dir_filter(mods_dir, column='jars_b.dir')
+		return self.db.execute('''
+			SELECT a.path, b.path, COUNT(*), MIN(a.name) FROM classes a
+			JOIN classes b ON a.name=b.name AND a.path < b.path
+			JOIN jars jars_a ON jars_a.path=a.path
+			JOIN jars jars_b ON jars_b.path=b.path
+			WHERE {condition_a} AND {condition_b}
+			GROUP BY a.path, b.path
+			ORDER BY COUNT(*) DESC, a.path, b.path
+		'''.format(condition_a=condition_a, condition_b=condition_b), params_a + params_b).fetchall()
+
+	def which(self, query, mods_dir=None):
+		"""
+		the jars a mod ID, file name, or class (e.g. "net/example/Example.class" or "net.example.Example") belongs to
+		returns a list of (path, what matched) tuples
+		"""
+		(condition, params) = self.dir_filter(mods_dir)
+		class_name = query if query.endswith('.class') else query.replace('.', '/') + '.class'
+		found = []
+		for path, in self.db.execute('SELECT DISTINCT mods.path FROM mods JOIN jars ON jars.path=mods.path WHERE mods.mod_id=? AND {} ORDER BY mods.path'.format(condition), (query,) + params):
+			found.append((path, 'mod ID "{}"'.format(query)))
+		for path, in self.db.execute('SELECT path FROM jars WHERE (path=? OR path LIKE ? ESCAPE \'\\\') AND {} ORDER BY path'.format(condition), (os.path.abspath(query), '%' + os.sep + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')) + params):
+			found.append((path, 'file name'))
+		for path, in self.db.execute('SELECT classes.path FROM classes JOIN jars ON jars.path=classes.path WHERE classes.name=? AND {} ORDER BY classes.path'.format(condition), (class_name,) + params):
+			found.append((path, 'class "{}"'.format(class_name)))
+		return found
+
+if __name__=='__main__':
+	parser = argparse.ArgumentParser(description='Index the jars in a modpack\'s mods directory, and query which mods are duplicated, which jars conflict, and which jar a mod ID or class belongs to.')
+	parser.add_argument('mods_dir', help='Path to the mods directory to index (e.g. the "mods" folder of the modpack instance).')
+	parser.add_argument('--db', dest='db_fname', default=DEFAULT_DB_FNAME, help='Filename of the SQLite database holding the index.  Defaults to ".mc_mod_index.sqlite" in the home directory.')
+	parser.add_argument('--workers', dest='workers', default=4, type=int, help='Number of threads used to read changed jars.  Defaults to 4.')
+	subparsers = parser.add_subparsers(dest='command')
+	subparsers.add_parser('update', help='Only bring the index up to date.')
+	subparsers.add_parser('list', help='List the indexed jars and the mod IDs they declare.')
+	subparsers.add_parser('duplicates', help='List mod IDs declared by more than one jar, and jars with identical contents.')
+	subparsers.add_parser('conflicts', help='List pairs of jars containing some of the same classes.')
+	which_parser = subparsers.add_parser('which', help='Find the jars a mod ID, file name, or class belongs to.')
+	which_parser.add_argument('query', help='Mod ID, jar file name, or class name (e.g. "net.example.Example").')
+	args = parser.parse_args()
+	with mod_index(args.db_fname) as index:
+		counts = index.update(args.mods_dir, workers=args.workers)
+		print('Index of "{mods_dir}" updated: {added} added, {updated} updated, {removed} removed, {unchanged} unchanged jars.'.format(mods_dir=args.mods_dir, **counts))
+		if args.command=='list':
+			for jar in index.jars(args.mods_dir):
+				print('{name}: {mod_ids}{client_only}{error}'.format(
+					name=os.path.basename(jar['path']),
+					mod_ids=', '.join(jar['mod_ids']) or '(no mod metadata)',
+					client_only=' [client-only]' if jar['client_only'] else '',
+					error=' [unreadable: {}]'.format(jar['error']) if not jar['error'] is None else '',
+				))
+		elif args.command=='duplicates':
+			for mod_id, paths in index.duplicates(args.mods_dir).items():
+				print('Mod ID "{mod_id}" is declared by: {jars}'.format(mod_id=mod_id, jars=', '.join([os.path.basename(path) for path in paths])))
+			for jar_hash, paths in index.identical(args.mods_dir).items():
+				print('Identical jars: {jars}'.format(jars=', '.join([os.path.basename(path) for path in paths])))
+		elif args.command=='conflicts':
+			for path, other_path, count, example in index.conflicts(args.mods_dir):
+				print('"{jar}" and "{other_jar}" share {count} classes (e.g. {example})'.format(jar=os.path.basename(path), other_jar=os.path.basename(other_path), count=count, example=example))
+		elif args.command=='which':
+			found = index.which(args.query, args.mods_dir)
+			for path, matched in found:
+				print('{path} ({matched})'.format(path=path, matched=matched))
+			if len(found)==0:
+				print('"{}" was not found in any indexed jar.'.format(args.query))
+				sys.exit(1)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+import os
+import re
+import json
+import fnmatch
+import hashlib
+import argparse
+import threading
+
+from MinecraftModpackPackager import copy_backend
+from MinecraftModpackPackager import docker_context
+
+OCI_LAYOUT_VERSION = '1.0.0'
+MANIFEST_MEDIA_TYPE = 'application/vnd.oci.image.manifest.v1+json'
+CONFIG_MEDIA_TYPE = 'application/vnd.oci.image.config.v1+json'
+LAYER_MEDIA_TYPE = 'application/vnd.oci.image.layer.v1.tar'
+
+# directory the server package is placed in inside the image, as in the bundled Dockerfile
+APP_DIR = 'app'
+# the rest of the bundled Dockerfile, which is not read (a RUN step cannot be done without a docker daemon)
+DEFAULT_IMAGE_CONFIG = {
+	'WorkingDir':'/' + APP_DIR,
+	'ExposedPorts':{'80/tcp':{}, '443/tcp':{}, '25565/tcp':{}},
+	'Cmd':['python', '-m', 'ServerStartDocker'],
+}
+
+# layers of the server package, from the least to the most often changed, as (name, glob patterns matched against the whole path inside the package, where '*' also matches '/')
+# each file goes into the first layer with a matching pattern
+DEFAULT_LAYERS = [
+	('forge libraries', ['libraries/*', 'forge-*.jar', 'minecraft_server.*.jar']),
+	('mods', ['mods/*']),
+	('config, settings, and scripts', ['*']),
+]
+
+def json_bytes(value):
+	"""the canonical encoding of a JSON document in the image, so the same document always has the same digest"""
+	return json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+class hashing_writer(object):
+	"""a binary file object that hashes and counts everything written through it"""
+	def __init__(self, fp):
+		self.fp = fp
+		self.hash = hashlib.sha256()
+		self.size = 0
+
+	def write(self, data):
+		"""write data to the underlying file object"""
+		self.hash.update(data)
+		self.size += len(data)
+		return self.fp.write(data)
+
+	def digest(self):
+		"""the digest of everything written so far"""
+		return 'sha256:' + self.hash.hexdigest()
+
+def split_layers(package_dir, layers=DEFAULT_LAYERS, prefix=APP_DIR):
+	"""
+	split the contents of a server package into layers, in a single walk of the package directory
+	returns a list of (layer name, [docker_context.context_member]), with every directory a layer needs placed before its contents
+	"""
+	patterns = [[fnmatch.translate(pattern) for pattern in layer_patterns] for _, layer_patterns in layers]
+	matchers = [re.compile('|'.join(['(?:{})'.format(pattern) for pattern in layer_patterns]) or '(?!)') for layer_patterns in patterns]
+	layer_members = [[] for _ in layers]
+	layer_dirs = [set() for _ in layers]
+	dir_members = {}
+	def add_dirs(layer_index, arcname):
+		parts = arcname.split('/')[:-1]
+		for depth in range(1, len(parts) + 1):
+			dir_arcname = '/'.join(parts[:depth])
+			if not dir_arcname in layer_dirs[layer_index]:
+				layer_dirs[layer_index].add(dir_arcname)
+				layer_members[layer_index].append(dir_members[dir_arcname])
+	dir_members[prefix] = docker_context.context_member(prefix, package_dir, True, 0o755)
+	for member in docker_context.list_context(package_dir):
+		relpath = member.arcname
+		member.arcname = prefix + '/' + relpath
+		if member.is_dir:
+			dir_members[member.arcname] = member
+		for layer_index, matcher in enumerate(matchers):
+			if not matcher.match(relpath) is None:
+				add_dirs(layer_index, member.arcname)
+				if member.is_dir:
+					if not member.arcname in layer_dirs[layer_index]:
+						layer_dirs[layer_index].add(member.arcname)
+						layer_members[layer_index].append(member)
+				else:
+					layer_members[layer_index].append(member)
+				break
+	return [(name, members) for (name, _), members in zip(layers, layer_members) if len(members) > 0]
+
+class blob_store(object):
+	"""
+	content-addressed store of image blobs (blobs/sha256/<hex digest>), shared by the images of every version of a modpack
+		layers are also indexed by the digest of their contents (see docker_context.context_digest), so an unchanged layer is not even written again
+	"""
+	def __init__(self, store_dir):
+		self.store_dir = store_dir
+		self.blobs_dir = os.path.join(self.store_dir, 'blobs', 'sha256')
+		self.layer_index_fname = os.path.join(self.store_dir, 'layers.json')
+		self.lock = threading.Lock()
+		if not os.path.isdir(self.blobs_dir):
+			os.makedirs(self.blobs_dir, exist_ok=True)
+		self.layer_index = {}
+		if os.path.isfile(self.layer_index_fname):
+			with open(self.layer_index_fname, 'r') as fp:
+				self.layer_index = json.load(fp)
+
+	def blob_path(self, digest):
+		"""the path of a blob in the store"""
+		return os.path.join(self.blobs_dir, digest.split(':', 1)[1])
+
+	def has_blob(self, digest):
+		"""check whether the store holds a blob"""
+		return os.path.isfile(self.blob_path(digest))
+
+	def tmp_path(self):
+		"""a path to write a blob to before its digest is known"""
+		return os.path.join(self.store_dir, 'blob.{}.{}.tmp'.format(os.getpid(), threading.get_ident()))
+
+	def add_bytes(self, data):
+		"""add a blob held in memory; returns its descriptor (digest and size)"""
+		digest = 'sha256:' + hashlib.sha256(data).hexdigest()
+		if not self.has_blob(digest):
+			tmp_path = self.tmp_path()
+			with open(tmp_path, 'wb') as fp:
+				fp.write(data)
+			os.replace(tmp_path, self.blob_path(digest))
+		return {'digest':digest, 'size':len(data)}
+
+	def add_blob(self, digest, src):
+		"""add a blob from a file whose digest is already known (e.g. a layer of a base image)"""
+		if not self.has_blob(digest):
+			copy_backend.default_backend.copy(src, self.blob_path(digest), read_only=True)
+
+	def add_layer(self, members):
+		"""add the layer holding members, writing its tar only if no layer with the same contents was added before; returns (descriptor, whether it was reused)"""
+		contents_digest = docker_context.context_digest(members)
+		with self.lock:
+			cached = self.layer_index.get(contents_digest)
+		if not cached is None and self.has_blob(cached['digest']):
+			return (cached, True)
+		tmp_path = self.tmp_path()
+		with open(tmp_path, 'wb') as fp:
+			writer = hashing_writer(fp)
+			docker_context.write_context_tar(members, writer)
+		descriptor = {'digest':writer.digest(), 'size':writer.size}
+		os.replace(tmp_path, self.blob_path(descriptor['digest']))
+		with self.lock:
+			self.layer_index[contents_digest] = descriptor
+		return (descriptor, False)
+
+	def save(self):
+		"""write the index of layers to disk"""
+		tmp_fname = '{}.{}.{}.tmp'.format(self.layer_index_fname, os.getpid(), threading.get_ident())
+		with self.lock:
+			with open(tmp_fname, 'w') as fp:
+				json.dump(self.layer_index, fp)
+		os.replace(tmp_fname, self.layer_index_fname)
+
+def read_base_image(base_layout_dir):
+	"""the manifest and config of the first image in an OCI image layout directory (e.g. one written by "skopeo copy docker://... oci:<dir>")"""
+	def read_blob(digest):
+		with open(os.path.join(base_layout_dir, 'blobs', *digest.split(':', 1)), 'rb') as fp:
+			return json.loads(fp.read().decode('utf-8'))
+	with open(os.path.join(base_layout_dir, 'index.json'), 'r') as fp:
+		index = json.load(fp)
+	if len(index.get('manifests', []))==0:
+		raise Exception('Base image layout "{}" contains no images!'.format(base_layout_dir))
+	manifest = read_blob(index['manifests'][0]['digest'])
+	if not 'config' in manifest:
+		raise Exception('Base image layout "{}" holds an image index rather than a single image, which is not supported!'.format(base_layout_dir))
+	return (manifest, read_blob(manifest['config']['digest']))
+
+def image_config(base_config, diff_ids, layer_names):
+	"""the config of the image: that of the base image (if any) with the server package layers and the settings of the bundled Dockerfile on top"""
+	if base_config is None:
+		config = {'architecture':'amd64', 'os':'linux', 'config':{}, 'rootfs':{'type':'layers', 'diff_ids':[]}, 'history':[]}
+	else:
+		config = json.loads(json.dumps(base_config))
+	container_config = config.setdefault('config', {})
+	container_config['WorkingDir'] = DEFAULT_IMAGE_CONFIG['WorkingDir']
+	container_config['Cmd'] = list(DEFAULT_IMAGE_CONFIG['Cmd'])
+	container_config.pop('Entrypoint', None)
+	container_config.setdefault('ExposedPorts', {}).update(DEFAULT_IMAGE_CONFIG['ExposedPorts'])
+	config['rootfs']['diff_ids'] = config['rootfs'].get('diff_ids', []) + diff_ids
+	config['history'] = config.get('history', []) + [{'created_by':'MinecraftModpackPackager: {}'.format(name)} for name in layer_names]
+	# no timestamps, so an unchanged package gives the same image ID
+	config.pop('created', None)
+	return config
+
+def write_image(package_dir, layout_dir, store_dir, tags=[], base_layout_dir=None, layers=DEFAULT_LAYERS):
+	"""
+	write the image of a server package as an OCI image layout directory, without a docker daemon
+		the package is split into layers (see DEFAULT_LAYERS), each a deterministic tar, so unchanged layers keep their digest between versions
+		the layout also holds a docker "manifest.json", so a tar of it (see write_docker_archive) can be loaded with "docker load"
+		layers are uncompressed, as "docker save" writes them; registries receive them compressed from the tool pushing the layout (e.g. skopeo)
+		the base image (e.g. with java and python installed) is read from an OCI image layout directory; without one, the image holds only the server package, and cannot run its command
+	returns a list of (layer name, descriptor, whether the layer was reused) tuples
+	"""
+	store = blob_store(store_dir)
+	base_manifest = None
+	base_config = None
+	if not base_layout_dir is None:
+		(base_manifest, base_config) = read_base_image(base_layout_dir)
+		for descriptor in base_manifest['layers']:
+			store.add_blob(descriptor['digest'], os.path.join(base_layout_dir, 'blobs', *descriptor['digest'].split(':', 1)))
+	results = []
+	for name, members in split_layers(package_dir, layers=layers):
+		(descriptor, reused) = store.add_layer(members)
+		results.append((name, descriptor, reused))
+	store.save()
+	layer_descriptors = [] if base_manifest is None else [dict(descriptor) for descriptor in base_manifest['layers']]
+	layer_descriptors += [{'mediaType':LAYER_MEDIA_TYPE, 'digest':descriptor['digest'], 'size':descriptor['size']} for _, descriptor, _ in results]
+	config_descriptor = store.add_bytes(json_bytes(image_config(base_config, [descriptor['digest'] for _, descriptor, _ in results], [name for name, _, _ in results])))
+	config_descriptor['mediaType'] = CONFIG_MEDIA_TYPE
+	manifest_descriptor = store.add_bytes(json_bytes({
+		'schemaVersion':2,
+		'mediaType':MANIFEST_MEDIA_TYPE,
+		'config':config_descriptor,
+		'layers':layer_descriptors,
+	}))
+	manifest_descriptor['mediaType'] = MANIFEST_MEDIA_TYPE
+	# the layout only links to the blobs in the store
+	layout_blobs_dir = os.path.join(layout_dir, 'blobs', 'sha256')
+	if not os.path.isdir(layout_blobs_dir):
+		os.makedirs(layout_blobs_dir)
+	for descriptor in [manifest_descriptor, config_descriptor] + layer_descriptors:
+		layout_blob_path = os.path.join(layout_blobs_dir, descriptor['digest'].split(':', 1)[1])
+		if not os.path.isfile(layout_blob_path):
+			copy_backend.default_backend.copy(store.blob_path(descriptor['digest']), layout_blob_path, read_only=True)
+	index_manifests = []
+	for tag in tags:
+		descriptor = dict(manifest_descriptor)
+		descriptor['annotations'] = {'io.containerd.image.name':tag, 'org.opencontainers.image.ref.name':tag.rsplit(':', 1)[-1]}
+		index_manifests.append(descriptor)
+	if len(index_manifests)==0:
+		index_manifests.append(manifest_descriptor)
+	with open(os.path.join(layout_dir, 'oci-layout'), 'wb') as fp:
+		fp.write(json_bytes({'imageLayoutVersion':OCI_LAYOUT_VERSION}))
+	with open(os.path.join(layout_dir, 'index.json'), 'wb') as fp:
+		fp.write(json_bytes({'schemaVersion':2, 'mediaType':'application/vnd.oci.image.index.v1+json', 'manifests':index_manifests}))
+	with open(os.path.join(layout_dir, 'manifest.json'), 'wb') as fp:
+		fp.write(json_bytes([{
+			'Config':'blobs/sha256/' + config_descriptor['digest'].split(':', 1)[1],
+			'RepoTags':list(tags),
+			'Layers':['blobs/sha256/' + descriptor['digest'].split(':', 1)[1] for descriptor in layer_descriptors],
+		}]))
+	return results
+
+def write_docker_archive(layout_dir, archive):
+	"""write a deterministic tar of an image layout directory, which "docker load" (and tools reading OCI archives) can load"""
+	with open(archive, 'wb') as fp:
+		docker_context.write_context_tar(docker_context.list_context(layout_dir), fp)
+
+if __name__=='__main__':
+	parser = argparse.ArgumentParser(description='Write the image of a server package as an OCI image layout and docker archive, without a docker daemon.')
+	parser.add_argument('package_dir', help='Server package directory to put in the image.')
+	parser.add_argument('layout_dir', help='Directory to write the OCI image layout to.')
+	parser.add_argument('--store', dest='store_dir', default=None, help='Directory holding the blobs shared by the images of every version.  Defaults to the folder ".oci_store" next to the layout directory.')
+	parser.add_argument('--base', dest='base_layout_dir', required=True, help='OCI image layout directory of the base image (e.g. written by "skopeo copy docker://openjdk:8 oci:<dir>"), which must provide java and python.')
+	parser.add_argument('-t', '--tag', dest='tags', default=[], action='append', help='Name and tag of the image (e.g. "registry.example.com/modpack:1.0.0").  May be given several times.')
+	parser.add_argument('--archive', dest='archive', default=None, help='Filename of a docker archive of the image to write as well, for "docker load".')
+	args = parser.parse_args()
+	store_dir = args.store_dir
+	if store_dir is None:
+		store_dir = os.path.join(os.path.dirname(os.path.abspath(args.layout_dir)), '.oci_store')
+	for name, descriptor, reused in write_image(args.package_dir, args.layout_dir, store_dir, tags=args.tags, base_layout_dir=args.base_layout_dir):
+		print('Layer "{name}": {digest} ({size} bytes){reused}'.format(name=name, digest=descriptor['digest'], size=descriptor['size'], reused=', unchanged' if reused else ''))
+	if not args.archive is None:
+		write_docker_archive(args.layout_dir, args.archive)
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 
 import os
+import io
 import shutil
 import tempfile
+import time
 import argparse
 
 import subprocess
@@ -10,6 +12,22 @@ import json
 
 from MinecraftModpackPackager import file_ops
 from MinecraftModpackPackager import translate_wsl_paths
+from MinecraftModpackPackager import build_cache
+from MinecraftModpackPackager import package_stream
+from MinecraftModpackPackager import copy_backend
+from MinecraftModpackPackager import task_graph
+from MinecraftModpackPackager import forge_cache
+from MinecraftModpackPackager import delta_package
+from MinecraftModpackPackager import minecraft_instance
+from MinecraftModpackPackager import client_manifest
+from MinecraftModpackPackager import template_engine
+from MinecraftModpackPackager import mod_index
+from MinecraftModpackPackager import server_mod_filter
+from MinecraftModpackPackager import docker_context
+from MinecraftModpackPackager import oci_image
+from MinecraftModpackPackager import instrumentation
+from MinecraftModpackPackager import progress
+from MinecraftModpackPackager import build_plan
 
 class modpack_packager(object):
 	"""packages a Minecraft modpack into the respective client and server zip archives, for easy transfer to another computer"""
@@ -22,6 +40,27 @@ class modpack_packager(object):
 			modpack_version=None, 
 			remove_server_mods_fname=os.path.join(os.path.dirname(__file__),'remove_server_mods.json'), 
 			client_info_fname=os.path.join(os.path.dirname(__file__),'client_loc_info.json'), 
+			use_build_cache=False, 
+			build_cache_dir=None, 
+			stream_packages=False, 
+			write_package_dirs=True, 
+			zip_compresslevel=6, 
+			zip_workers=None, 
+			copy_workers=None, 
+			stage_workers=4, 
+			forge_cache_dir=os.path.join(os.path.expanduser('~'), '.mc_forge_installs'), 
+			forge_cache_max_mb=None, 
+			previous_version=None, 
+			template_files=None, 
+			template_values={}, 
+			detect_client_mods=False, 
+			oci_image=False, 
+			oci_base_layout_dir=None, 
+			report_fname=None, 
+			profile_fname=None, 
+			dry_run=False, 
+			plan_fname=None, 
+			client_info=None, 
 		):
 		"""initialize all variables needed by the package functions"""
 		self.modpack_dir = modpack_dir
@@ -32,78 +71,144 @@ class modpack_packager(object):
 		self.modpack_version = modpack_version
 		self.remove_server_mods_fname = remove_server_mods_fname
 		self.client_info_fname = client_info_fname
+		self.use_build_cache = use_build_cache
+		self.build_cache_dir = build_cache_dir
+		self.stream_packages = stream_packages
+		self.write_package_dirs = write_package_dirs
+		self.zip_compresslevel = zip_compresslevel
+		self.zip_workers = zip_workers
+		self.copy_workers = copy_workers
+		self.stage_workers = stage_workers
+		self.forge_cache_dir = forge_cache_dir
+		self.forge_cache_max_mb = forge_cache_max_mb
+		self.previous_version = previous_version
+		self.template_files = template_files
+		self.template_values = template_values
+		self.detect_client_mods = detect_client_mods
+		self.oci_image = oci_image
+		self.oci_base_layout_dir = oci_base_layout_dir
+		self.report_fname = report_fname
+		self.profile_fname = profile_fname
+		self.dry_run = dry_run
+		self.plan_fname = plan_fname
 		if not self.client_info_fname is None:
-			print("Loading settings JSON file...")
+			progress.message("Loading settings JSON file...")
 			self.load_client_info()
+		if not client_info is None:
+			self.apply_client_info(client_info)
 		if self.modpack_version is None:
-			print("Calculating next version number...")
+			progress.message("Calculating next version number...")
 			#TODO: auto-gen version if not set yet
 			raise NotImplementedError("No version number specified, and cannot be auto-calculated!")
 		if self.packages_dir is None:
-			print("WARNING: Packages directory not set! Creating one in local directory...")
+			progress.warning("Packages directory not set! Creating one in local directory...")
 			self.packages_dir = os.path.join(os.curdir, 'packages')
-		print("Modpack version number {version}".format(version=self.modpack_version))
+		progress.message("Modpack version number {version}".format(version=self.modpack_version))
 	
 	def prep(self):
 		"""prepare the system for packaging the server and client"""
-		print("Calculating path to minecraft instance...")
 		self.calculate_initial_paths()
-		print("Loading information from modpack instance...")
 		self.load_minecraftinstance()
-		print("Calculating paths for all files...")
 		self.calculate_paths()
-		print("Ensuring correct forge version is installed...")
+		self.plan_packages()
 		self.install_forge()
 	
 	def load_client_info(self):
 		"""load in a JSON archive of settings for the installed client, and override preset settings"""
 		if not os.path.isfile(self.client_info_fname):
-			print('WARNING: Client info file "{}" does not exist')
+			progress.warning('Client info file "{}" does not exist')
 		else:
 			with open(self.client_info_fname, 'r') as fp:
 				client_info = json.load(fp)
-			overwrite_keys = [
-				'additional_server_files_dir', 
-				'remove_server_mods_fname', 
-				'modpack_dir', 
-				'packages_dir', 
-				'modpack_name', 
-				'docker_image_name', 
-				'modpack_version', 
-			]
-			for key in overwrite_keys:
-				if key in client_info:
-					if not client_info[key] is None:
-						setattr(self, key, client_info[key])
+			self.apply_client_info(client_info)
+	
+	def apply_client_info(self, client_info):
+		"""override preset settings with those in a dict in the format of the client info JSON file (keys set to null are ignored)"""
+		overwrite_keys = [
+			'additional_server_files_dir', 
+			'remove_server_mods_fname', 
+			'modpack_dir', 
+			'packages_dir', 
+			'modpack_name', 
+			'docker_image_name', 
+			'modpack_version', 
+			'use_build_cache', 
+			'build_cache_dir', 
+			'stream_packages', 
+			'write_package_dirs', 
+			'zip_compresslevel', 
+			'zip_workers', 
+			'copy_workers', 
+			'stage_workers', 
+			'forge_cache_dir', 
+			'forge_cache_max_mb', 
+			'previous_version', 
+			'template_files', 
+			'template_values', 
+			'detect_client_mods', 
+			'oci_image', 
+			'oci_base_layout_dir', 
+			'report_fname', 
+			'profile_fname', 
+			'dry_run', 
+			'plan_fname', 
+		]
+		for key in overwrite_keys:
+			if key in client_info:
+				if not client_info[key] is None:
+					setattr(self, key, client_info[key])
 	
 	def calculate_initial_paths(self):
 		"""calculate a few paths required by load_minecraftinstance"""
+		progress.message("Calculating path to minecraft instance...")
 		if self.modpack_dir is None:
 			raise Exception("No folder is specified for the modpack!")
+		if self.oci_image and self.oci_base_layout_dir is None:
+			# the image runs ServerStartDocker.py, so it is of no use without a base image providing java and python
+			raise Exception("No base image layout (oci_base_layout_dir) is specified for the OCI image!")
 		
-		self.modpack_dir_native = translate_wsl_paths.translate_path_to_native(self.modpack_dir)
-		self.packages_dir_native = translate_wsl_paths.translate_path_to_native(self.packages_dir)
-		self.additional_server_files_dir_native = translate_wsl_paths.translate_path_to_native(self.additional_server_files_dir)
+		# translated together, so at most one wslpath subprocess is started for all of them
+		(
+			self.modpack_dir_native, 
+			self.packages_dir_native, 
+			self.additional_server_files_dir_native, 
+			self.forge_cache_dir_native, 
+		) = translate_wsl_paths.translate_paths([self.modpack_dir, self.packages_dir, self.additional_server_files_dir, self.forge_cache_dir])
+		if self.build_cache_dir is None:
+			self.build_cache_dir_native = os.path.join(self.packages_dir_native, '.build_cache')
+		else:
+			self.build_cache_dir_native = translate_wsl_paths.translate_path_to_native(self.build_cache_dir)
 
 		self.minecraftinstance_json_path = os.path.join(self.modpack_dir_native, 'minecraftinstance.json')
+		self.minecraftinstance_cache_dir = os.path.join(self.build_cache_dir_native, 'instances')
+		self.mod_index_fname = os.path.join(self.build_cache_dir_native, 'mod_index.sqlite')
 	
 	def load_minecraftinstance(self):
 		"""load data from the modpack's minecraftinstance.json file"""
-		with open(self.minecraftinstance_json_path, 'r') as fp:
-			self.minecraftinstance = json.load(fp)
-		self.minecraftinstance["baseModLoader"]["versionDict"] = json.loads(self.minecraftinstance["baseModLoader"]["versionJson"])
+		progress.message("Loading information from modpack instance...")
+		self.minecraftinstance = minecraft_instance.load_instance(self.minecraftinstance_json_path, cache_dir=self.minecraftinstance_cache_dir)
 		if self.modpack_name is None:
-			self.modpack_name = self.minecraftinstance["name"]
+			self.modpack_name = self.minecraftinstance.name
 	
 	def calculate_paths(self):
 		"""calculate all of the paths needed by the package functions"""
+		progress.message("Calculating paths for all files...")
 		self.config_dir_path = os.path.join(self.modpack_dir_native, 'config')
+		self.mods_dir_path = os.path.join(self.modpack_dir_native, 'mods')
 
 		# self.temp_dir = os.path.join(os.curdir, 'temp')
 		self.temp_dir = os.path.join(tempfile.gettempdir(), 'mc_modpack_package')
-		self.temp_version_dir = os.path.join(self.temp_dir, self.modpack_version)
+		# named after the modpack as well as the version, so several packs can be built at the same time (see batch_package)
+		self.temp_version_dir = os.path.join(self.temp_dir, '{name}_{version}'.format(name=self.modpack_name, version=self.modpack_version))
 		self.temp_client_dir = os.path.join(self.temp_version_dir, 'client')
 		self.temp_server_dir = os.path.join(self.temp_version_dir, 'server')
+		if self.use_build_cache:
+			# keep persistent staging directories next to the packages, so unchanged files are not copied again
+			self.build_cache = build_cache.build_cache(os.path.join(self.build_cache_dir_native, self.modpack_name))
+			self.temp_client_dir = self.build_cache.staging_dir('client')
+			self.temp_server_dir = self.build_cache.staging_dir('server')
+		else:
+			self.build_cache = None
 
 		self.package_dir = os.path.join(self.packages_dir_native, self.modpack_version)
 		self.package_client_dir = os.path.join(self.package_dir, '{name}_client_{version}'.format(name=self.modpack_name, version=self.modpack_version))
@@ -112,241 +217,569 @@ class modpack_packager(object):
 		self.package_server_zip_fname = '{name}_server_{version}.zip'.format(name=self.modpack_name, version=self.modpack_version)
 		self.package_client_zip_path = os.path.join(self.package_dir, self.package_client_zip_fname)
 		self.package_server_zip_path = os.path.join(self.package_dir, self.package_server_zip_fname)
+		self.package_server_oci_dir = os.path.join(self.package_dir, '{name}_server_{version}_oci'.format(name=self.modpack_name, version=self.modpack_version))
+		self.package_server_image_path = os.path.join(self.package_dir, '{name}_server_{version}_image.tar'.format(name=self.modpack_name, version=self.modpack_version))
+		self.oci_store_dir = os.path.join(self.build_cache_dir_native, 'oci')
+		if not self.previous_version is None:
+			self.previous_package_dir = os.path.join(self.packages_dir_native, self.previous_version)
 
 		self.temp_client_overrides_dir_path = os.path.join(self.temp_client_dir,'overrides')
 		self.temp_client_config_dir_path = os.path.join(self.temp_client_overrides_dir_path,'config')
 		self.temp_client_manifest_json_path = os.path.join(self.temp_client_dir,'manifest.json')
 		self.temp_client_modlist_html_path = os.path.join(self.temp_client_dir,'modlist.html')
 
-		self.forge_version = self.minecraftinstance["baseModLoader"]["filename"].replace('.jar','').replace('forge-','')
+		self.forge_version = self.minecraftinstance.mod_loader_filename.replace('.jar','').replace('forge-','')
 		self.forge_installer_filename = 'forge-{}-installer.jar'.format(self.forge_version)
 		if self.forge_version.startswith('1.12.2') and int(self.forge_version[-4:])<=2838:
 			self.forge_universal_filename = 'forge-{}-universal.jar'.format(self.forge_version)
 		else:
 			self.forge_universal_filename = 'forge-{}.jar'.format(self.forge_version)
-		self.forge_installer_path = os.path.join(os.curdir, 'forge_jars', self.forge_installer_filename)
-		# self.forge_install_dir_path = os.path.join(os.curdir, 'forge_jars', 'installs', self.forge_version)
-		self.forge_install_dir_path = os.path.join(os.path.expanduser('~'), '.mc_forge_installs', 'forge-{}'.format(self.forge_version))
-		self.forge_universal_path = os.path.join(self.forge_install_dir_path, self.forge_universal_filename)
+		max_size = None
+		if not self.forge_cache_max_mb is None:
+			max_size = int(self.forge_cache_max_mb*1024*1024)
+		self.forge_cache = forge_cache.forge_cache(self.forge_cache_dir_native, max_size=max_size)
+		self.forge_installer_path = self.forge_cache.installer_path(self.forge_version)
+		# installs are keyed by the hash of the installer as well as the version, so these are only known once install_forge has run
+		self.forge_install_dir_path = None
+		self.forge_universal_path = None
+		self.forge_install_lock = None
 		self.forge_installer_url = 'https://files.minecraftforge.net/maven/net/minecraftforge/forge/{forge_version}/forge-{forge_version}-installer.jar'.format(forge_version=self.forge_version)
-		self.launcher_wrapper_version = None
-		for lib in self.minecraftinstance["baseModLoader"]["versionDict"]["libraries"]:
-			if 'name' in lib:
-				name = lib['name']
-				name_split = name.split(':')
-				if name_split[0]=='net.minecraft' and name_split[1]=='launchwrapper':
-					self.launcher_wrapper_version = name_split[-1]
+		self.launcher_wrapper_version = self.minecraftinstance.library_version('net.minecraft', 'launchwrapper')
 		if self.launcher_wrapper_version is None:
 			raise Exception("Could not determine launchwrapper version!")
-		self.minecraft_version = self.minecraftinstance["baseModLoader"]["minecraftVersion"]
+		self.minecraft_version = self.minecraftinstance.minecraft_version
+
+		self.server_modpack_exclude = [
+			".curseclient",
+			"minecraftinstance.json",
+			"saves",
+			os.path.join("mods","mod_list.json"),
+		]
+		# left behind if python imported one of the scripts in place, and tied to that python version
+		self.additional_server_files_exclude = [
+			"__pycache__",
+		]
+		self.forge_install_exclude = [
+			os.path.join('libraries','net','minecraft','launchwrapper',self.launcher_wrapper_version,'launchwrapper-{}.jar'.format(self.launcher_wrapper_version)), 
+			'minecraft_server.{}.jar'.format(self.minecraft_version), 
+		]
+		self.keep_folder_relpath = os.path.join('libraries','net','minecraft','launchwrapper',self.launcher_wrapper_version,'KEEP_FOLDER')
+		self.settings_keys = {
+			'{{[FORGEJAR]}}':self.forge_universal_filename, 
+			'{{[LAUNCHERVER]}}':self.launcher_wrapper_version, 
+			'{{[MCVER]}}':self.minecraft_version, 
+		}
+		template_values = dict(self.settings_keys)
+		for key, value in self.template_values.items():
+			template_values[template_engine.placeholder(key)] = value
+		template_files = self.template_files
+		if template_files is None:
+			template_files = template_engine.DEFAULT_TEMPLATE_FILES
+		self.server_template = template_engine.template_engine(template_values, rules=template_files)
 	
 	def install_forge(self):
 		"""ensures the forge server version specified in minecraftinstance is installed where we can access it"""
-		if not os.path.isfile(self.forge_installer_path):
-			print("Downloading installer for forge {ver} (URL: {url})...".format(ver=self.forge_version,url=self.forge_installer_url))
-			file_ops.download_file(self.forge_installer_url, self.forge_installer_path)
-		if not os.path.isdir(self.forge_install_dir_path):
-			os.makedirs(self.forge_install_dir_path)
-		if not os.path.isfile(self.forge_universal_path):
-			print('Installing forge {forge_version} into "{forge_install_dir_path}"...'.format(forge_version=self.forge_version,forge_install_dir_path=self.forge_install_dir_path))
-			subprocess.check_call(['java', '-jar', os.path.abspath(self.forge_installer_path), '--installServer'], cwd=self.forge_install_dir_path)
-			print("Forge installation complete!")
-
-	def gen_manifest_json(self):
-		"""generate the data for manifest.json in the client package"""
-		files_list = []
-		for addon in self.minecraftinstance["installedAddons"]:
-			files_list.append({
-				"projectID": addon["addonID"],
-				"fileID": addon["installedFile"]["id"],
-				"required": (addon["installedFile"]["FileNameOnDisk"][-4:]=='.jar')
-			})
-		return {
-			"minecraft": {
-				"version": self.minecraftinstance["baseModLoader"]["minecraftVersion"],
-				"modLoaders": [
-					{
-						"id": self.minecraftinstance["baseModLoader"]["name"],
-						"primary": True
-					}
-				]
-			},
-			"manifestType": "minecraftModpack",
-			"manifestVersion": 1,
-			"name": self.modpack_name,
-			"version": self.modpack_version,
-			"author": self.minecraftinstance["customAuthor"],
-			"files": files_list,
-			"overrides": "overrides"
-		}
+		progress.message('Ensuring correct forge version is installed in "{}"...'.format(self.forge_cache.cache_dir))
+		# the install stays locked until cleanup, so it cannot be evicted while it is copied or hardlinked into the server package
+		self.forge_install_dir_path, self.forge_install_lock = self.forge_cache.ensure_install(self.forge_version, self.forge_installer_url, self.forge_universal_filename)
+		self.forge_universal_path = os.path.join(self.forge_install_dir_path, self.forge_universal_filename)
 
-	def gen_modlist_html(self):
-		"""generate the contents of modlist.html for the client package"""
-		mods_list = ""
-		for addon in self.minecraftinstance["installedAddons"]:
-			mods_list = mods_list + '<li><a href="https://minecraft.curseforge.com/mc-mods/{id}">{name}</a></li>\r\n'.format(
-					id=addon["addonID"], 
-					name=addon["installedFile"]["fileName"], #TODO: find better way of representing this information
-				)
-		return "<ul>\r\n{mods_list}</ul>\r\n".format(mods_list=mods_list)
+	def write_client_files(self, manifest_fp, modlist_fp):
+		"""write manifest.json and modlist.html for the client package into two binary file objects, in one pass over the addons"""
+		client_manifest.write_client_files(self.minecraftinstance, self.modpack_name, self.modpack_version, manifest_fp, modlist_fp)
 	
+	def prepare_temp_dir(self, temp_dir, package_type):
+		"""create an empty temporary directory for a package, or reuse the staging directory from the build cache"""
+		if not self.build_cache is None:
+			progress.message("Updating {} staging directory from build cache...".format(package_type))
+			if not os.path.isdir(temp_dir):
+				os.makedirs(temp_dir)
+			return
+		if os.path.isdir(temp_dir):
+			progress.message("Removing previous {} temporary directory (Possibly from previous failed build?)...".format(package_type))
+			shutil.rmtree(temp_dir)
+		progress.message("Creating {} temporary directory...".format(package_type))
+		os.makedirs(temp_dir)
+
+	def mark_generated(self, path):
+		"""record a file created by the packager itself (rather than copied), so the build cache keeps it"""
+		if not self.build_cache is None:
+			self.build_cache.touch(path)
+
+	def finish_temp_dir(self, temp_dir):
+		"""remove leftovers of previous builds from a build cache staging directory and save the cache"""
+		if not self.build_cache is None:
+			self.build_cache.remove_untouched(temp_dir)
+			self.build_cache.save()
+
+	def load_remove_server_mods(self):
+		"""load the list of mods to disable on the server from remove_server_mods_fname"""
+		if self.remove_server_mods_fname is None:
+			return []
+		if not os.path.isfile(self.remove_server_mods_fname):
+			progress.warning('Removed mods list "{}" does not exist! Installing all mods to server...'.format(self.remove_server_mods_fname))
+			return []
+		progress.message('Disabling troublesome mods listed in "{}"...'.format(self.remove_server_mods_fname))
+		with open(self.remove_server_mods_fname, 'r') as fp:
+			return json.load(fp)
+
+	def select_disabled_server_mods(self):
+		"""
+		the names of the files in the modpack's mods directory to disable on the server
+			rules from remove_server_mods_fname match file names exactly, by glob, by regex ("re:..."), or by mod ID ("modid:...")
+			with detect_client_mods, jars whose metadata marks them client-only are disabled too
+			the mods directory is taken from the scan of the modpack instance (see plan_packages)
+			the mod index in the build cache (see mod_index) is updated from the same scan on every run, and the metadata of the jars is read from it
+		"""
+		mods_files = self.modpack_scan.mods_index()
+		with mod_index.mod_index(self.mod_index_fname) as index:
+			index.update_files(
+				os.path.join(self.modpack_dir_native, 'mods'), 
+				[(cur_file.path, cur_file.stat) for cur_file in mods_files if cur_file.name.endswith('.jar')], 
+				workers=self.copy_workers or file_ops.COPY_WORKERS, 
+			)
+			rules = self.load_remove_server_mods()
+			if len(rules)==0 and not self.detect_client_mods:
+				return []
+			if self.detect_client_mods:
+				progress.message("Detecting client-only mods...")
+			mod_filter = server_mod_filter.server_mod_filter(
+				rules, 
+				detect_client_only=self.detect_client_mods, 
+				index=index, 
+				workers=self.copy_workers or file_ops.COPY_WORKERS, 
+			)
+			disabled = []
+			for cur_file, reason in mod_filter.select(mods_files):
+				progress.message('Disabling "{name}" on the server ({reason})...'.format(name=cur_file.name, reason=reason))
+				disabled.append(cur_file.name)
+			return disabled
+
+	def plan_packages(self):
+		"""
+		plan the contents of the client and server packages from a single scan of the modpack instance (see build_plan)
+			both the streamed and the staged packages are written from the plan
+			the forge installation and additional files are added to the server package by stage_server_forge, once forge is installed
+		"""
+		progress.message("Scanning modpack instance...")
+		self.modpack_scan = build_plan.source_scan(self.modpack_dir_native, exclude=self.server_modpack_exclude)
+		self.build_plan = build_plan.build_plan()
+		self.build_plan.add_package('client', self.gen_client_entries(), self.package_client_dir, self.package_client_zip_path)
+		self.build_plan.add_package('server', self.gen_server_modpack_entries(), self.package_server_dir, self.package_server_zip_path)
+
+	def gen_client_entries(self):
+		"""collect the contents of the client package from the scan of the modpack instance, without copying anything"""
+		entries = package_stream.package_entries()
+		progress.message("Collecting client config directory...")
+		entries.add_scanned(self.modpack_scan.subtree('config'), prefix=entries.arcname('overrides', 'config'))
+		entries.add_dir('overrides')
+		progress.message("Generating client manifest.json and modlist.html...")
+		manifest_fp = io.BytesIO()
+		modlist_fp = io.BytesIO()
+		self.write_client_files(manifest_fp, modlist_fp)
+		entries.add_data('manifest.json', manifest_fp.getvalue())
+		entries.add_data('modlist.html', modlist_fp.getvalue())
+		return entries
+
+	def gen_server_modpack_entries(self):
+		"""collect the files the server package takes from the scan of the modpack instance, without copying anything"""
+		entries = package_stream.package_entries()
+		progress.message("Collecting mod files from modpack instance...")
+		entries.add_scanned(self.modpack_scan.items, read_only=['.jar'])
+		for mod in self.select_disabled_server_mods():
+			arcname = entries.arcname('mods', mod)
+			if entries.is_file(arcname):
+				entries.rename(arcname, arcname + '.disabled')
+		entries.apply_template(self.server_template)
+		return entries
+
+	def add_server_forge_entries(self, entries):
+		"""
+		add the forge installation and additional files on top of the modpack files planned for the server package
+		each directory is walked once, and the listings are returned as (forge items, additional items) for staging to copy (see file_ops.copy_entries)
+		if forge is not installed (only in a dry run), its files are left out
+		"""
+		forge_items = []
+		if not self.forge_install_dir_path is None:
+			progress.message('Collecting forge installation from "{}"...'.format(self.forge_install_dir_path))
+			forge_items = list(file_ops.walk_directory(self.forge_install_dir_path, exclude=self.forge_install_exclude))
+			entries.add_scanned(forge_items, read_only=True)
+		entries.add_data(entries.arcname(self.keep_folder_relpath), b'')
+		progress.message('Collecting additional files from "{}"...'.format(self.additional_server_files_dir_native))
+		additional_items = list(file_ops.walk_directory(self.additional_server_files_dir_native, exclude=self.additional_server_files_exclude))
+		entries.add_scanned(additional_items)
+		entries.apply_template(self.server_template)
+		return (forge_items, additional_items)
+
+	def write_package_entries(self, entries, package_dir, zip_path, package_type):
+		"""write collected package entries into the package directory (if enabled) and straight into the zip file"""
+		if self.write_package_dirs:
+			if os.path.isdir(package_dir):
+				progress.message("Removing previous {} package directory (Possibly from previous failed build?)...".format(package_type))
+				shutil.rmtree(package_dir)
+			progress.message('Writing {} package into packages directory "{}"...'.format(package_type, package_dir))
+			entries.write_directory(package_dir)
+		progress.message('Compressing {} package to "{}"...'.format(package_type, zip_path))
+		entries.write_zip(zip_path, compresslevel=self.zip_compresslevel, workers=self.zip_workers)
+
+	def package_delta(self, package_type):
+		"""create a delta archive from the package of previous_version to the package just created, if a previous version is set"""
+		if self.previous_version is None:
+			return
+		old_zip_path = os.path.join(self.previous_package_dir, '{name}_{type}_{version}.zip'.format(name=self.modpack_name, type=package_type, version=self.previous_version))
+		new_zip_path = os.path.join(self.package_dir, '{name}_{type}_{version}.zip'.format(name=self.modpack_name, type=package_type, version=self.modpack_version))
+		delta_zip_path = os.path.join(self.package_dir, '{name}_{type}_delta_{old_version}_to_{version}.zip'.format(name=self.modpack_name, type=package_type, old_version=self.previous_version, version=self.modpack_version))
+		if not os.path.isfile(old_zip_path):
+			progress.warning('Previous {type} package "{old_zip_path}" not found! Skipping {type} delta package!'.format(type=package_type, old_zip_path=old_zip_path))
+			return
+		progress.message('Creating {type} delta package "{delta_zip_path}"...'.format(type=package_type, delta_zip_path=delta_zip_path))
+		manifest = delta_package.create_delta(old_zip_path, new_zip_path, delta_zip_path, from_version=self.previous_version, to_version=self.modpack_version, compresslevel=self.zip_compresslevel, workers=self.zip_workers)
+		progress.message('Delta package complete: {added} added, {changed} changed, {removed} removed files.'.format(added=len(manifest['added']), changed=len(manifest['changed']), removed=len(manifest['removed'])))
+
 	def package_client(self):
 		"""create the package directory and zip file for the client"""
-		if os.path.isdir(self.temp_client_dir):
-			print("Removing previous client temporary directory (Possibly from previous failed build?)...")
-			shutil.rmtree(self.temp_client_dir)
-		print("Creating client temporary directory...")
-		os.makedirs(self.temp_client_dir)
-		print("Creating client overrides directory...")
-		os.makedirs(self.temp_client_overrides_dir_path)
-		print("Copying client config directory...")
-		file_ops.copy_directory(self.config_dir_path, self.temp_client_config_dir_path)
-		print("Writing client manifest.json...")
-		with open(self.temp_client_manifest_json_path, 'w') as fp:
-			json.dump(self.gen_manifest_json(),fp, indent=2)
-		print("Writing client modlist.html...")
-		with open(self.temp_client_modlist_html_path, 'wb') as fp:
-			fp.write(self.gen_modlist_html().encode('utf-8'))
+		entries = self.build_plan.package('client')
+		if self.stream_packages:
+			self.write_package_entries(entries, self.package_client_dir, self.package_client_zip_path, 'client')
+			progress.message("Client package complete!")
+			self.package_delta('client')
+			return
+		self.prepare_temp_dir(self.temp_client_dir, 'client')
+		progress.message("Creating client overrides directory...")
+		if not os.path.isdir(self.temp_client_overrides_dir_path):
+			os.makedirs(self.temp_client_overrides_dir_path)
+		self.mark_generated(self.temp_client_overrides_dir_path)
+		progress.message("Copying client config directory...")
+		file_ops.copy_entries(self.modpack_scan.subtree('config'), self.temp_client_config_dir_path, cache=self.build_cache, workers=self.copy_workers)
+		progress.message("Writing client manifest.json and modlist.html...")
+		for path, arcname in [(self.temp_client_manifest_json_path, 'manifest.json'), (self.temp_client_modlist_html_path, 'modlist.html')]:
+			file_ops.unlink_if_exists(path)
+			with open(path, 'wb') as fp:
+				fp.write(entries.entries[arcname].data)
+			self.mark_generated(path)
+		self.finish_temp_dir(self.temp_client_dir)
 		if os.path.isdir(self.package_client_dir):
-			print("Removing previous client package directory (Possibly from previous failed build?)...")
+			progress.message("Removing previous client package directory (Possibly from previous failed build?)...")
 			shutil.rmtree(self.package_client_dir)
-		print('Copying client package into packages directory "{}"...'.format(self.package_client_dir))
-		file_ops.copy_directory(self.temp_client_dir, self.package_client_dir)
-		print('Compressing client package to "{}"...'.format(self.package_client_zip_path))
-		file_ops.create_zip(self.package_client_dir, self.package_client_zip_path)
-		print("Client package complete!")
+		progress.message('Copying client package into packages directory "{}"...'.format(self.package_client_dir))
+		file_ops.copy_directory(self.temp_client_dir, self.package_client_dir, read_only=True, workers=self.copy_workers)
+		progress.message('Compressing client package to "{}"...'.format(self.package_client_zip_path))
+		file_ops.create_zip(self.package_client_dir, self.package_client_zip_path, compresslevel=self.zip_compresslevel, workers=self.zip_workers)
+		progress.message("Client package complete!")
+		self.package_delta('client')
 	
-	def package_server(self):
-		"""create the package directory and zip file for the server"""
-		if os.path.isdir(self.temp_server_dir):
-			print("Removing previous server temporary directory (Possibly from previous failed build?)...")
-			shutil.rmtree(self.temp_server_dir)
-		print("Creating server temporary directory...")
-		os.makedirs(self.temp_server_dir)
-		print("Copying mod files from modpack instance...")
-		file_ops.copy_directory(self.modpack_dir_native, self.temp_server_dir, 
-			exclude=[
-				".curseclient",
-				"minecraftinstance.json",
-				"saves",
-				os.path.join("mods","mod_list.json"),
-			]
-		)
-		if not self.remove_server_mods_fname is None:
-			if not os.path.isfile(self.remove_server_mods_fname):
-				print('WARNING: Removed mods list "{}" does not exist! Installing all mods to server...'.format(self.remove_server_mods_fname))
-			else:
-				print('Disabling troublesome mods listed in "{}"...'.format(self.remove_server_mods_fname))
-				with open(self.remove_server_mods_fname, 'r') as fp:
-					remove_mods = json.load(fp)
-				for mod in remove_mods:
-					mod_path_A = os.path.join(self.temp_server_dir, "mods", mod)
-					mod_path_B = mod_path_A + '.jar'
-					mod_paths = [mod_path_A, mod_path_B]
-					for mod_path in mod_paths:
-						if os.path.isfile(mod_path):
-							mod_disabled_path = mod_path + ".disabled"
-							os.rename(mod_path, mod_disabled_path)
-		print('Copying forge installation from "{forge_install_dir_path}" into "{temp_server_dir}"...'.format(forge_install_dir_path = self.forge_install_dir_path, temp_server_dir = self.temp_server_dir))
-		file_ops.copy_directory(self.forge_install_dir_path, self.temp_server_dir, 
-			exclude=[
-				os.path.join('libraries','net','minecraft','launchwrapper',self.launcher_wrapper_version,'launchwrapper-{}.jar'.format(self.launcher_wrapper_version)), 
-				'minecraft_server.{}.jar'.format(self.minecraft_version), 
-			]
-		)
-		with open(os.path.join(self.temp_server_dir,'libraries','net','minecraft','launchwrapper',self.launcher_wrapper_version,'KEEP_FOLDER'), 'w') as _:
+	def stage_server_modpack(self):
+		"""stage the files the server package takes from the modpack instance (does not need forge to be installed yet)"""
+		if self.stream_packages:
+			return
+		self.prepare_temp_dir(self.temp_server_dir, 'server')
+		progress.message("Copying mod files from modpack instance...")
+		file_ops.copy_entries(self.modpack_scan.items, self.temp_server_dir, cache=self.build_cache, read_only=['.jar'], workers=self.copy_workers, template=self.server_template)
+		for entry in self.build_plan.package('server').sorted_entries():
+			if entry.transform()=='disable':
+				mod_disabled_path = os.path.join(self.temp_server_dir, *entry.arcname.split('/'))
+				# a cached build may have left the disabled name as a hardlink to the same jar, and renaming a file onto another link to it does nothing
+				file_ops.unlink_if_exists(mod_disabled_path)
+				os.replace(os.path.join(self.temp_server_dir, *entry.renamed_from.split('/')), mod_disabled_path)
+				self.mark_generated(mod_disabled_path)
+
+	def stage_server_forge(self):
+		"""stage the forge installation and additional files on top of the modpack files (templated files are filled in as they are copied)"""
+		forge_items, additional_items = self.add_server_forge_entries(self.build_plan.package('server'))
+		if self.stream_packages:
+			return
+		progress.message('Copying forge installation from "{forge_install_dir_path}" into "{temp_server_dir}"...'.format(forge_install_dir_path = self.forge_install_dir_path, temp_server_dir = self.temp_server_dir))
+		file_ops.copy_entries(forge_items, self.temp_server_dir, cache=self.build_cache, read_only=True, workers=self.copy_workers, template=self.server_template)
+		keep_folder_path = os.path.join(self.temp_server_dir, self.keep_folder_relpath)
+		file_ops.unlink_if_exists(keep_folder_path)
+		with open(keep_folder_path, 'w') as _:
 			pass # Just creating this as a blank file
+		self.mark_generated(keep_folder_path)
 
-		print('Copying additional files into  "{}"...'.format(self.temp_server_dir))
-		file_ops.copy_directory(self.additional_server_files_dir_native, self.temp_server_dir)
+		progress.message('Copying additional files into  "{}"...'.format(self.temp_server_dir))
+		file_ops.copy_entries(additional_items, self.temp_server_dir, cache=self.build_cache, workers=self.copy_workers, template=self.server_template)
 
-		print('Modifying settings files to include correct versions...')
-		settings_files = [
-			'settings.bat', 
-			'settings.sh', 
-			'settings.py', 
-		]
-		settings_keys = {
-			'{{[FORGEJAR]}}':self.forge_universal_filename, 
-			'{{[LAUNCHERVER]}}':self.launcher_wrapper_version, 
-			'{{[MCVER]}}':self.minecraft_version, 
-		}
-		for fname in settings_files:
-			file_ops.replace_in_file(os.path.join(self.temp_server_dir, fname), settings_keys)
-		
+		self.finish_temp_dir(self.temp_server_dir)
+
+	def finish_server_package(self):
+		"""write the staged server files into the server package directory and zip file"""
+		if self.stream_packages:
+			self.write_package_entries(self.build_plan.package('server'), self.package_server_dir, self.package_server_zip_path, 'server')
+			self.server_template.report()
+			progress.message("Server package complete!")
+			self.package_delta('server')
+			return
 		if os.path.isdir(self.package_server_dir):
-			print("Removing previous server package directory (Possibly from previous failed build?)...")
+			progress.message("Removing previous server package directory (Possibly from previous failed build?)...")
 			shutil.rmtree(self.package_server_dir)
-		print('Copying server package into packages directory "{}"...'.format(self.package_server_dir))
-		file_ops.copy_directory(self.temp_server_dir, self.package_server_dir)
-		print('Compressing server package to "{}"...'.format(self.package_server_zip_path))
-		file_ops.create_zip(self.package_server_dir, self.package_server_zip_path)
-		print("Server package complete!")
+		progress.message('Copying server package into packages directory "{}"...'.format(self.package_server_dir))
+		file_ops.copy_directory(self.temp_server_dir, self.package_server_dir, read_only=True, workers=self.copy_workers)
+		progress.message('Compressing server package to "{}"...'.format(self.package_server_zip_path))
+		file_ops.create_zip(self.package_server_dir, self.package_server_zip_path, compresslevel=self.zip_compresslevel, workers=self.zip_workers)
+		self.server_template.report()
+		progress.message("Server package complete!")
+		self.package_delta('server')
+
+	def package_server(self):
+		"""create the package directory and zip file for the server"""
+		self.stage_server_modpack()
+		self.stage_server_forge()
+		self.finish_server_package()
 	
+	def docker_tags(self):
+		"""the names and tags of the docker image of the server, the first being the one the image is built as"""
+		if self.docker_image_name is None:
+			self.docker_image_name = self.modpack_name.lower()
+		return [
+			'{name}:{version}'.format(name=self.docker_image_name, version=self.modpack_version),
+			'{name}:{version}'.format(name=self.docker_image_name, version='latest'),
+		]
+
+	def package_oci_image(self):
+		"""
+		write the server image as an OCI image layout directory and a docker archive ("docker load -i ..."), without a docker daemon
+			only done if oci_image is set, from the server package directory
+			layers are kept in the build cache directory, and an unchanged layer keeps its digest, so registries only receive the layers that changed
+			the base image (with java, python and requirements.txt installed) is read from the OCI image layout in oci_base_layout_dir, which must be set
+		"""
+		if not self.oci_image:
+			return
+		if not os.path.isdir(self.package_server_dir):
+			progress.message("Server package directory was not written! Skipping OCI image!")
+			return
+		base_layout_dir = translate_wsl_paths.translate_path_to_native(self.oci_base_layout_dir)
+		if os.path.isdir(self.package_server_oci_dir):
+			progress.message("Removing previous OCI image directory (Possibly from previous failed build?)...")
+			shutil.rmtree(self.package_server_oci_dir)
+		progress.message('Writing OCI image to "{}"...'.format(self.package_server_oci_dir))
+		for name, descriptor, reused in oci_image.write_image(self.package_server_dir, self.package_server_oci_dir, self.oci_store_dir, tags=self.docker_tags(), base_layout_dir=base_layout_dir):
+			progress.message('Layer "{name}": {digest}{reused}'.format(name=name, digest=descriptor['digest'], reused=' (unchanged)' if reused else ''))
+		progress.message('Writing docker archive of image to "{}"...'.format(self.package_server_image_path))
+		oci_image.write_docker_archive(self.package_server_oci_dir, self.package_server_image_path)
+		progress.message("OCI image complete!")
+
 	def package_docker_server(self):
 		"""
 		convert the server package directory into a docker image and push the image to a container registry
 			skips upload if container registry not specified as part of docker_image_name
 			requires docker (https://www.docker.com/) to be installed and Dockerfile included in root of additional_server_files_dir, else skips this step
 			runs Dockerfile with build context directory in the root of the server package directory
+			the context is streamed to docker as a deterministic tar, and the image is labelled with a digest of the context
+			if a local image already carries the digest of the context, it is tagged and pushed without building it again
 		"""
+		if not os.path.isdir(self.package_server_dir):
+			progress.message("Server package directory was not written! Skipping docker packaging!")
+			return
 		dockerfile_filename = os.path.join(self.package_server_dir, 'Dockerfile')
-		print("Checking if Dockerfile exists...")
+		progress.message("Checking if Dockerfile exists...")
 		if not os.path.isfile(dockerfile_filename):
-			print("No Dockerfile found! Skipping docker packaging!")
+			progress.message("No Dockerfile found! Skipping docker packaging!")
 			return
-		print("Checking if docker is installed...")
+		progress.message("Checking if docker is installed...")
 		try:
 			subprocess.check_call(['docker', '--version'])
-		except subprocess.CalledProcessError:
-			print("Docker installation not found! Skipping docker packaging!")
+		except (subprocess.CalledProcessError, FileNotFoundError):
+			progress.message("Docker installation not found! Skipping docker packaging!")
 			return
-		if self.docker_image_name is None:
-			self.docker_image_name = self.modpack_name.lower()
-		docker_tags = [
-			'{name}:{version}'.format(name=self.docker_image_name, version=self.modpack_version),
-			'{name}:{version}'.format(name=self.docker_image_name, version='latest'),
-		]
+		docker_tags = self.docker_tags()
 		if len(docker_tags)<=0:
-			print("No docker tag names listed! Skipping docker packaging!")
+			progress.message("No docker tag names listed! Skipping docker packaging!")
 			return
-		print('Building docker container "{name_ver}"...'.format(name_ver=docker_tags[0]))
-		subprocess.check_call(['docker', 'build', '--rm', '-f', dockerfile_filename, '-t', docker_tags[0], self.package_server_dir], cwd=self.package_server_dir)
-		print("Docker container built!")
+		progress.message("Calculating digest of docker build context...")
+		context_members = docker_context.list_context(self.package_server_dir)
+		context_digest = docker_context.context_digest(context_members)
+		existing_image = docker_context.find_image(context_digest)
+		if not existing_image is None:
+			progress.message('Docker build context is unchanged since image "{image}" was built! Skipping build...'.format(image=existing_image))
+			progress.message('Tagging image as "{tagname}"...'.format(tagname=docker_tags[0]))
+			subprocess.check_call(['docker', 'tag', existing_image, docker_tags[0]])
+		else:
+			progress.message('Building docker container "{name_ver}"...'.format(name_ver=docker_tags[0]))
+			docker_context.build_image(context_members, context_digest, docker_tags[0], dockerfile=os.path.basename(dockerfile_filename))
+			progress.message("Docker container built!")
 		for tagname in docker_tags[1:]:
-			print('Tagging build as "{tagname}"...'.format(tagname=tagname))
+			progress.message('Tagging build as "{tagname}"...'.format(tagname=tagname))
 			subprocess.check_call(['docker', 'tag', docker_tags[0], tagname])
-			print("Inage tagged!")
+			progress.message("Inage tagged!")
 		for tagname in docker_tags:
 			if '/' in tagname:
-				print('Uploading docker image "{tagname}"...'.format(tagname=tagname))
+				progress.message('Uploading docker image "{tagname}"...'.format(tagname=tagname))
 				subprocess.check_call(['docker', 'push', tagname])
-				print("Image uploaded!")
-		print("Docker container packaging complete!")
+				progress.message("Image uploaded!")
+		progress.message("Docker container packaging complete!")
 	
 	def cleanup(self):
-		"""deletes the temporary files used during creation of packages"""
-		print('Deleting temporary directory "{}"...'.format(self.temp_version_dir))
+		"""deletes the temporary files used during creation of packages, and releases the forge installation"""
+		if not self.forge_install_lock is None:
+			self.forge_install_lock.release()
+			self.forge_install_lock = None
+			self.forge_cache.evict_if_needed()
+		if not self.build_cache is None:
+			progress.message('Keeping staging directories in build cache "{}" for the next build...'.format(self.build_cache.cache_dir))
+			return
+		if not os.path.isdir(self.temp_version_dir):
+			progress.message('No temporary directory to delete!')
+			return
+		progress.message('Deleting temporary directory "{}"...'.format(self.temp_version_dir))
 		shutil.rmtree(self.temp_version_dir)
-		print('Temporary directory cleared!')
+		progress.message('Temporary directory cleared!')
 	
+	def instrumented(self, name, func):
+		"""wrap a step so it is measured as a phase named name, and reported as a stage of the same name (see progress)"""
+		def run_phase():
+			with progress.default_reporter.stage(name):
+				with instrumentation.default_recorder.phase(name):
+					return func()
+		return run_phase
+
+	def add_tasks(self, graph, prefix='', after=[], prepared=False):
+		"""
+		add the steps of the packaging procedure to a task_graph, with prefix in front of every step name
+		each step is measured as a phase, and reported as a stage, of the same name (see instrumentation and progress)
+		the first step waits for the steps named in after (see task_graph.add_task)
+		if prepared is set, calculate_initial_paths, load_minecraftinstance, and calculate_paths have already been called, so they are left out (plan_packages is not)
+		returns the names of the steps added
+		"""
+		steps = [
+			('calculate_initial_paths', self.calculate_initial_paths, []), 
+			('load_minecraftinstance', self.load_minecraftinstance, ['calculate_initial_paths']), 
+			('calculate_paths', self.calculate_paths, ['load_minecraftinstance']), 
+			('plan_packages', self.plan_packages, ['calculate_paths']), 
+			('install_forge', self.install_forge, ['calculate_paths']), 
+			('package_client', self.package_client, ['plan_packages']), 
+			('stage_server_modpack', self.stage_server_modpack, ['plan_packages']), 
+			('stage_server_forge', self.stage_server_forge, ['install_forge', 'stage_server_modpack']), 
+			('finish_server_package', self.finish_server_package, ['stage_server_forge']), 
+			('package_docker_server', self.package_docker_server, ['finish_server_package']), 
+			('package_oci_image', self.package_oci_image, ['finish_server_package']), 
+			('cleanup', self.cleanup, ['package_client', 'package_docker_server', 'package_oci_image']), 
+		]
+		if prepared:
+			steps = steps[3:]
+		names = [name for name, _, _ in steps]
+		for name, func, deps in steps:
+			deps = [prefix + dep for dep in deps if dep in names]
+			graph.add_task(prefix + name, self.instrumented(prefix + name, func), deps=deps, after=after if name==names[0] else [])
+		return [prefix + name for name in names]
+
 	def run(self):
-		"""runs the entire packaging procedure in order, including prep, package_client, package_server, package_docker_server, and cleanup"""
-		self.prep()
-		self.package_client()
-		self.package_server()
-		self.package_docker_server()
-		self.cleanup()
+		"""
+		runs the entire packaging procedure, including prep, package_client, package_server, package_docker_server, and cleanup
+			steps run on stage_workers threads as soon as the steps they depend on are done
+			e.g. the forge install overlaps with packaging the client and copying the modpack's files for the server
+			the time and I/O of each step are written to report_fname (and a cProfile dump to profile_fname) if set, even if a step failed
+			the build plan is exported to plan_fname if set
+		with dry_run set, only the build plan is computed and printed, and nothing is written (see print_plan)
+		"""
+		if self.dry_run:
+			self.print_plan()
+			return
+		instrumentation.default_recorder.profile = not self.profile_fname is None
+		graph = task_graph.task_graph(workers=self.stage_workers)
+		self.add_tasks(graph)
+		start = time.monotonic()
+		try:
+			graph.run()
+		finally:
+			instrumentation.default_recorder.set_total('elapsed_seconds', time.monotonic() - start)
+			if hasattr(self, 'build_plan'):
+				instrumentation.default_recorder.set_total('plan_bytes', self.build_plan.total_bytes())
+			write_instrumentation(self.report_fname, self.profile_fname)
+		if not self.plan_fname is None:
+			progress.message('Writing build plan to "{}"...'.format(self.plan_fname))
+			self.build_plan.write_json(self.plan_fname)
+		progress.message("Files copied by strategy: {}".format(copy_backend.default_backend.report()))
+		progress.message(graph.report())
+
+	def print_plan(self):
+		"""
+		compute the build plan without writing any package, print its totals, and export it to plan_fname if set
+			forge is not installed; if it is not in the forge cache yet, its files are left out of the plan
+			if report_fname holds the report of a previous run, the time the build takes is estimated from it
+		"""
+		self.calculate_initial_paths()
+		self.load_minecraftinstance()
+		self.calculate_paths()
+		self.plan_packages()
+		self.forge_install_dir_path = self.forge_cache.find_install(self.forge_version, self.forge_universal_filename)
+		if self.forge_install_dir_path is None:
+			self.build_plan.notes.append('forge {} is not in the forge cache yet, so its files are not included'.format(self.forge_version))
+		self.add_server_forge_entries(self.build_plan.package('server'))
+		progress.message("Build plan:")
+		progress.message(self.build_plan.summary())
+		if not self.report_fname is None and os.path.isfile(self.report_fname):
+			with open(self.report_fname, 'r') as fp:
+				seconds = build_plan.estimate_seconds(self.build_plan, json.load(fp))
+			if not seconds is None:
+				progress.message('Estimated build time: {:.1f}s (from the run reported in "{}")'.format(seconds, self.report_fname))
+		if not self.plan_fname is None:
+			progress.message('Writing build plan to "{}"...'.format(self.plan_fname))
+			self.build_plan.write_json(self.plan_fname)
+
+def write_instrumentation(report_fname=None, profile_fname=None):
+	"""print what was measured for each phase, and write it to report_fname as JSON and the cProfile results to profile_fname, if set"""
+	progress.message("Time and I/O by phase:")
+	progress.message(instrumentation.default_recorder.summary())
+	if not report_fname is None:
+		progress.message('Writing instrumentation report to "{}"...'.format(report_fname))
+		instrumentation.default_recorder.write_report(report_fname)
+	if not profile_fname is None:
+		progress.message('Writing profile to "{}" (view it with "python -m pstats {}")...'.format(profile_fname, profile_fname))
+		if not instrumentation.default_recorder.dump_profile(profile_fname):
+			progress.warning("Nothing was profiled! No profile written...")
 
 if __name__=='__main__':
 	parser = argparse.ArgumentParser(description='TEST_DESCRIPTION')
 	parser.add_argument('-j', '--client_info_fname',           dest='client_info_fname',           default=argparse.SUPPRESS, help='Filename of a JSON file containing settings.  For details, see example file "client_loc_info.json".  Values specified in the JSON file override those specified by command-line.')
-	parser.add_argument('-r', '--remove_server_mods_fname',    dest='remove_server_mods_fname',    default=argparse.SUPPRESS, help='Filename of a JSON file containing a list of mods to remove for the server.  Should contain a list of filenames in the format ["ExampleMod1-1.12-1.0.1.jar", "ExampleMod2-1.12.2-3.2.01.jar"].')
+	parser.add_argument('-r', '--remove_server_mods_fname',    dest='remove_server_mods_fname',    default=argparse.SUPPRESS, help='Filename of a JSON file containing a list of mods to remove for the server.  Should contain a list of filenames in the format ["ExampleMod1-1.12-1.0.1.jar", "ExampleMod2-1.12.2-3.2.01.jar"].  Entries may also be globs ("ExampleMod1-*.jar"), regexes ("re:ExampleMod1-.*"), or mod IDs ("modid:examplemod1").')
 	parser.add_argument('-d', '--modpack_dir',                 dest='modpack_dir',                 default=argparse.SUPPRESS, help='Path to the directory from which the modpack files should be copied.  On systems running Windows Subsystem for Linux (WSL), supports both WSL paths (/mnt/c/...) and Windows paths (C:\...).')
 	parser.add_argument('-p', '--packages_dir',                dest='packages_dir',                default=argparse.SUPPRESS, help='Path to the directory in which the finished modpack packages should be created.  On systems running Windows Subsystem for Linux (WSL), supports both WSL paths (/mnt/c/...) and Windows paths (C:\...).')
 	parser.add_argument('-a', '--additional_server_files_dir', dest='additional_server_files_dir', default=argparse.SUPPRESS, help='Path to the directory from which additional files for the server should be copied.  Defaults to the folder "additional_server_files" installed with the packager.  On systems running Windows Subsystem for Linux (WSL), supports both WSL paths (/mnt/c/...) and Windows paths (C:\...).')
 	parser.add_argument('-n', '--modpack_name',                dest='modpack_name',                default=argparse.SUPPRESS, help='Name of the modpack used as a prefix for filenames and listed in client "manifest.json".  If not specified (here or in JSON file), defaults to the name specified in "minecraftinstance.json" in the modpack directory.')
 	parser.add_argument('-v', '--modpack_version',             dest='modpack_version',             default=argparse.SUPPRESS, help='Version number of the modpack used as a suffix for filenames and listed in client "manifest.json".  If not specified (here or in JSON file), an error is encountered. #TODO: Implement auto-incrementing version numbers!') #TODO
+	parser.add_argument('-c', '--use_build_cache',             dest='use_build_cache',             default=argparse.SUPPRESS, action='store_true', help='Keep persistent staging directories in a build cache next to the packages directory, and only copy files whose contents changed since the previous build.')
+	parser.add_argument('--build_cache_dir',                   dest='build_cache_dir',             default=argparse.SUPPRESS, help='Path to the directory holding the build cache.  Defaults to the folder ".build_cache" in the packages directory.  On systems running Windows Subsystem for Linux (WSL), supports both WSL paths (/mnt/c/...) and Windows paths (C:\\...).')
+	parser.add_argument('-s', '--stream_packages',             dest='stream_packages',             default=argparse.SUPPRESS, action='store_true', help='Write the client and server packages straight from the source files into the zip archives, skipping the temporary directory.')
+	parser.add_argument('--no_package_dirs',                   dest='write_package_dirs',          default=argparse.SUPPRESS, action='store_false', help='When streaming packages, only write the zip archives and not the unpacked package directories.  Docker packaging is skipped, since it builds from the server package directory.')
+	parser.add_argument('--zip_compresslevel',                 dest='zip_compresslevel',           default=argparse.SUPPRESS, type=int, help='Deflate compression level (0-9) used for the zip archives.  Defaults to 6.  Already-compressed files (jars, zips, images, ...) are always stored without compression.')
+	parser.add_argument('--zip_workers',                       dest='zip_workers',                 default=argparse.SUPPRESS, type=int, help='Number of threads used to compress the zip archives.  Defaults to one per CPU.')
+	parser.add_argument('--copy_workers',                      dest='copy_workers',                default=argparse.SUPPRESS, type=int, help='Number of threads used to copy files into the temporary and package directories.  Defaults to 8.')
+	parser.add_argument('--stage_workers',                     dest='stage_workers',               default=argparse.SUPPRESS, type=int, help='Number of packaging steps (client package, server package, forge install, ...) that may run at the same time.  Defaults to 4.  Use 1 to run the steps one after another.')
+	parser.add_argument('--forge_cache_dir',                   dest='forge_cache_dir',             default=argparse.SUPPRESS, help='Path to the directory holding the shared cache of forge installers and installations.  Defaults to the folder ".mc_forge_installs" in the home directory.  On systems running Windows Subsystem for Linux (WSL), supports both WSL paths (/mnt/c/...) and Windows paths (C:\\...).')
+	parser.add_argument('--forge_cache_max_mb',                dest='forge_cache_max_mb',          default=argparse.SUPPRESS, type=float, help='Maximum total size of the forge installations kept in the cache, in MiB.  The least recently used installations are deleted once it is exceeded.  Unlimited by default.')
+	parser.add_argument('--previous_version',                  dest='previous_version',            default=argparse.SUPPRESS, help='Version number of a previous package in the packages directory.  If set, delta archives holding only the files added or changed since that version (and a list of the removed files) are created next to the full packages.  Apply them to a server with "apply_delta.py".')
+	parser.add_argument('--template_files',                    dest='template_files',              default=argparse.SUPPRESS, nargs='+', help='Glob patterns of the files in the server package whose placeholders (e.g. "{{[MCVER]}}") are filled in, matched against the path inside the package ("*" also matches "/").  Defaults to settings.bat settings.sh settings.py.  Additional placeholder values can be given with "template_values" in the JSON settings file.')
+	parser.add_argument('--detect_client_mods',                dest='detect_client_mods',          default=argparse.SUPPRESS, action='store_true', help='Also disable mods on the server whose metadata (mods.toml or fabric.mod.json) marks them client-only.  What is read from each jar is cached in the build cache directory.')
+	parser.add_argument('--oci_image',                         dest='oci_image',                   default=argparse.SUPPRESS, action='store_true', help='Also write the server image as an OCI image layout and a docker archive (for "docker load"), without a docker daemon.  The server package is split into layers for the forge libraries, the mods, and everything else, so unchanged layers are not uploaded again.  Requires --oci_base_layout_dir.')
+	parser.add_argument('--oci_base_layout_dir',               dest='oci_base_layout_dir',         default=argparse.SUPPRESS, help='Path to an OCI image layout directory holding the base image of the OCI image (e.g. written by "skopeo copy docker://<image> oci:<dir>"), which must provide java, python and the packages in requirements.txt.  On systems running Windows Subsystem for Linux (WSL), supports both WSL paths (/mnt/c/...) and Windows paths (C:\\...).')
+	parser.add_argument('--report',                            dest='report_fname',                default=argparse.SUPPRESS, help='Filename of a JSON report of the wall time, CPU time, files and bytes read and written, and throughput of each step of the packaging procedure, and of the file operations within them.')
+	parser.add_argument('--profile',                           dest='profile_fname',               default=argparse.SUPPRESS, help='Filename of a cProfile dump of the packaging procedure, covering every step and the worker threads they use.  View it with "python -m pstats <filename>".')
+	parser.add_argument('--progress',                          dest='progress_handler',            default=argparse.SUPPRESS, choices=sorted(progress.HANDLERS), help='How progress is reported.  "console" (the default) prints progress messages, "silent" prints nothing, "jsonl" writes every event (messages, start and end of each step, files and bytes done out of the total, throughput) as a line of JSON, and "terminal" prints progress messages along with a progress line on stderr.')
+	parser.add_argument('--progress_file',                     dest='progress_fname',              default=argparse.SUPPRESS, help='Filename the "jsonl" or "terminal" progress output is written to, instead of stdout or stderr.')
+	parser.add_argument('--dry_run', '--dry-run',              dest='dry_run',                     default=argparse.SUPPRESS, action='store_true', help='Only compute the build plan (every file of the client and server packages, where it comes from, its size, and whether it is copied, templated, disabled, or generated) and print its totals, without writing anything.  With --report, the build time is estimated from the report of a previous run.')
+	parser.add_argument('--plan',                              dest='plan_fname',                  default=argparse.SUPPRESS, help='Filename the build plan is exported to as JSON, both in a dry run and in a normal run.')
+	parser.add_argument('-b', '--batch',                       dest='batch_fname',                 default=argparse.SUPPRESS, help='Filename of a JSON file containing a list of jobs (or a JSONL file with one job per line) to package in one run.  Each job is a dict in the format of "client_loc_info.json", and overrides the settings given on the command line.')
+	parser.add_argument('--batch_summary',                     dest='batch_summary_fname',         default=argparse.SUPPRESS, help='Filename of the JSON summary of the result of every job in a batch.  Defaults to the batch filename with "_results.json" in place of the extension.')
+	parser.add_argument('--batch_workers',                     dest='batch_workers',               default=argparse.SUPPRESS, type=int, help='Number of packaging steps that may run at the same time across all the jobs in a batch.  Defaults to 4.')
 	args = parser.parse_args()
 	init_settings = args.__dict__
-	modpack_packager(**init_settings).run()
+	progress_fname = init_settings.pop('progress_fname', None)
+	progress_fp = None if progress_fname is None else open(progress_fname, 'w')
+	progress.default_reporter.set_handlers([progress.make_handler(init_settings.pop('progress_handler', 'console'), fp=progress_fp)])
+	if 'batch_fname' in init_settings:
+		from MinecraftModpackPackager import batch_package
+		report_fname = init_settings.pop('report_fname', None)
+		profile_fname = init_settings.pop('profile_fname', None)
+		instrumentation.default_recorder.profile = not profile_fname is None
+		batch = batch_package.batch_packager(
+			init_settings.pop('batch_fname'), 
+			summary_fname=init_settings.pop('batch_summary_fname', None), 
+			workers=init_settings.pop('batch_workers', 4), 
+			packager_settings=init_settings, 
+		)
+		succeeded = batch.run()
+		write_instrumentation(report_fname, profile_fname)
+		if not succeeded:
+			exit(1)
+	else:
+		modpack_packager(**init_settings).run()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+import os
+import io
+import time
+
+from MinecraftModpackPackager import file_ops
+from MinecraftModpackPackager import zip_writer
+from MinecraftModpackPackager import instrumentation
+from MinecraftModpackPackager import progress
+
+class package_entry(object):
+	"""a single file or directory in a package, along with where its contents come from"""
+	def __init__(self, arcname, src=None, data=None, template=None, is_dir=False, read_only=False, src_stat=None):
+		self.arcname = arcname
+		self.src = src
+		self.data = data
+		self.template = template
+		self.is_dir = is_dir
+		self.read_only = read_only
+		self.renamed_from = None
+		if not self.src is None:
+			if src_stat is None:
+				src_stat = os.stat(self.src)
+			self.mtime = src_stat.st_mtime
+			self.mode = src_stat.st_mode
+			self.size = 0 if self.is_dir else src_stat.st_size
+		else:
+			self.mtime = time.time()
+			if self.is_dir:
+				self.mode = 0o40775
+			else:
+				self.mode = 0o100664
+			self.size = 0 if self.data is None else len(self.data)
+
+	def transform(self):
+		"""how the entry is produced: 'dir', 'generated' (from data), 'template', 'disable' (renamed to ".disabled"), or 'copy'"""
+		if self.is_dir:
+			return 'dir'
+		if not self.data is None:
+			return 'generated'
+		if not self.template is None:
+			return 'template'
+		if not self.renamed_from is None:
+			return 'disable'
+		return 'copy'
+
+	def open(self):
+		"""open a binary file object for reading the contents of this entry"""
+		if not self.data is None:
+			return io.BytesIO(self.data)
+		if not self.template is None:
+			try:
+				return io.BytesIO(self.template.read_rendered(self.src, relpath=self.arcname))
+			except UnicodeDecodeError:
+				progress.warning('"{}" is not a text file! Packaging it without filling in placeholders...'.format(self.src))
+				self.template = None
+		return open(self.src, 'rb')
+
+class package_entries(object):
+	"""
+	ordered collection of the entries that make up a package, keyed by their path inside the package
+		entries are collected from the source directories without copying anything
+		exclude lists, renames, generated files and template substitutions are all applied while writing
+	"""
+	def __init__(self):
+		self.entries = {}
+
+	@staticmethod
+	def arcname(*parts):
+		"""join path parts into a path inside the package, always separated by '/'"""
+		return '/'.join([p.replace(os.sep, '/').strip('/') for p in parts if p!=''])
+
+	def add_dir(self, arcname, src=None, src_stat=None):
+		"""add an empty directory to the package"""
+		self.entries[arcname] = package_entry(arcname, is_dir=True, src=src, src_stat=src_stat)
+
+	def add_data(self, arcname, data):
+		"""add a file with the given contents (bytes) to the package"""
+		self.entries[arcname] = package_entry(arcname, data=data)
+
+	def add_file(self, arcname, src, read_only=False, src_stat=None):
+		"""add a file to the package, read from src when the package is written"""
+		self.entries[arcname] = package_entry(arcname, src=src, read_only=read_only, src_stat=src_stat)
+
+	def add_directory(self, src, prefix='', exclude=[], read_only=False):
+		"""
+		add a directory and its contents to the package at prefix, skipping anything in exclude (same rules as file_ops.copy_directory)
+		read_only (a bool, or a list of file extensions) marks files that may be hardlinked into the package directory
+		"""
+		self.add_scanned(file_ops.walk_directory(src, exclude=exclude), prefix=prefix, read_only=read_only)
+
+	def add_scanned(self, items, prefix='', read_only=False):
+		"""add the (relative path, os.DirEntry) tuples of a directory listing (see file_ops.walk_directory) to the package at prefix"""
+		if prefix!='':
+			self.add_dir(prefix)
+		for rel, dir_entry in items:
+			arcname = self.arcname(prefix, rel)
+			if dir_entry.is_dir():
+				self.add_dir(arcname, src=dir_entry.path, src_stat=dir_entry.stat())
+			else:
+				self.add_file(arcname, dir_entry.path, read_only=file_ops.is_read_only(rel, read_only), src_stat=dir_entry.stat())
+
+	def is_file(self, arcname):
+		"""check whether the package contains a file at arcname"""
+		return arcname in self.entries and not self.entries[arcname].is_dir
+
+	def rename(self, arcname, new_arcname):
+		"""move a file to a new path inside the package"""
+		entry = self.entries.pop(arcname)
+		if entry.renamed_from is None:
+			entry.renamed_from = arcname
+		entry.arcname = new_arcname
+		self.entries[new_arcname] = entry
+
+	def apply_template(self, template):
+		"""fill in the placeholders of every file matching the rules of a template_engine when the file is written"""
+		for entry in self.entries.values():
+			if not entry.is_dir and entry.data is None and template.matches(entry.arcname):
+				entry.template = template
+
+	def sorted_entries(self):
+		"""all entries, in a stable order"""
+		return [self.entries[arcname] for arcname in sorted(self.entries)]
+
+	def write_directory(self, directory):
+		"""write the package out as an unpacked directory"""
+		with instrumentation.default_recorder.operation('package_stream.write_directory'):
+			if not os.path.isdir(directory):
+				os.makedirs(directory)
+			entries = self.sorted_entries()
+			with progress.default_reporter.tracker('write_directory') as tracker:
+				tracker.add_total(len([entry for entry in entries if not entry.is_dir]), sum([entry.size for entry in entries]))
+				for entry in entries:
+					dest = os.path.join(directory, *entry.arcname.split('/'))
+					if entry.is_dir:
+						if not os.path.isdir(dest):
+							os.makedirs(dest)
+						continue
+					if entry.data is None and entry.template is None:
+						file_ops.copy_file(entry.src, dest, read_only=entry.read_only)
+					else:
+						if not os.path.isdir(os.path.dirname(dest)):
+							os.makedirs(os.path.dirname(dest))
+						with entry.open() as src_fp:
+							contents = src_fp.read()
+						with open(dest, 'wb') as dest_fp:
+							dest_fp.write(contents)
+						instrumentation.default_recorder.count_written(1, len(contents))
+					tracker.advance(1, entry.size)
+
+	def write_zip(self, archive, compresslevel=6, workers=None):
+		"""write the package straight into a zip archive, reading each source file only once"""
+		if not os.path.isdir(os.path.dirname(archive)):
+			os.makedirs(os.path.dirname(archive))
+		with instrumentation.default_recorder.operation('package_stream.write_zip'):
+			with progress.default_reporter.tracker('write_zip') as tracker:
+				zip_writer.write_zip(archive, self.sorted_entries(), compresslevel=compresslevel, workers=workers, tracker=tracker)
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import time
+import threading
+import contextlib
+
+# kinds of events delivered to the handlers of a progress_reporter
+EVENT_KINDS = ['message', 'warning', 'error', 'stage_start', 'stage_end', 'progress']
+
+class event(object):
+	"""
+	something that happened while packaging, as delivered to the handlers of a progress_reporter
+		message, warning and error events carry the text printed to the console (errors are failures the packager carries on after, e.g. a failed batch job)
+		stage_start and stage_end events mark a step of the packaging procedure (stage_end also has seconds and succeeded)
+		progress events carry the files and bytes an operation (e.g. "copy_directory") has done so far, out of the totals if they are known, and the current throughput
+	"""
+	__slots__ = ['kind', 'time', 'stage', 'operation', 'message', 'files_done', 'files_total', 'bytes_done', 'bytes_total', 'bytes_per_second', 'seconds', 'succeeded', 'finished']
+
+	def __init__(self, kind, stage=None, operation=None, message=None, files_done=None, files_total=None, bytes_done=None, bytes_total=None, bytes_per_second=None, seconds=None, succeeded=None, finished=None):
+		self.kind = kind
+		self.time = time.time()
+		self.stage = stage
+		self.operation = operation
+		self.message = message
+		self.files_done = files_done
+		self.files_total = files_total
+		self.bytes_done = bytes_done
+		self.bytes_total = bytes_total
+		self.bytes_per_second = bytes_per_second
+		self.seconds = seconds
+		self.succeeded = succeeded
+		self.finished = finished
+
+	def as_dict(self):
+		"""the event as a dict, leaving out the fields that are not set"""
+		return dict([(name, getattr(self, name)) for name in self.__slots__ if not getattr(self, name) is None])
+
+class console_handler(object):
+	"""prints messages, warnings and errors, exactly like the packager always has; ignores everything else"""
+	wants_progress = False
+
+	def handle(self, ev):
+		if ev.kind=='message':
+			print(ev.message)
+		elif ev.kind=='warning':
+			print('WARNING: ' + ev.message)
+		elif ev.kind=='error':
+			print('ERROR: ' + ev.message)
+
+class silent_handler(object):
+	"""ignores every event"""
+	wants_progress = False
+
+	def handle(self, ev):
+		pass
+
+class jsonl_handler(object):
+	"""writes every event as a line of JSON to a file object (stdout by default), for CI jobs and dashboards to parse"""
+	wants_progress = True
+
+	def __init__(self, fp=None):
+		self.fp = fp
+
+	def handle(self, ev):
+		fp = sys.stdout if self.fp is None else self.fp
+		fp.write(json.dumps(ev.as_dict()) + '\n')
+		fp.flush()
+
+def format_size(size):
+	"""a number of bytes as MiB, for progress lines"""
+	return '{:.1f} MiB'.format(size / 1024 / 1024)
+
+class terminal_handler(console_handler):
+	"""
+	prints messages and warnings like console_handler, and a single progress line that is redrawn in place
+	the progress line goes to stderr (by default), so the messages on stdout can still be redirected
+	"""
+	wants_progress = True
+
+	def __init__(self, fp=None, width=100):
+		self.fp = fp
+		self.width = width
+		self.line_shown = False
+
+	def clear_line(self):
+		"""remove the progress line, so a message can be printed in its place"""
+		if self.line_shown:
+			fp = sys.stderr if self.fp is None else self.fp
+			fp.write('\r' + ' '*self.width + '\r')
+			fp.flush()
+			self.line_shown = False
+
+	def progress_line(self, ev):
+		"""the progress line for a progress event, e.g. "package_client copy_directory: 120/300 files  12.0/40.0 MiB (30%)  25.3 MiB/s" """
+		parts = [' '.join([name for name in [ev.stage, ev.operation] if not name is None]) + ':']
+		if ev.files_total is None:
+			parts.append('{} files'.format(ev.files_done))
+		else:
+			parts.append('{}/{} files'.format(ev.files_done, ev.files_total))
+		if ev.bytes_total is None:
+			parts.append(format_size(ev.bytes_done))
+		else:
+			parts.append('{}/{}'.format(format_size(ev.bytes_done), format_size(ev.bytes_total)))
+			if ev.bytes_total > 0:
+				parts.append('({:.0f}%)'.format(100.0 * ev.bytes_done / ev.bytes_total))
+		if not ev.bytes_per_second is None:
+			parts.append('{}/s'.format(format_size(ev.bytes_per_second)))
+		return ' '.join(parts)[:self.width]
+
+	def handle(self, ev):
+		if ev.kind in ['message', 'warning', 'error']:
+			self.clear_line()
+			console_handler.handle(self, ev)
+		elif ev.kind=='progress':
+			fp = sys.stderr if self.fp is None else self.fp
+			fp.write('\r' + self.progress_line(ev).ljust(self.width))
+			if ev.finished:
+				fp.write('\n')
+			fp.flush()
+			self.line_shown = not ev.finished
+
+# handlers selectable by name (e.g. from the command line), see make_handler
+HANDLERS = {
+	'console':console_handler,
+	'silent':silent_handler,
+	'jsonl':jsonl_handler,
+	'terminal':terminal_handler,
+}
+
+def make_handler(name, fp=None):
+	"""create the handler called name (see HANDLERS), writing to fp instead of stdout/stderr if it is given"""
+	if not name in HANDLERS:
+		raise Exception('Unknown progress handler "{name}"! Expected one of {names}'.format(name=name, names=', '.join(sorted(HANDLERS))))
+	if name in ['console', 'silent']:
+		return HANDLERS[name]()
+	return HANDLERS[name](fp=fp)
+
+class progress_tracker(object):
+	"""
+	counts the files and bytes done by one operation (e.g. a copy_directory), and reports them as progress events
+		advance is safe to call from worker threads, and only emits an event once every interval seconds, so it can be called for every file (or chunk)
+		when no handler wants progress events, advance returns straight away
+		the totals may be added to while the operation runs, e.g. when they are only known once a download has started
+	"""
+	def __init__(self, reporter, operation, stage=None, files_total=None, bytes_total=None, interval=0.2):
+		self.reporter = reporter
+		self.operation = operation
+		self.stage = stage
+		self.enabled = reporter.wants_progress()
+		self.interval = interval
+		self.lock = threading.Lock()
+		self.files_done = 0
+		self.bytes_done = 0
+		self.files_total = files_total
+		self.bytes_total = bytes_total
+		self.start_time = time.monotonic()
+		self.last_time = self.start_time
+		self.last_bytes = 0
+
+	def add_total(self, files=0, size=None):
+		"""add files and bytes (size, if it is known) to the totals of the operation"""
+		with self.lock:
+			self.files_total = (self.files_total or 0) + files
+			if not size is None:
+				self.bytes_total = (self.bytes_total or 0) + size
+
+	def advance(self, files=1, size=0):
+		"""record files and bytes (size) as done, reporting them if interval seconds passed since the last report"""
+		if not self.enabled:
+			return
+		with self.lock:
+			self.files_done += files
+			self.bytes_done += size
+			now = time.monotonic()
+			if now - self.last_time < self.interval:
+				return
+			ev = self.progress_event(now, self.last_time, self.last_bytes, False)
+			self.last_time = now
+			self.last_bytes = self.bytes_done
+		self.reporter.emit(ev)
+
+	def progress_event(self, now, since_time, since_bytes, finished):
+		"""a progress event with the throughput since since_time (call with lock held)"""
+		bytes_per_second = None
+		if now > since_time:
+			bytes_per_second = (self.bytes_done - since_bytes) / (now - since_time)
+		return event('progress', stage=self.stage, operation=self.operation, files_done=self.files_done, files_total=self.files_total, bytes_done=self.bytes_done, bytes_total=self.bytes_total, bytes_per_second=bytes_per_second, finished=finished)
+
+	def finish(self):
+		"""report the final counts, with the average throughput of the whole operation"""
+		if not self.enabled:
+			return
+		with self.lock:
+			ev = self.progress_event(time.monotonic(), self.start_time, 0, True)
+		self.reporter.emit(ev)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, tb):
+		self.finish()
+
+class progress_reporter(object):
+	"""
+	delivers the events of the packager to a list of handlers (see HANDLERS), one event at a time
+	the stage running on a thread is kept in a thread-local, so progress events are labelled with the stage that started the operation
+	"""
+	def __init__(self, handlers=None, interval=0.2):
+		self.lock = threading.Lock()
+		self.local = threading.local()
+		self.handlers = [console_handler()] if handlers is None else handlers
+		self.interval = interval
+
+	def set_handlers(self, handlers):
+		"""replace the handlers events are delivered to"""
+		with self.lock:
+			self.handlers = handlers
+
+	def wants_progress(self):
+		"""check whether any of the handlers uses progress events"""
+		return any([handler.wants_progress for handler in self.handlers])
+
+	def emit(self, ev):
+		"""deliver an event to every handler"""
+		with self.lock:
+			for handler in self.handlers:
+				handler.handle(ev)
+
+	def current_stage(self):
+		"""the name of the stage running on this thread, or None"""
+		return getattr(self.local, 'stage', None)
+
+	def message(self, text):
+		"""report a progress message (e.g. "Copying client config directory...")"""
+		self.emit(event('message', stage=self.current_stage(), message=text))
+
+	def warning(self, text):
+		"""report a warning (the console handler prints it with "WARNING: " in front)"""
+		self.emit(event('warning', stage=self.current_stage(), message=text))
+
+	def error(self, text):
+		"""report a failure the packager carries on after (the console handler prints it with "ERROR: " in front)"""
+		self.emit(event('error', stage=self.current_stage(), message=text))
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		"""report the start and end of a stage of the packager, which is everything done inside the with block"""
+		previous = self.current_stage()
+		self.local.stage = name
+		self.emit(event('stage_start', stage=name))
+		start = time.monotonic()
+		succeeded = False
+		try:
+			yield
+			succeeded = True
+		finally:
+			self.emit(event('stage_end', stage=name, seconds=time.monotonic() - start, succeeded=succeeded))
+			self.local.stage = previous
+
+	def tracker(self, operation, files_total=None, bytes_total=None):
+		"""start tracking the progress of an operation in the current stage (see progress_tracker)"""
+		return progress_tracker(self, operation, stage=self.current_stage(), files_total=files_total, bytes_total=bytes_total, interval=self.interval)
+
+default_reporter = progress_reporter()
+
+def message(text):
+	"""report a progress message through the default reporter"""
+	default_reporter.message(text)
+
+def warning(text):
+	"""report a warning through the default reporter"""
+	default_reporter.warning(text)
+
+def error(text):
+	"""report an error through the default reporter"""
+	default_reporter.error(text)
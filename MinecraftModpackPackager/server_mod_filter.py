@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import os
+import re
+import fnmatch
+import concurrent.futures
+
+from MinecraftModpackPackager import jar_metadata
+
+REGEX_RULE_PREFIX = 're:'
+MOD_ID_RULE_PREFIX = 'modid:'
+GLOB_CHARACTERS = '*?['
+
+class mod_file(object):
+	"""a file directly inside the mods directory"""
+	__slots__ = ['name', 'path', 'stat']
+
+	def __init__(self, name, path, stat):
+		self.name = name
+		self.path = path
+		self.stat = stat
+
+def index_mods_dir(mods_dir):
+	"""list the files directly inside the mods directory (sorted by name) in a single scan; a missing directory has no files"""
+	if not os.path.isdir(mods_dir):
+		return []
+	index = []
+	with os.scandir(mods_dir) as scan:
+		for dir_entry in scan:
+			if dir_entry.is_file():
+				index.append(mod_file(dir_entry.name, dir_entry.path, dir_entry.stat()))
+	return sorted(index, key=lambda cur_file: cur_file.name)
+
+class server_mod_filter(object):
+	"""
+	selects the mods to disable on the server, from a list of rules in the format of remove_server_mods.json
+		"ExampleMod1-1.12-1.0.1.jar" or "ExampleMod1-1.12-1.0.1" disables exactly that file, as the list always has
+		"ExampleMod1-*.jar" disables every file matching the glob, so the rule survives updates of the mod
+		"re:ExampleMod1-.*\\.jar" disables every file the regex matches in full
+		"modid:examplemod1" disables every jar declaring that mod ID in its mcmod.info, mods.toml, or fabric.mod.json
+	with detect_client_only, jars whose metadata marks them client-only are disabled as well
+	the metadata of jars is taken from index (a mod_index.mod_index) when given; jars it does not know are read directly
+	the globs and regexes are compiled into a single regex, so each file name is matched once however many rules there are
+	"""
+	def __init__(self, rules=[], detect_client_only=False, index=None, workers=4):
+		self.rules = list(rules)
+		self.detect_client_only = detect_client_only
+		self.index = index
+		self.workers = workers
+		self.names = {}
+		self.mod_ids = {}
+		self.pattern_rules = []
+		patterns = []
+		for rule in self.rules:
+			if rule.startswith(MOD_ID_RULE_PREFIX):
+				self.mod_ids[rule[len(MOD_ID_RULE_PREFIX):]] = rule
+				continue
+			if rule.startswith(REGEX_RULE_PREFIX):
+				pattern = rule[len(REGEX_RULE_PREFIX):]
+				try:
+					re.compile(pattern)
+				except re.error as e:
+					raise Exception('Invalid regex in server mod rule "{rule}": {error}'.format(rule=rule, error=e))
+			elif any([char in rule for char in GLOB_CHARACTERS]):
+				pattern = fnmatch.translate(rule)
+			else:
+				self.names.setdefault(rule, rule)
+				self.names.setdefault(rule + '.jar', rule)
+				continue
+			# each rule gets its own group, so the rule that matched can be reported
+			patterns.append('(?P<_rule{index}>{pattern})'.format(index=len(self.pattern_rules), pattern=pattern))
+			self.pattern_rules.append(rule)
+		self.pattern = None
+		if len(patterns) > 0:
+			self.pattern = re.compile('|'.join(patterns))
+
+	def needs_metadata(self):
+		"""check whether any rule depends on the metadata inside the jars"""
+		return self.detect_client_only or len(self.mod_ids) > 0
+
+	def match_name(self, name):
+		"""the rule matching a file name, or None"""
+		if name in self.names:
+			return self.names[name]
+		if not self.pattern is None:
+			match = self.pattern.fullmatch(name)
+			if not match is None:
+				return self.pattern_rules[int(match.lastgroup[len('_rule'):])]
+		return None
+
+	def match_metadata(self, metadata):
+		"""the reason the metadata of a jar gets it disabled, or None"""
+		for mod_id in metadata['mod_ids']:
+			if mod_id in self.mod_ids:
+				return 'matches "{}"'.format(self.mod_ids[mod_id])
+		if self.detect_client_only and metadata['client_only']:
+			return 'is a client-only mod'
+		return None
+
+	def read_metadata(self, jar_files):
+		"""the metadata of each jar, from the index if it has the jar, or else read on worker threads"""
+		metadata = [None] * len(jar_files)
+		if not self.index is None:
+			# the index can only be used on the thread that opened it, so it is not used on the worker threads
+			metadata = [self.index.metadata(cur_file.path) for cur_file in jar_files]
+		unread = [i for i in range(len(jar_files)) if metadata[i] is None]
+		if len(unread) > 0:
+			with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+				for i, cur_metadata in zip(unread, executor.map(lambda i: jar_metadata.read_jar_metadata(jar_files[i].path), unread)):
+					metadata[i] = cur_metadata
+		return metadata
+
+	def select(self, index):
+		"""the files in an index of the mods directory (see index_mods_dir) to disable, as a list of (mod_file, reason) tuples in index order"""
+		reasons = {}
+		unmatched_jars = []
+		for cur_file in index:
+			rule = self.match_name(cur_file.name)
+			if not rule is None:
+				reasons[cur_file.name] = 'matches "{}"'.format(rule)
+			elif self.needs_metadata() and cur_file.name.endswith('.jar'):
+				unmatched_jars.append(cur_file)
+		for cur_file, metadata in zip(unmatched_jars, self.read_metadata(unmatched_jars)):
+			reason = self.match_metadata(metadata)
+			if not reason is None:
+				reasons[cur_file.name] = reason
+		return [(cur_file, reasons[cur_file.name]) for cur_file in index if cur_file.name in reasons]
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import time
+import concurrent.futures
+
+class task(object):
+	"""a single step of a task_graph, along with the steps it depends on and when it ran"""
+	def __init__(self, name, func, deps=[], after=[]):
+		self.name = name
+		self.func = func
+		self.deps = list(deps)
+		self.after = list(after)
+		self.start_time = None
+		self.end_time = None
+
+	def duration(self):
+		"""how long the task took to run, in seconds"""
+		return self.end_time - self.start_time
+
+class task_graph(object):
+	"""
+	runs a set of steps on a pool of worker threads, starting each step as soon as all the steps it depends on have finished
+		if a step fails, no further steps are started and the error is raised once the running steps are done
+		with keep_going, only the steps that depend on a failed step are skipped, and the errors are kept in errors instead of raised
+		records when each step ran, so the critical path through the graph can be reported afterwards
+	"""
+	def __init__(self, workers=4):
+		self.workers = workers
+		self.tasks = {}
+		self.order = []
+		self.start_time = None
+		self.end_time = None
+		self.errors = {}
+		self.skipped = set()
+
+	def add_task(self, name, func, deps=[], after=[]):
+		"""
+		add a step to the graph, which runs func() once every step named in deps has finished
+		steps named in after only order the steps: this step waits for them, but still runs if they failed or were skipped
+		"""
+		for dep in list(deps) + list(after):
+			if not dep in self.tasks:
+				raise Exception('Task "{name}" depends on unknown task "{dep}"!'.format(name=name, dep=dep))
+		self.tasks[name] = task(name, func, deps, after)
+		self.order.append(name)
+
+	def run_task(self, name):
+		"""run a single step, recording its start and end times (runs on the worker threads)"""
+		cur_task = self.tasks[name]
+		cur_task.start_time = time.time()
+		try:
+			cur_task.func()
+		finally:
+			cur_task.end_time = time.time()
+
+	def run(self, keep_going=False):
+		"""run every step in the graph, honoring the dependencies between them"""
+		self.start_time = time.time()
+		self.errors = {}
+		self.skipped = set()
+		done = set()
+		running = {}
+		waiting = list(self.order)
+		error = None
+		with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+			while len(waiting) > 0 or len(running) > 0:
+				if error is None:
+					for name in list(waiting):
+						if any([(dep in self.errors or dep in self.skipped) for dep in self.tasks[name].deps]):
+							waiting.remove(name)
+							self.skipped.add(name)
+						elif all([dep in done for dep in self.tasks[name].deps]) and all([(dep in done or dep in self.errors or dep in self.skipped) for dep in self.tasks[name].after]):
+							waiting.remove(name)
+							running[executor.submit(self.run_task, name)] = name
+				if len(running)==0:
+					break
+				finished, _ = concurrent.futures.wait(list(running), return_when=concurrent.futures.FIRST_COMPLETED)
+				for future in finished:
+					name = running.pop(future)
+					if future.exception() is None:
+						done.add(name)
+					else:
+						self.errors[name] = future.exception()
+						if not keep_going and error is None:
+							error = future.exception()
+		self.end_time = time.time()
+		if not error is None:
+			raise error
+
+	def status(self, name):
+		"""whether a step is 'done', 'failed', 'skipped' (because a step it depends on failed), or 'not run'"""
+		if name in self.errors:
+			return 'failed'
+		if name in self.skipped:
+			return 'skipped'
+		if self.tasks[name].end_time is None:
+			return 'not run'
+		return 'done'
+
+	def critical_path(self):
+		"""the chain of steps that determined the total run time, starting with the first step (steps that never finished, e.g. skipped ones, are left out)"""
+		finished = [self.tasks[name] for name in self.order if not self.tasks[name].end_time is None]
+		if len(finished)==0:
+			return []
+		cur_task = max(finished, key=lambda t: t.end_time)
+		path = [cur_task]
+		while True:
+			finished_deps = [self.tasks[dep] for dep in cur_task.deps if not self.tasks[dep].end_time is None]
+			if len(finished_deps)==0:
+				break
+			cur_task = max(finished_deps, key=lambda t: t.end_time)
+			path.insert(0, cur_task)
+		return path
+
+	def report(self):
+		"""describe the critical path through the graph, with the time spent in each step"""
+		lines = ['Critical path ({:.2f}s total):'.format(self.end_time - self.start_time)]
+		for cur_task in self.critical_path():
+			lines.append('  {name}: {duration:.2f}s'.format(name=cur_task.name, duration=cur_task.duration()))
+		return '\n'.join(lines)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import os
+import re
+import locale
+import fnmatch
+import threading
+
+from MinecraftModpackPackager import progress
+
+# files templated unless other rules are configured
+DEFAULT_TEMPLATE_FILES = [
+	'settings.bat',
+	'settings.sh',
+	'settings.py',
+]
+
+# any placeholder, whether or not a value is known for it
+PLACEHOLDER_PATTERN = re.compile(r'\{\{\[[^\[\]{}\r\n]*\]\}\}')
+
+def placeholder(name):
+	"""the placeholder for a template key, e.g. "{{[MCVER]}}" for "MCVER" (names already in that form are kept)"""
+	if PLACEHOLDER_PATTERN.fullmatch(name):
+		return name
+	return '{{[' + name + ']}}'
+
+class template_engine(object):
+	"""
+	fills in placeholders (e.g. "{{[MCVER]}}") in the text files of a package
+		all the keys are compiled into a single regex alternation, so each file is scanned once however many keys there are
+		substituted values are never scanned again, so a value containing another placeholder is kept as-is
+		files are selected with glob rules matched against the whole path inside the package, where '*' also matches '/' (e.g. "settings.sh" or "config/*.cfg")
+		placeholders without a value are recorded per file, so they can be reported once the package is done
+	"""
+	def __init__(self, values, rules=DEFAULT_TEMPLATE_FILES):
+		self.values = dict([(placeholder(key), value) for key, value in values.items()])
+		self.rules = list(rules)
+		self.pattern = None
+		if len(self.values) > 0:
+			# longest first, so a key that starts with another key still wins
+			self.pattern = re.compile('|'.join([re.escape(key) for key in sorted(self.values, key=len, reverse=True)]))
+		# '(?!)' never matches, for when there are no rules
+		self.rules_pattern = re.compile('|'.join(['(?:{})'.format(fnmatch.translate(rule)) for rule in self.rules]) or '(?!)')
+		self.lock = threading.Lock()
+		self.unresolved = {}
+
+	def matches(self, relpath):
+		"""check whether the file at relpath (inside the package) should be templated"""
+		return not self.rules_pattern.match(relpath.replace(os.sep, '/').strip('/')) is None
+
+	def render_string(self, contents, relpath=None):
+		"""fill in the placeholders in a string, recording any left without a value under relpath"""
+		if not self.pattern is None:
+			contents = self.pattern.sub(lambda match: self.values[match.group(0)], contents)
+		if not relpath is None:
+			unresolved = set(PLACEHOLDER_PATTERN.findall(contents))
+			if len(unresolved) > 0:
+				with self.lock:
+					self.unresolved.setdefault(relpath.replace(os.sep, '/'), set()).update(unresolved)
+		return contents
+
+	def read_rendered(self, src, relpath=None):
+		"""
+		render a text file, encoded as the old replace_in_file wrote it (preferred encoding, platform line endings)
+		raises UnicodeDecodeError for files that are not text
+		"""
+		with open(src, 'r') as fp:
+			contents = self.render_string(fp.read(), relpath=relpath)
+		return contents.replace('\n', os.linesep).encode(locale.getpreferredencoding(False))
+
+	def render_file(self, src, dest, relpath=None):
+		"""write a rendered copy of src to dest, replacing (rather than modifying) any file already at dest"""
+		rendered = self.read_rendered(src, relpath=relpath)
+		if os.path.lexists(dest):
+			os.remove(dest)
+		with open(dest, 'wb') as fp:
+			fp.write(rendered)
+
+	def report(self):
+		"""warn about every placeholder that was left without a value; returns whether there were any"""
+		with self.lock:
+			for relpath in sorted(self.unresolved):
+				progress.warning('Unresolved template placeholders in "{relpath}": {placeholders}'.format(relpath=relpath, placeholders=', '.join(sorted(self.unresolved[relpath]))))
+			return len(self.unresolved) > 0
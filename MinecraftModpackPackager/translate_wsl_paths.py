@@ -1,7 +1,18 @@
 #!/usr/bin/env python
 
 import os
+import functools
+import threading
 import subprocess
+import configparser
+
+from MinecraftModpackPackager import progress
+
+# where WSL mounts the Windows drives, unless /etc/wsl.conf says otherwise
+WSL_CONF_FNAME = '/etc/wsl.conf'
+DEFAULT_AUTOMOUNT_ROOT = '/mnt/'
+# hosts of the UNC paths Windows uses for the files inside a WSL distribution
+WSL_UNC_HOSTS = ['wsl$', 'wsl.localhost']
 
 def is_win_path(path):
 	if len(path)==0:
@@ -34,11 +45,27 @@ def is_win_path(path):
 			return False
 	return False
 
+@functools.lru_cache(maxsize=None)
+def automount_root():
+	"""the folder the Windows drives are mounted in under WSL ("root" in the [automount] section of /etc/wsl.conf), ending with '/'"""
+	root = DEFAULT_AUTOMOUNT_ROOT
+	if not is_running_win() and os.path.isfile(WSL_CONF_FNAME):
+		parser = configparser.ConfigParser()
+		try:
+			parser.read(WSL_CONF_FNAME)
+			root = parser.get('automount', 'root', fallback=root).strip().strip('"\'')
+		except configparser.Error:
+			progress.warning('Could not read "{}"! Assuming drives are mounted in "{}"...'.format(WSL_CONF_FNAME, DEFAULT_AUTOMOUNT_ROOT))
+	if not root.endswith('/'):
+		root = root + '/'
+	return root
+
 def is_wsl_path(path):
-	if path[:5]=='/mnt/':
-		if path[5:][:1] in ['/','']:
+	root = automount_root()
+	if path[:len(root)]==root:
+		if path[len(root):][:1] in ['/','']:
 			return False
-		if path[6:][:1] in ['/','']:
+		if path[len(root)+1:][:1] in ['/','']:
 			return True
 	return False
 
@@ -47,6 +74,7 @@ def is_running_win():
 		return True
 	return False
 
+@functools.lru_cache(maxsize=None)
 def is_running_wsl():
 	if is_running_win():
 		return False
@@ -57,23 +85,91 @@ def is_running_wsl():
 			return True
 	return False
 
+@functools.lru_cache(maxsize=4096)
+def win_to_wsl_in_process(path):
+	"""translate a drive letter path, or a UNC path into the running WSL distribution, without calling wslpath (returns None for any other path)"""
+	if path[1:2]==':' and path[:1].isalpha():
+		rest = path[2:].replace('\\', '/')
+		if rest=='' or rest.startswith('/'):
+			return automount_root() + path[0].lower() + rest
+		# drive-relative paths (e.g. "C:folder") depend on the current directory of that drive
+		return None
+	parts = path.replace('/', '\\').lstrip('\\').split('\\')
+	distro = os.environ.get('WSL_DISTRO_NAME', '')
+	if path[:2] in ['\\\\', '//'] and len(parts) >= 2 and parts[0].lower() in WSL_UNC_HOSTS and distro!='' and parts[1].lower()==distro.lower():
+		return '/' + '/'.join(parts[2:])
+	return None
+
+@functools.lru_cache(maxsize=4096)
+def wsl_to_win_in_process(path):
+	"""translate a path inside the WSL drive mounts into a drive letter path without calling wslpath (returns None for any other path)"""
+	if not is_wsl_path(path):
+		return None
+	rest = path[len(automount_root()):]
+	return rest[0].upper() + ':\\' + rest[2:].replace('/', '\\')
+
+# results of wslpath calls, keyed by option and path, so no path is passed to wslpath twice
+wslpath_cache = {}
+wslpath_lock = threading.Lock()
+
+def wslpath(paths, option):
+	"""
+	translate paths with wslpath (option is '-u' for WSL paths or '-w' for Windows paths)
+	all the paths not translated before are passed to a single bash subprocess, which calls wslpath for each of them
+	paths wslpath cannot translate are returned untranslated
+	"""
+	with wslpath_lock:
+		missing = []
+		for path in paths:
+			if not (option, path) in wslpath_cache and not path in missing:
+				missing.append(path)
+		if len(missing) > 0:
+			script = 'for p in "$@"; do wslpath {} "$p" 2>/dev/null || echo; done'.format(option)
+			try:
+				lines = subprocess.check_output(['bash', '-c', script, 'wslpath'] + missing).decode('utf-8').replace('\r', '').split('\n')
+			except (subprocess.CalledProcessError, OSError):
+				lines = []
+			lines = lines + ['']*(len(missing) - len(lines))
+			for path, translated in zip(missing, lines):
+				if translated=='':
+					progress.warning('wslpath call could not translate path "{}"! Using untranslated path!'.format(path))
+					translated = path
+				wslpath_cache[(option, path)] = translated
+		return [wslpath_cache[(option, path)] for path in paths]
+
 def translate_wsl_to_win(path):
-	try:
-		return subprocess.check_output(['bash','-c',"wslpath -w '{}'".format(path)]).decode('utf-8').replace('\n','')
-	except subprocess.CalledProcessError:
-		print('WARNING: wslpath call could not translate path "{}"! Using untranslated path!'.format(path))
-		return path
+	translated = wsl_to_win_in_process(path)
+	if translated is None:
+		translated = wslpath([path], '-w')[0]
+	return translated
 
 def translate_win_to_wsl(path):
-	try:
-		return subprocess.check_output(['bash','-c',"wslpath -u '{}'".format(path)]).decode('utf-8').replace('\n','')
-	except subprocess.CalledProcessError:
-		print('WARNING: wslpath call could not translate path "{}"! Using untranslated path!'.format(path))
-		return path
+	translated = win_to_wsl_in_process(path)
+	if translated is None:
+		translated = wslpath([path], '-u')[0]
+	return translated
+
+def translate_paths(paths):
+	"""
+	translate a list of paths to native paths, like translate_path_to_native
+	paths that cannot be translated in-process are passed to wslpath together, in a single subprocess
+	"""
+	translated = list(paths)
+	fallback = {'-u':[], '-w':[]}
+	for index, path in enumerate(paths):
+		if is_win_path(path) and is_running_wsl():
+			translated[index] = win_to_wsl_in_process(path)
+			if translated[index] is None:
+				fallback['-u'].append(index)
+		elif is_wsl_path(path) and is_running_win():
+			translated[index] = wsl_to_win_in_process(path)
+			if translated[index] is None:
+				fallback['-w'].append(index)
+	for option, indices in fallback.items():
+		if len(indices) > 0:
+			for index, path in zip(indices, wslpath([paths[index] for index in indices], option)):
+				translated[index] = path
+	return translated
 
 def translate_path_to_native(path):
-	if is_win_path(path) and is_running_wsl():
-		return translate_win_to_wsl(path)
-	elif is_wsl_path(path) and is_running_win():
-		return translate_wsl_to_win(path)
-	return path
\ No newline at end of file
+	return translate_paths([path])[0]
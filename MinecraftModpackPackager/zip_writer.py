@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+import os
+import time
+import zlib
+import struct
+import shutil
+import tempfile
+import concurrent.futures
+
+from MinecraftModpackPackager import instrumentation
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# sizes, offsets and entry counts past these limits need the zip64 extensions
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+
+# file types that are already compressed, so deflating them again only wastes time
+STORED_EXTENSIONS = [
+	'.jar',
+	'.zip',
+	'.png',
+	'.jpg',
+	'.jpeg',
+	'.gif',
+	'.ogg',
+	'.mp3',
+	'.gz',
+	'.xz',
+	'.bz2',
+	'.7z',
+]
+
+CHUNK_SIZE = 1024*1024
+
+if os.name=='nt':
+	CREATE_SYSTEM = 0
+else:
+	CREATE_SYSTEM = 3
+
+class zip_entry(object):
+	"""a file or directory on disk that should be written into a zip archive"""
+	def __init__(self, arcname, src, is_dir=False):
+		self.arcname = arcname
+		self.src = src
+		self.is_dir = is_dir
+		src_stat = os.stat(self.src)
+		self.mtime = src_stat.st_mtime
+		self.mode = src_stat.st_mode
+		self.size = 0 if is_dir else src_stat.st_size
+
+	def open(self):
+		"""open a binary file object for reading the contents of this entry"""
+		return open(self.src, 'rb')
+
+def directory_entries(directory):
+	"""list a directory as zip entries, in the same order and with the same names shutil.make_archive would use"""
+	entries = []
+	for dirpath, dirnames, filenames in os.walk(directory):
+		arcdirpath = os.path.relpath(dirpath, directory)
+		for name in sorted(dirnames):
+			entries.append(zip_entry(os.path.normpath(os.path.join(arcdirpath, name)).replace(os.sep, '/'), os.path.join(dirpath, name), is_dir=True))
+		for name in filenames:
+			path = os.path.join(dirpath, name)
+			if os.path.isfile(path):
+				entries.append(zip_entry(os.path.normpath(os.path.join(arcdirpath, name)).replace(os.sep, '/'), path))
+	return entries
+
+class compressed_entry(object):
+	"""the result of compressing a single entry, ready to be written into the archive"""
+	def __init__(self, entry, method, crc=0, file_size=0, compress_size=0, spool=None):
+		self.entry = entry
+		self.method = method
+		self.crc = crc
+		self.file_size = file_size
+		self.compress_size = compress_size
+		self.spool = spool
+		self.header_offset = None
+
+class parallel_zip_writer(object):
+	"""
+	writes zip archives with the entries compressed in parallel on a thread pool
+		entries are written in the order they are given, so the archive is stable between runs
+		already-compressed file types are STORED instead of deflated
+		supports the zip64 extensions for large archives
+	"""
+	def __init__(self, compresslevel=6, workers=None, stored_extensions=STORED_EXTENSIONS, spool_size=16*1024*1024):
+		self.compresslevel = compresslevel
+		self.workers = workers
+		if self.workers is None:
+			self.workers = os.cpu_count() or 1
+		self.stored_extensions = stored_extensions
+		self.spool_size = spool_size
+
+	def should_store(self, arcname):
+		"""check whether an entry should be STORED rather than deflated, based on its file type"""
+		return os.path.splitext(arcname)[1].lower() in self.stored_extensions
+
+	def compress(self, entry):
+		"""
+		compress a single entry (runs on the worker threads)
+			STORED entries are only checksummed here, and read again when written into the archive
+			deflated entries are kept in a spool file that only goes to disk once it grows past spool_size
+		"""
+		if entry.is_dir:
+			return compressed_entry(entry, ZIP_STORED)
+		crc = 0
+		file_size = 0
+		if self.should_store(entry.arcname):
+			with entry.open() as fp:
+				for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+					crc = zlib.crc32(chunk, crc)
+					file_size = file_size + len(chunk)
+			return compressed_entry(entry, ZIP_STORED, crc=crc, file_size=file_size, compress_size=file_size)
+		spool = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+		compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+		with entry.open() as fp:
+			for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+				crc = zlib.crc32(chunk, crc)
+				file_size = file_size + len(chunk)
+				spool.write(compressor.compress(chunk))
+		spool.write(compressor.flush())
+		compress_size = spool.tell()
+		if compress_size >= file_size:
+			# deflating made it bigger - store it as-is instead
+			spool.close()
+			return compressed_entry(entry, ZIP_STORED, crc=crc, file_size=file_size, compress_size=file_size)
+		spool.seek(0)
+		return compressed_entry(entry, ZIP_DEFLATED, crc=crc, file_size=file_size, compress_size=compress_size, spool=spool)
+
+	@staticmethod
+	def dos_date_time(mtime):
+		"""convert a unix timestamp into the date and time fields of a zip header"""
+		date_time = time.localtime(mtime)
+		year = min(max(date_time.tm_year, 1980), 2107)
+		if year!=date_time.tm_year:
+			return ((year - 1980) << 9 | 1 << 5 | 1, 0)
+		dos_date = (year - 1980) << 9 | date_time.tm_mon << 5 | date_time.tm_mday
+		dos_time = date_time.tm_hour << 11 | date_time.tm_min << 5 | (date_time.tm_sec // 2)
+		return (dos_date, dos_time)
+
+	@staticmethod
+	def encode_name(arcname):
+		"""encode an entry name, returning the name bytes and the general purpose flags it needs"""
+		try:
+			return (arcname.encode('ascii'), 0)
+		except UnicodeEncodeError:
+			return (arcname.encode('utf-8'), 0x800)
+
+	def write_local_header(self, fp, comp):
+		"""write the local file header of an entry at the current position of fp"""
+		comp.header_offset = fp.tell()
+		name, flags = self.encode_name(comp.entry.arcname + ('/' if comp.entry.is_dir else ''))
+		dos_date, dos_time = self.dos_date_time(comp.entry.mtime)
+		extra = b''
+		file_size = comp.file_size
+		compress_size = comp.compress_size
+		version = 20
+		if file_size > ZIP64_LIMIT or compress_size > ZIP64_LIMIT:
+			extra = struct.pack('<HHQQ', 1, 16, file_size, compress_size)
+			file_size = 0xFFFFFFFF
+			compress_size = 0xFFFFFFFF
+			version = 45
+		fp.write(struct.pack('<4sBBHHHHLLLHH', b'PK\003\004', version, 0, flags, comp.method, dos_time, dos_date, comp.crc, compress_size, file_size, len(name), len(extra)))
+		fp.write(name)
+		fp.write(extra)
+
+	def write_central_header(self, fp, comp):
+		"""write the central directory record of an entry at the current position of fp"""
+		name, flags = self.encode_name(comp.entry.arcname + ('/' if comp.entry.is_dir else ''))
+		dos_date, dos_time = self.dos_date_time(comp.entry.mtime)
+		zip64_fields = []
+		file_size = comp.file_size
+		compress_size = comp.compress_size
+		header_offset = comp.header_offset
+		if file_size > ZIP64_LIMIT or compress_size > ZIP64_LIMIT:
+			zip64_fields = zip64_fields + [file_size, compress_size]
+			file_size = 0xFFFFFFFF
+			compress_size = 0xFFFFFFFF
+		if header_offset > ZIP64_LIMIT:
+			zip64_fields.append(header_offset)
+			header_offset = 0xFFFFFFFF
+		extra = b''
+		version = 20
+		if len(zip64_fields) > 0:
+			extra = struct.pack('<HH' + 'Q'*len(zip64_fields), 1, 8*len(zip64_fields), *zip64_fields)
+			version = 45
+		if comp.entry.is_dir:
+			external_attr = (comp.entry.mode & 0xFFFF) << 16 | 0x10
+		else:
+			external_attr = (comp.entry.mode & 0xFFFF) << 16
+		fp.write(struct.pack('<4sBBBBHHHHLLLHHHHHLL', b'PK\001\002', version, CREATE_SYSTEM, version, 0, flags, comp.method, dos_time, dos_date, comp.crc, compress_size, file_size, len(name), len(extra), 0, 0, 0, external_attr, header_offset))
+		fp.write(name)
+		fp.write(extra)
+
+	def write_entry(self, fp, comp):
+		"""write the local header and data of a compressed entry into the archive"""
+		self.write_local_header(fp, comp)
+		if comp.entry.is_dir:
+			return
+		if comp.spool is None:
+			with comp.entry.open() as src_fp:
+				shutil.copyfileobj(src_fp, fp, CHUNK_SIZE)
+		else:
+			shutil.copyfileobj(comp.spool, fp, CHUNK_SIZE)
+			comp.spool.close()
+			comp.spool = None
+
+	def write_end_of_central_dir(self, fp, count, central_dir_offset, central_dir_size):
+		"""write the end of central directory record, including the zip64 records when needed"""
+		if count > ZIP_FILECOUNT_LIMIT or central_dir_offset > ZIP64_LIMIT or central_dir_size > ZIP64_LIMIT:
+			zip64_end_offset = fp.tell()
+			fp.write(struct.pack('<4sQHHLLQQQQ', b'PK\006\006', 44, 45, 45, 0, 0, count, count, central_dir_size, central_dir_offset))
+			fp.write(struct.pack('<4sLQL', b'PK\006\007', 0, zip64_end_offset, 1))
+			count = min(count, 0xFFFF)
+			central_dir_offset = min(central_dir_offset, 0xFFFFFFFF)
+			central_dir_size = min(central_dir_size, 0xFFFFFFFF)
+		fp.write(struct.pack('<4sHHHHLLH', b'PK\005\006', 0, 0, count, count, central_dir_size, central_dir_offset, 0))
+
+	def write(self, archive, entries, tracker=None):
+		"""
+		write the given entries (in order) into a new zip archive at the path archive
+		if a progress tracker is given, every entry written into the archive is reported to it (see progress)
+		"""
+		written = []
+		if not tracker is None:
+			entries = list(entries)
+			tracker.add_total(len([entry for entry in entries if not entry.is_dir]), sum([entry.size for entry in entries]))
+		compress = instrumentation.default_recorder.bind(self.compress)
+		with open(archive, 'wb') as fp:
+			with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+				pending = []
+				for entry in entries:
+					pending.append(executor.submit(compress, entry))
+					# keep a bounded window of entries in flight, so memory stays bounded too
+					while len(pending) > self.workers*2:
+						comp = pending.pop(0).result()
+						self.write_entry(fp, comp)
+						written.append(comp)
+						if not tracker is None and not comp.entry.is_dir:
+							tracker.advance(1, comp.file_size)
+				for future in pending:
+					comp = future.result()
+					self.write_entry(fp, comp)
+					written.append(comp)
+					if not tracker is None and not comp.entry.is_dir:
+						tracker.advance(1, comp.file_size)
+			central_dir_offset = fp.tell()
+			for comp in written:
+				self.write_central_header(fp, comp)
+			central_dir_size = fp.tell() - central_dir_offset
+			self.write_end_of_central_dir(fp, len(written), central_dir_offset, central_dir_size)
+			files = [comp for comp in written if not comp.entry.is_dir]
+			instrumentation.default_recorder.count_read(len(files), sum([comp.file_size for comp in files]))
+			instrumentation.default_recorder.count_written(1, fp.tell())
+
+def write_zip(archive, entries, compresslevel=6, workers=None, tracker=None):
+	"""write the given entries (in order) into a new zip archive, compressing them in parallel (and reporting them to tracker, if given)"""
+	parallel_zip_writer(compresslevel=compresslevel, workers=workers).write(archive, entries, tracker=tracker)
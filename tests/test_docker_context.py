@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from MinecraftModpackPackager import progress
+from MinecraftModpackPackager import docker_context
+from MinecraftModpackPackager.package_modpack import modpack_packager
+
+# stands in for the docker CLI: records the arguments of every call, and remembers the labels of the images it "built"
+STUB_DOCKER = '''#!{python}
+import os
+import sys
+import json
+
+args = sys.argv[1:]
+with open(os.environ['DOCKER_STUB_LOG'], 'a') as fp:
+	fp.write(json.dumps(args) + '\\n')
+state_fname = os.environ['DOCKER_STUB_STATE']
+images = []
+if os.path.isfile(state_fname):
+	with open(state_fname, 'r') as fp:
+		images = json.load(fp)
+if args[0]=='images':
+	label = args[args.index('--filter') + 1][len('label='):]
+	for image in images:
+		if image['label']==label:
+			print(image['id'])
+elif args[0]=='build':
+	image_id = 'sha256:{{:064x}}'.format(len(images) + 1)
+	with open(os.path.join(os.path.dirname(state_fname), 'build-{{}}.tar'.format(len(images) + 1)), 'wb') as fp:
+		fp.write(sys.stdin.buffer.read())
+	images.append({{'id':image_id, 'label':args[args.index('--label') + 1]}})
+	with open(state_fname, 'w') as fp:
+		json.dump(images, fp)
+'''
+
+class docker_server_test(unittest.TestCase):
+	"""package_docker_server against a stub docker executable on PATH"""
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.stub_dir = os.path.join(self.tmp_dir, 'bin')
+		os.makedirs(self.stub_dir)
+		stub_fname = os.path.join(self.stub_dir, 'docker')
+		with open(stub_fname, 'w') as fp:
+			fp.write(STUB_DOCKER.format(python=sys.executable))
+		os.chmod(stub_fname, 0o755)
+		self.log_fname = os.path.join(self.tmp_dir, 'docker_calls.jsonl')
+		self.saved_environ = dict(os.environ)
+		os.environ['PATH'] = self.stub_dir + os.pathsep + os.environ.get('PATH', '')
+		os.environ['DOCKER_STUB_LOG'] = self.log_fname
+		os.environ['DOCKER_STUB_STATE'] = os.path.join(self.tmp_dir, 'images.json')
+		self.saved_handlers = progress.default_reporter.handlers
+		progress.default_reporter.set_handlers([progress.silent_handler()])
+		self.context_dir = os.path.join(self.tmp_dir, 'server')
+		os.makedirs(os.path.join(self.context_dir, 'mods'))
+		self.write_context_file('Dockerfile', 'FROM scratch\nCOPY . /server\n')
+		self.write_context_file(os.path.join('mods', 'ExampleMod.jar'), 'jar contents')
+		self.write_context_file('ServerStart.py', 'print("starting")\n')
+
+	def tearDown(self):
+		progress.default_reporter.set_handlers(self.saved_handlers)
+		os.environ.clear()
+		os.environ.update(self.saved_environ)
+		shutil.rmtree(self.tmp_dir)
+
+	def write_context_file(self, rel_path, contents):
+		"""write a file into the server package directory the image is built from"""
+		with open(os.path.join(self.context_dir, rel_path), 'w') as fp:
+			fp.write(contents)
+
+	def package(self):
+		"""run package_docker_server on the server package directory, returning the docker commands it ran"""
+		packager = modpack_packager(modpack_name='ExamplePack', modpack_version='1.0.0', packages_dir=self.tmp_dir, client_info_fname=None)
+		packager.package_server_dir = self.context_dir
+		if os.path.isfile(self.log_fname):
+			os.remove(self.log_fname)
+		packager.package_docker_server()
+		with open(self.log_fname, 'r') as fp:
+			return [json.loads(line) for line in fp]
+
+	def commands(self, calls):
+		"""the docker subcommands of a list of calls"""
+		return [args[0] for args in calls]
+
+	def test_first_run_builds(self):
+		calls = self.package()
+		self.assertEqual(self.commands(calls), ['--version', 'images', 'build', 'tag'])
+		build_args = calls[2]
+		self.assertEqual(build_args[-1], '-')
+		self.assertIn('examplepack:1.0.0', build_args)
+		self.assertIn('{label}={digest}'.format(label=docker_context.CONTEXT_DIGEST_LABEL, digest=docker_context.context_digest(docker_context.list_context(self.context_dir))), build_args)
+		self.assertEqual(calls[3], ['tag', 'examplepack:1.0.0', 'examplepack:latest'])
+		with tarfile.open(os.path.join(self.tmp_dir, 'build-1.tar'), 'r') as tar:
+			self.assertEqual(sorted(tar.getnames()), ['Dockerfile', 'ServerStart.py', 'mods', 'mods/ExampleMod.jar'])
+			self.assertTrue(all([member.mtime==0 and member.uid==0 for member in tar.getmembers()]))
+
+	def test_unchanged_context_only_tags(self):
+		self.package()
+		calls = self.package()
+		self.assertEqual(self.commands(calls), ['--version', 'images', 'tag', 'tag'])
+		self.assertEqual(calls[2], ['tag', 'sha256:{:064x}'.format(1), 'examplepack:1.0.0'])
+		self.assertEqual(calls[3], ['tag', 'examplepack:1.0.0', 'examplepack:latest'])
+
+	def test_changed_file_rebuilds(self):
+		self.package()
+		self.write_context_file(os.path.join('mods', 'ExampleMod.jar'), 'updated jar contents')
+		calls = self.package()
+		self.assertEqual(self.commands(calls), ['--version', 'images', 'build', 'tag'])
+		self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, 'build-2.tar')))
+
+if __name__=='__main__':
+	unittest.main()
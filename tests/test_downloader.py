@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+import http.server
+
+import requests
+
+from MinecraftModpackPackager import downloader
+
+DATA = bytes(range(256)) * 4096 + b'tail'
+
+class file_handler(http.server.BaseHTTPRequestHandler):
+	"""
+	serves DATA at every path but /missing, with the ETag the server says
+	honors Range requests (when If-Range matches the ETag) only if the server says so
+	"""
+	def log_message(self, format, *args):
+		pass
+
+	def do_GET(self):
+		self.server.requests.append(dict(self.headers))
+		if self.path=='/missing':
+			self.send_error(404)
+			return
+		start = 0
+		range_header = self.headers.get('Range')
+		if self.server.supports_range and not range_header is None and self.headers.get('If-Range', self.server.etag)==self.server.etag:
+			start = int(range_header[len('bytes='):].rstrip('-'))
+			if start >= len(DATA):
+				self.send_response(416)
+				self.send_header('Content-Length', '0')
+				self.end_headers()
+				return
+			if self.server.ignore_range_start:
+				# a broken server or proxy that answers a range with a different part of the file than asked for
+				start = 0
+			self.send_response(206)
+			self.send_header('Content-Range', 'bytes {start}-{end}/{size}'.format(start=start, end=len(DATA)-1, size=len(DATA)))
+		else:
+			self.send_response(200)
+		self.send_header('ETag', self.server.etag)
+		body = DATA[start:]
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		if not self.server.cut_after is None:
+			# drop the connection part way through, like a download interrupted by the network
+			body = body[:self.server.cut_after]
+			self.server.cut_after = None
+		# counted before writing, since the client may check the count as soon as it has read the body
+		self.server.bytes_sent += len(body)
+		self.wfile.write(body)
+
+class downloader_test(unittest.TestCase):
+	"""downloader.download against a local http.server"""
+	def setUp(self):
+		self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), file_handler)
+		self.server.supports_range = True
+		self.server.ignore_range_start = False
+		self.server.etag = '"v1"'
+		self.server.cut_after = None
+		self.server.requests = []
+		self.server.bytes_sent = 0
+		self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self.server_thread.start()
+		self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+		self.tmp_dir = tempfile.mkdtemp()
+		self.filename = os.path.join(self.tmp_dir, 'forge-installer.jar')
+		self.downloader = downloader.downloader(chunk_size=64*1024, timeout=10)
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		shutil.rmtree(self.tmp_dir)
+
+	def write_part(self, contents, validator='"v1"'):
+		"""leave a partial download behind, as an interrupted run would, along with the ETag of the file it was part of"""
+		with open(self.filename + '.part', 'wb') as fp:
+			fp.write(contents)
+		if not validator is None:
+			with open(self.filename + '.part.validator', 'w') as fp:
+				fp.write(validator)
+
+	def assert_no_part(self):
+		"""check that neither the partial file nor its validator were left behind"""
+		self.assertFalse(os.path.exists(self.filename + '.part'))
+		self.assertFalse(os.path.exists(self.filename + '.part.validator'))
+
+	def read_file(self):
+		"""the contents of the finished download"""
+		with open(self.filename, 'rb') as fp:
+			return fp.read()
+
+	def test_range_resume(self):
+		self.write_part(DATA[:100000])
+		self.downloader.download(self.base_url + '/file', self.filename, expected_hash='sha256:' + hashlib.sha256(DATA).hexdigest())
+		self.assertEqual(self.server.requests[0].get('Range'), 'bytes=100000-')
+		self.assertEqual(self.server.requests[0].get('If-Range'), '"v1"')
+		self.assertEqual(self.server.bytes_sent, len(DATA) - 100000)
+		self.assertEqual(self.read_file(), DATA)
+		self.assert_no_part()
+
+	def test_interrupted_download_resumes(self):
+		self.server.cut_after = 200000
+		with self.assertRaises(Exception):
+			self.downloader.download(self.base_url + '/file', self.filename)
+		self.assertFalse(os.path.exists(self.filename))
+		self.assertTrue(os.path.isfile(self.filename + '.part.validator'))
+		# only whole chunks reach the partial file, so it may hold less than was received
+		part_size = os.path.getsize(self.filename + '.part')
+		self.assertTrue(0 < part_size <= 200000)
+		self.downloader.download(self.base_url + '/file', self.filename)
+		self.assertEqual(self.server.requests[-1].get('Range'), 'bytes={}-'.format(part_size))
+		self.assertEqual(self.read_file(), DATA)
+		self.assert_no_part()
+
+	def test_server_without_range_restarts(self):
+		self.server.supports_range = False
+		# contents that differ from DATA, so keeping any of them would show in the result
+		self.write_part(b'x' * 100000)
+		self.downloader.download(self.base_url + '/file', self.filename, expected_hash='sha1:' + hashlib.sha1(DATA).hexdigest())
+		self.assertEqual(self.server.requests[0].get('Range'), 'bytes=100000-')
+		self.assertEqual(self.read_file(), DATA)
+		self.assert_no_part()
+
+	def test_changed_file_restarts(self):
+		# the partial file is of an older version of the file, which the server no longer has
+		self.write_part(b'x' * 100000, validator='"v0"')
+		self.downloader.download(self.base_url + '/file', self.filename)
+		self.assertEqual(self.server.requests[0].get('If-Range'), '"v0"')
+		self.assertEqual(len(self.server.requests), 1)
+		self.assertEqual(self.read_file(), DATA)
+		self.assert_no_part()
+
+	def test_part_without_validator_restarts(self):
+		self.write_part(b'x' * 100000, validator=None)
+		self.downloader.download(self.base_url + '/file', self.filename)
+		self.assertIsNone(self.server.requests[0].get('Range'))
+		self.assertEqual(self.read_file(), DATA)
+
+	def test_wrong_content_range_restarts(self):
+		self.server.ignore_range_start = True
+		self.write_part(b'x' * 100000)
+		self.downloader.download(self.base_url + '/file', self.filename)
+		self.assertEqual([request.get('Range') for request in self.server.requests], ['bytes=100000-', None])
+		self.assertEqual(self.read_file(), DATA)
+		self.assert_no_part()
+
+	def test_unsatisfiable_range_restarts(self):
+		self.write_part(b'x' * (len(DATA) + 1))
+		self.downloader.download(self.base_url + '/file', self.filename)
+		self.assertEqual([request.get('Range') for request in self.server.requests], ['bytes={}-'.format(len(DATA) + 1), None])
+		self.assertEqual(self.read_file(), DATA)
+		self.assert_no_part()
+
+	def test_hash_mismatch(self):
+		with self.assertRaisesRegex(Exception, 'expected 00'):
+			self.downloader.download(self.base_url + '/file', self.filename, expected_hash='sha256:00')
+		self.assertFalse(os.path.exists(self.filename))
+		self.assert_no_part()
+
+	def test_http_error(self):
+		with self.assertRaises(requests.exceptions.HTTPError):
+			self.downloader.download(self.base_url + '/missing', self.filename)
+		self.assertFalse(os.path.exists(self.filename))
+		self.assert_no_part()
+
+if __name__=='__main__':
+	unittest.main()